@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import asyncio
+from collections import Counter, defaultdict
+from typing import Optional
+from aiohttp import web
+
+BOT_USER = {'id': 999000, 'is_bot': True, 'first_name': 'VortexBench', 'username': 'vortex_bench_bot'}
+
+
+class BadRequest(Exception):
+    """Answered like Telegram's "400 Bad Request" errors."""
+
+
+class FakeTelegramAPI:
+    """
+    A local stand-in for the Bot API: answers the methods the bot uses, keeps the messages it
+    sends per chat, and serves files registered with `add_file` to getFile and file downloads.
+
+    Uploads are read completely, so the bot pays the real cost of sending them; `latency` adds a
+    fixed delay to every call and `upload_rate` (bytes per second, 0 = unlimited) simulates the
+    time Telegram takes to receive an upload.
+    """
+
+    def __init__(self, token: str, latency: float = 0.0, upload_rate: float = 0.0):
+        self.token = token
+        self.latency = latency
+        self.upload_rate = upload_rate
+        self.calls: Counter = Counter()
+        self.uploaded_bytes = 0
+        self.uploads = 0
+        self.webhook_set = asyncio.Event()
+        self._next_message_id = 0
+        self._messages: dict[tuple[int, int], dict] = {}
+        # chat id -> callback data of the inline buttons sent to it, with the message carrying them.
+        self._buttons: dict[int, list[tuple[str, dict]]] = defaultdict(list)
+        self._button_added = asyncio.Condition()
+        self._sent: dict[tuple[int, str], list[float]] = defaultdict(list)
+        self._files: dict[str, str] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_file(self, file_id: str, path: str) -> None:
+        """Makes `path` downloadable by the bot as the Telegram file `file_id`."""
+        self._files[file_id] = path
+
+    async def take_button(self, chat_id: int, prefix: str, timeout: float) -> Optional[tuple[str, dict]]:
+        """
+        Waits until a button whose callback data starts with `prefix` has been sent to the chat and
+        returns (callback data, message carrying it); each button is returned once.
+        """
+        def find():
+            return next((entry for entry in self._buttons[chat_id] if entry[0].startswith(prefix)), None)
+
+        async with self._button_added:
+            try:
+                entry = await asyncio.wait_for(self._button_added.wait_for(find), timeout)
+            except asyncio.TimeoutError:
+                return None
+            self._buttons[chat_id].remove(entry)
+            return entry
+
+    def sent_since(self, chat_id: int, method: str, since: float) -> bool:
+        """Tells whether `method` (e.g. 'sendVideo') delivered something to the chat since `since`."""
+        return any(sent >= since for sent in self._sent[(chat_id, method)])
+
+    # --- Messages ---
+
+    def _new_message(self, chat_id: int, **fields) -> dict:
+        self._next_message_id += 1
+        message = {
+            'message_id': self._next_message_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER, **fields,
+        }
+        self._messages[(chat_id, message['message_id'])] = message
+        return message
+
+    async def _remember_buttons(self, message: dict) -> None:
+        rows = (message.get('reply_markup') or {}).get('inline_keyboard') or []
+        data = [button['callback_data'] for row in rows for button in row if button.get('callback_data')]
+        if data:
+            async with self._button_added:
+                self._buttons[message['chat']['id']].extend((item, message) for item in data)
+                self._button_added.notify_all()
+
+    async def _upload(self, value) -> Optional[dict]:
+        """Returns the media object of an uploaded (or re-sent by file_id) file."""
+        if isinstance(value, web.FileField):
+            size = len(value.file.read())
+            self.uploaded_bytes += size
+            if self.upload_rate:
+                await asyncio.sleep(size / self.upload_rate)
+            self.uploads += 1
+            file_id = f"upload{self.uploads}"
+            return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': size}
+        return {'file_id': str(value), 'file_unique_id': str(value)}
+
+    # --- Bot API methods ---
+
+    async def _call(self, method: str, params: dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('setWebhook', 'deleteWebhook'):
+            if method == 'setWebhook':
+                self.webhook_set.set()
+            return True
+        if method == 'getFile':
+            file_id = params['file_id']
+            path = self._files.get(file_id)
+            if not path:
+                raise BadRequest("Bad Request: invalid file_id")
+            return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': os.path.getsize(path), 'file_path': file_id}
+
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        reply_markup = json.loads(params['reply_markup']) if isinstance(params.get('reply_markup'), str) else None
+        if method == 'sendMessage':
+            message = self._new_message(chat_id, text=params.get('text', ''))
+        elif method in ('sendVideo', 'sendAudio', 'sendDocument', 'sendVoice'):
+            field = method[4:].lower()
+            message = self._new_message(chat_id, caption=params.get('caption', ''), **{field: await self._upload(params[field])})
+            self._sent[(chat_id, method)].append(time.time())
+        elif method in ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'):
+            message = self._messages.get((chat_id, int(params['message_id'])))
+            if message is None:
+                message = self._new_message(chat_id)
+            if 'text' in params:
+                message['text'] = params['text']
+            if 'caption' in params:
+                message['caption'] = params['caption']
+        else:
+            # deleteMessage, answerCallbackQuery, setMyCommands, sendChatAction, ...
+            return True
+        if reply_markup is not None:
+            message['reply_markup'] = reply_markup
+            await self._remember_buttons(message)
+        return message
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        if request.match_info['token'] != self.token:
+            return web.json_response({'ok': False, 'error_code': 401, 'description': 'Unauthorized'}, status=401)
+        method = request.match_info['method']
+        self.calls[method] += 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            result = await self._call(method, params)
+        except BadRequest as e:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': str(e)}, status=400)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _handle_file(self, request: web.Request) -> web.StreamResponse:
+        path = self._files.get(request.match_info['file_path'])
+        if request.match_info['token'] != self.token or not path:
+            return web.Response(status=404)
+        return web.FileResponse(path)
+
+    async def start(self, host: str, port: int) -> None:
+        app = web.Application(client_max_size=4 * 1024 ** 3)
+        app.router.add_post('/bot{token}/{method}', self._handle_method)
+        app.router.add_get('/file/bot{token}/{file_path}', self._handle_file)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,51 @@
+import os
+import subprocess
+
+# A test pattern with a tone: real H.264/AAC streams, so downloads, Shazam windows and audio
+# extraction do the same work as with real media.
+VIDEO_ARGS = [
+    '-f', 'lavfi', '-i', 'testsrc2=size=640x360:rate=25',
+    '-f', 'lavfi', '-i', 'sine=frequency=440:beep_factor=4:sample_rate=44100',
+    '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', '1M', '-pix_fmt', 'yuv420p',
+    '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart', '-f', 'mp4',
+]
+# Beeps over pink noise as an Opus voice note; Whisper decodes it like any other audio.
+VOICE_ARGS = [
+    '-f', 'lavfi', '-i', 'sine=frequency=300:beep_factor=6:sample_rate=48000',
+    '-f', 'lavfi', '-i', 'anoisesrc=color=pink:amplitude=0.05:sample_rate=48000',
+    '-filter_complex', 'amix=inputs=2:duration=first',
+    '-c:a', 'libopus', '-b:a', '32k', '-ac', '1', '-f', 'ogg',
+]
+# The "YouTube video" of the stubbed Shazam matches, downloaded by the song button.
+SONG_NAME = 'song.m4a'
+SONG_SECONDS = 180
+SONG_ARGS = [
+    '-f', 'lavfi', '-i', 'sine=frequency=220:beep_factor=2:sample_rate=44100',
+    '-c:a', 'aac', '-b:a', '192k', '-f', 'ipod',
+]
+
+
+def video_name(seconds: int) -> str:
+    return f"video_{seconds}s.mp4"
+
+
+def voice_name(seconds: int) -> str:
+    return f"voice_{seconds}s.ogg"
+
+
+def _generate(path: str, args: list[str], seconds: float) -> None:
+    if os.path.exists(path):
+        return
+    partial = path + '.part'
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', *args, '-t', str(seconds), partial], check=True)
+    os.replace(partial, path)
+
+
+def generate_fixtures(directory: str, video_lengths: list[int], voice_lengths: list[int]) -> None:
+    """Creates the fixture files that are missing (existing ones are reused between runs)."""
+    os.makedirs(directory, exist_ok=True)
+    for seconds in video_lengths:
+        _generate(os.path.join(directory, video_name(seconds)), VIDEO_ARGS, seconds)
+    for seconds in voice_lengths:
+        _generate(os.path.join(directory, voice_name(seconds)), VOICE_ARGS, seconds)
+    _generate(os.path.join(directory, SONG_NAME), SONG_ARGS, SONG_SECONDS)
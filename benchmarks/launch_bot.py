@@ -0,0 +1,18 @@
+"""
+Runs bot.py for the benchmark (see benchmarks/run.py) with Shazam stubbed out.
+
+Media worker processes are started with the 'spawn' method, which imports this script again
+in every child process, so the stub is installed there as well.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import stubs
+
+stubs.install()
+
+if __name__ == '__main__':
+    import bot
+    bot.main()
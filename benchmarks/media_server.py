@@ -0,0 +1,30 @@
+from typing import Optional
+from aiohttp import web
+
+
+class MediaServer:
+    """
+    Serves the fixture directory over HTTP for yt-dlp's generic extractor (direct file links,
+    with Range support). The query string is ignored, so every request can use a unique URL
+    and bypass the bot's result cache while downloading the same file.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.base_url = ''
+        self._runner: Optional[web.AppRunner] = None
+
+    def url(self, name: str, tag: str = '') -> str:
+        return f"{self.base_url}/{name}" + (f"?r={tag}" if tag else '')
+
+    async def start(self, host: str, port: int) -> None:
+        app = web.Application()
+        app.router.add_static('/', self.directory)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.base_url = f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
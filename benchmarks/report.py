@@ -0,0 +1,141 @@
+import re
+import math
+import statistics
+from collections import defaultdict
+from typing import Optional
+
+from utils.metrics import histogram_quantile
+
+_SAMPLE_RE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+_LABEL_RE = re.compile(r'(\w+)="([^"]*)"')
+
+
+def parse_histograms(text: str) -> dict[str, dict]:
+    """
+    Reads the histograms of a Prometheus text exposition into
+    {name: {'buckets': [bounds], 'series': {labels (sorted tuple of pairs): [per-bucket counts]}}}.
+    """
+    cumulative: dict[str, dict[tuple, dict[float, float]]] = defaultdict(lambda: defaultdict(dict))
+    for line in text.splitlines():
+        match = _SAMPLE_RE.match(line)
+        if not match or not match.group(1).endswith('_bucket'):
+            continue
+        labels = dict(_LABEL_RE.findall(match.group(2) or ''))
+        bound = float(labels.pop('le'))
+        cumulative[match.group(1)[:-len('_bucket')]][tuple(sorted(labels.items()))][bound] = float(match.group(3))
+    histograms = {}
+    for name, series in cumulative.items():
+        bounds = sorted(next(iter(series.values())))
+        histograms[name] = {'buckets': [bound for bound in bounds if not math.isinf(bound)], 'series': {}}
+        for labels, values in series.items():
+            counts, previous = [], 0.0
+            for bound in bounds:
+                counts.append(values[bound] - previous)
+                previous = values[bound]
+            histograms[name]['series'][labels] = counts
+    return histograms
+
+
+def _quantiles(buckets: list[float], counts: list[float]) -> dict:
+    return {
+        'count': int(sum(counts)),
+        'p50': histogram_quantile(0.5, buckets, counts),
+        'p95': histogram_quantile(0.95, buckets, counts),
+    }
+
+
+def histogram_summary(histogram: Optional[dict], group_by: tuple[str, ...], **match) -> dict:
+    """p50/p95 of a parsed histogram per value(s) of the `group_by` labels, over series matching `match`."""
+    if not histogram:
+        return {}
+    grouped = defaultdict(lambda: [0.0] * (len(histogram['buckets']) + 1))
+    for labels, counts in histogram['series'].items():
+        labels = dict(labels)
+        if any(labels.get(name) != value for name, value in match.items()):
+            continue
+        key = '/'.join(labels.get(name) or '-' for name in group_by)
+        grouped[key] = [a + b for a, b in zip(grouped[key], counts)]
+    return {key: _quantiles(histogram['buckets'], counts) for key, counts in sorted(grouped.items())}
+
+
+def latency_summary(samples: list[float]) -> dict:
+    """Exact p50/p95/max of end-to-end latencies measured by the harness."""
+    if not samples:
+        return {'p50': None, 'p95': None, 'max': None}
+    ordered = sorted(samples)
+    return {
+        'p50': statistics.median(ordered),
+        'p95': ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.95) - 1)],
+        'max': ordered[-1],
+    }
+
+
+def flatten(report: dict, prefix: str = '') -> dict[str, float]:
+    """Numeric values of a report as {'dotted.key': value}, for comparison with a baseline."""
+    values = {}
+    for key, value in report.items():
+        if key in ('config', 'api_calls'):
+            continue
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def _higher_is_better(key: str) -> bool:
+    return 'throughput' in key or key.endswith('.ok')
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> tuple[list[str], list[str]]:
+    """Returns the comparison table and the keys that got worse than the baseline by more than `tolerance`."""
+    current, previous = flatten(report), flatten(baseline)
+    lines = [f"{'metric':<48} {'baseline':>12} {'current':>12} {'change':>9}"]
+    regressions = []
+    for key in sorted(current.keys() & previous.keys()):
+        # Sample counts describe the workload, not its speed.
+        if key.endswith('.count'):
+            continue
+        old, new = previous[key], current[key]
+        change = (new - old) / old if old else 0.0
+        worse = -change if _higher_is_better(key) else change
+        marker = ''
+        if worse > tolerance:
+            marker = '  << worse'
+            regressions.append(key)
+        elif worse < -tolerance:
+            marker = '  better'
+        lines.append(f"{key:<48} {old:>12.3f} {new:>12.3f} {change:>+8.1%}{marker}")
+    return lines, regressions
+
+
+def _seconds(value: Optional[float]) -> str:
+    return '-' if value is None else f"{value:.2f}s"
+
+
+def format_report(report: dict) -> str:
+    """A human-readable summary of a report."""
+    lines = [
+        f"Wall time: {report['wall_seconds']:.1f}s, throughput: {report['throughput_per_minute']:.1f} requests/min",
+        f"Peak RSS: {report['peak_rss_mb']:.0f} MB, peak disk: {report['peak_disk_mb']:.0f} MB, "
+        f"uploaded: {report['uploaded_mb']:.0f} MB",
+        "",
+        "End-to-end (request sent -> job finished):",
+    ]
+    for kind, entry in report['requests'].items():
+        lines.append(
+            f"  {kind:<12} ok {entry['ok']:>4}  failed {entry['failed']:>4}  "
+            f"p50 {_seconds(entry['p50'])}  p95 {_seconds(entry['p95'])}  max {_seconds(entry['max'])}"
+        )
+    for title, key in (("Queue wait / run per job type:", 'jobs'), ("Stages:", 'stages')):
+        if report.get(key):
+            lines.append("")
+            lines.append(title)
+            for name, entry in report[key].items():
+                lines.append(f"  {name:<32} n {entry['count']:>5}  p50 {_seconds(entry['p50'])}  p95 {_seconds(entry['p95'])}")
+    if report.get('whisper_rtf'):
+        lines.append("")
+        for model, entry in report['whisper_rtf'].items():
+            lines.append(f"Whisper RTF ({model}): p50 {entry['p50']:.2f}, p95 {entry['p95']:.2f} (n {entry['count']})")
+    return "\n".join(lines)
@@ -0,0 +1,395 @@
+"""
+Offline end-to-end benchmark: runs the real bot (webhook mode, media worker processes, yt-dlp,
+ffmpeg, Whisper) against a fake Telegram Bot API, a local media server and a stubbed Shazam,
+with many simulated users at once.
+
+    python -m benchmarks.run --users 20 --save-baseline baseline.json
+    python -m benchmarks.run --users 20 --baseline baseline.json
+
+Needs ffmpeg (for the fixtures and the bot) and the Whisper model; Linux only (RSS is read from /proc).
+"""
+import os
+import sys
+import json
+import time
+import signal
+import shutil
+import sqlite3
+import asyncio
+import argparse
+import itertools
+import subprocess
+from collections import defaultdict
+from typing import Optional
+from aiohttp import ClientSession, ClientTimeout
+
+from benchmarks import fixtures
+from benchmarks.fake_telegram import FakeTelegramAPI
+from benchmarks.media_server import MediaServer
+from benchmarks.report import parse_histograms, histogram_summary, latency_summary, format_report, compare
+
+HOST = '127.0.0.1'
+TOKEN = '123456:bench'
+LAUNCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'launch_bot.py')
+# Simulated users get ids from here on; the warm-up user comes just before them.
+FIRST_USER_ID = 10_000
+# How often the harness samples memory and disk use, and polls the bot database for finished jobs.
+SAMPLE_INTERVAL = 0.25
+POLL_INTERVAL = 0.2
+METRICS_FLUSH_INTERVAL = 1.0
+
+
+def _process_tree(root: int) -> list[int]:
+    children = defaultdict(list)
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces and parentheses; the fields after it do not.
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(entry))
+    tree, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        tree.append(pid)
+        pending.extend(children[pid])
+    return tree
+
+
+def tree_rss(root: int) -> int:
+    """Resident memory of a process and all its descendants, in bytes."""
+    total = 0
+    for pid in _process_tree(root):
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def disk_usage(path: str) -> int:
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+class JobTracker:
+    """Resolves a waiting request when the bot's database shows its job finished."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._waiters: dict[tuple[int, str], tuple[float, asyncio.Future]] = {}
+        self._seen: set[int] = set()
+
+    def wait(self, user_id: int, kind: str, since: float) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[(user_id, kind)] = (since, future)
+        return future
+
+    def _finished_jobs(self, since: float) -> list[tuple]:
+        if not os.path.exists(self.db_path):
+            return []
+        with sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=5) as conn:
+            return conn.execute(
+                "SELECT job_id, kind, user_id, status, created_at, updated_at FROM jobs "
+                "WHERE status IN ('done', 'failed') AND updated_at >= ?", (since,)
+            ).fetchall()
+
+    async def run(self) -> None:
+        cursor = 0.0
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            if not self._waiters:
+                continue
+            checked = time.time()
+            try:
+                rows = await asyncio.to_thread(self._finished_jobs, cursor - 5)
+            except sqlite3.Error:
+                continue
+            cursor = checked
+            for job_id, kind, user_id, status, created_at, updated_at in rows:
+                if job_id in self._seen:
+                    continue
+                waiter = self._waiters.get((user_id, kind))
+                if waiter and created_at >= waiter[0] - 1:
+                    self._seen.add(job_id)
+                    del self._waiters[(user_id, kind)]
+                    if not waiter[1].done():
+                        waiter[1].set_result((status, updated_at))
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.workdir = os.path.abspath(args.workdir)
+        self.fixture_dir = os.path.join(self.workdir, 'fixtures')
+        self.run_dir = os.path.join(self.workdir, 'run')
+        self.tg_port, self.media_port, self.webhook_port, self.metrics_port = (args.base_port + i for i in range(4))
+        self.telegram = FakeTelegramAPI(TOKEN, latency=args.api_latency, upload_rate=args.upload_mbps * 125_000)
+        self.media = MediaServer(self.fixture_dir)
+        self.tracker = JobTracker(os.path.join(self.run_dir, 'bot_users.db'))
+        self.results: dict[str, list[tuple[bool, float]]] = defaultdict(list)
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._update_ids = itertools.count(1)
+        self._session: Optional[ClientSession] = None
+        self._process: Optional[asyncio.subprocess.Process] = None
+
+    # --- Updates sent to the bot ---
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"}
+
+    def _message(self, user_id: int, **fields) -> dict:
+        update_id = next(self._update_ids)
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': 1_000_000 + update_id, 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id), **fields,
+            },
+        }
+
+    def _voice_message(self, user_id: int, seconds: int) -> dict:
+        file_id = fixtures.voice_name(seconds)
+        size = os.path.getsize(os.path.join(self.fixture_dir, file_id))
+        voice = {'file_id': file_id, 'file_unique_id': file_id, 'duration': seconds, 'mime_type': 'audio/ogg', 'file_size': size}
+        return self._message(user_id, voice=voice)
+
+    def _callback_query(self, user_id: int, data: str, message: dict) -> dict:
+        update_id = next(self._update_ids)
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id), 'from': self._user(user_id), 'chat_instance': str(user_id),
+                'data': data, 'message': message,
+            },
+        }
+
+    async def _request(self, kind: str, user_id: int, update: dict, delivered_by: Optional[str], measured: bool) -> bool:
+        """Sends an update and waits for its job; returns whether the user got the result."""
+        sent = time.time()
+        finished = self.tracker.wait(user_id, kind, sent)
+        async with self._session.post(f"http://{HOST}:{self.webhook_port}/telegram", json=update) as response:
+            response.raise_for_status()
+        try:
+            status, finished_at = await asyncio.wait_for(finished, self.args.request_timeout)
+        except asyncio.TimeoutError:
+            status, finished_at = 'timeout', time.time()
+        ok = status == 'done' and (delivered_by is None or self.telegram.sent_since(user_id, delivered_by, sent))
+        if measured:
+            self.results[kind].append((ok, finished_at - sent))
+        return ok
+
+    async def _simulate_user(self, index: int, user_id: int, measured: bool = True) -> None:
+        args = self.args
+        for number in range(args.downloads):
+            seconds = args.video_lengths[(index + number) % len(args.video_lengths)]
+            # A unique URL per request, so results are not answered from the bot's cache.
+            url = self.media.url(fixtures.video_name(seconds), tag=f"{user_id}-{number}-{measured}")
+            ok = await self._request('download', user_id, self._message(user_id, text=url), 'sendVideo', measured)
+            if ok and number < args.songs:
+                button = await self.telegram.take_button(user_id, 'dl_song_', timeout=30)
+                if button:
+                    await self._request('song', user_id, self._callback_query(user_id, *button), 'sendAudio', measured)
+                elif measured:
+                    self.results['song'].append((False, 0.0))
+        for number in range(args.transcriptions):
+            seconds = args.voice_lengths[(index + number) % len(args.voice_lengths)]
+            await self._request('transcribe', user_id, self._voice_message(user_id, seconds), None, measured)
+
+    # --- Bot process ---
+
+    def _bot_env(self) -> dict:
+        env = {
+            **os.environ,
+            'TELEGRAM_BOT_TOKEN': TOKEN,
+            'ADMIN_ID': '1',
+            'BOT_API_BASE_URL': f"http://{HOST}:{self.tg_port}/bot",
+            'BOT_API_BASE_FILE_URL': f"http://{HOST}:{self.tg_port}/file/bot",
+            'BOT_API_LOCAL_MODE': 'false',
+            'WEBHOOK_URL': f"http://{HOST}:{self.webhook_port}",
+            'WEBHOOK_LISTEN': HOST,
+            'WEBHOOK_PORT': str(self.webhook_port),
+            'WEBHOOK_PATH': '/telegram',
+            'WEBHOOK_SECRET': '',
+            'BOT_PROCESSES': '1',
+            'BOT_WORKER_URLS': '',
+            'JOB_QUEUE_BACKEND': 'sqlite',
+            'METRICS_HOST': HOST,
+            'METRICS_PORT': str(self.metrics_port),
+            'METRICS_FLUSH_INTERVAL': str(METRICS_FLUSH_INTERVAL),
+            'YOUTUBE_COOKIE_FILE': '',
+            'INSTAGRAM_COOKIE_FILE': '',
+            'BENCH_SONG_URL': self.media.url(fixtures.SONG_NAME),
+            'BENCH_SHAZAM_LATENCY': str(self.args.shazam_latency),
+            'BENCH_SHAZAM_HIT_RATE': str(self.args.shazam_hit_rate),
+        }
+        for item in self.args.env:
+            key, _, value = item.partition('=')
+            env[key] = value
+        return env
+
+    async def _start_bot(self) -> None:
+        # A fresh database and download directory for every run; fixtures are kept.
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+        log = open(os.path.join(self.run_dir, 'bot.log'), 'wb')
+        self._process = await asyncio.create_subprocess_exec(
+            sys.executable, LAUNCHER, cwd=self.run_dir, env=self._bot_env(), stdout=log, stderr=subprocess.STDOUT
+        )
+        log.close()
+        exited = asyncio.create_task(self._process.wait())
+        ready = asyncio.create_task(self.telegram.webhook_set.wait())
+        await asyncio.wait({exited, ready}, timeout=self.args.startup_timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not ready.done():
+            ready.cancel()
+            raise RuntimeError(f"The bot did not start; see {os.path.join(self.run_dir, 'bot.log')}")
+
+    async def _stop_bot(self) -> None:
+        if self._process and self._process.returncode is None:
+            self._process.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(self._process.wait(), 60)
+            except asyncio.TimeoutError:
+                self._process.kill()
+
+    async def _sample(self) -> None:
+        downloads = os.path.join(self.run_dir, 'downloads')
+        while True:
+            self.peak_rss = max(self.peak_rss, await asyncio.to_thread(tree_rss, self._process.pid))
+            self.peak_disk = max(self.peak_disk, await asyncio.to_thread(disk_usage, downloads))
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    async def _scrape_metrics(self) -> dict:
+        # Media workers publish their metrics every METRICS_FLUSH_INTERVAL.
+        await asyncio.sleep(3 * METRICS_FLUSH_INTERVAL)
+        async with self._session.get(f"http://{HOST}:{self.metrics_port}/metrics") as response:
+            return parse_histograms(await response.text())
+
+    # --- Run ---
+
+    def _build_report(self, wall: float, histograms: dict) -> dict:
+        requests = {}
+        for kind, results in self.results.items():
+            latencies = [latency for ok, latency in results if ok]
+            requests[kind] = {'ok': len(latencies), 'failed': len(results) - len(latencies), **latency_summary(latencies)}
+        completed = sum(entry['ok'] for entry in requests.values())
+        stages = histograms.get('vortex_stage_duration_seconds')
+        jobs = histograms.get('vortex_job_duration_seconds')
+        return {
+            'config': {key: value for key, value in vars(self.args).items() if key not in ('baseline', 'save_baseline', 'output')},
+            'wall_seconds': wall,
+            'throughput_per_minute': completed / wall * 60 if wall else 0.0,
+            'requests': requests,
+            'jobs': {
+                **{f"{kind} wait": entry for kind, entry in histogram_summary(jobs, ('kind',), phase='wait').items()},
+                **{f"{kind} run": entry for kind, entry in histogram_summary(jobs, ('kind',), phase='run').items()},
+            },
+            'stages': histogram_summary(stages, ('stage', 'platform')),
+            'whisper_rtf': histogram_summary(histograms.get('vortex_whisper_real_time_factor'), ('model', 'beam')),
+            'peak_rss_mb': self.peak_rss / 1024 ** 2,
+            'peak_disk_mb': self.peak_disk / 1024 ** 2,
+            'uploaded_mb': self.telegram.uploaded_bytes / 1024 ** 2,
+            'api_calls': dict(self.telegram.calls),
+        }
+
+    async def run(self) -> dict:
+        args = self.args
+        print(f"Generating fixtures in {self.fixture_dir}...")
+        await asyncio.to_thread(fixtures.generate_fixtures, self.fixture_dir, args.video_lengths, args.voice_lengths)
+        for seconds in args.voice_lengths:
+            name = fixtures.voice_name(seconds)
+            self.telegram.add_file(name, os.path.join(self.fixture_dir, name))
+
+        await self.telegram.start(HOST, self.tg_port)
+        await self.media.start(HOST, self.media_port)
+        self._session = ClientSession(timeout=ClientTimeout(total=60))
+        tracker = asyncio.create_task(self.tracker.run())
+        sampler = None
+        try:
+            print("Starting the bot...")
+            await self._start_bot()
+            sampler = asyncio.create_task(self._sample())
+            # One unmeasured pass loads models, extractors and connections.
+            print("Warming up...")
+            await self._simulate_user(0, FIRST_USER_ID - 1, measured=False)
+
+            print(f"Running {args.users} simulated users...")
+            started = time.monotonic()
+            users = []
+            for index in range(args.users):
+                users.append(asyncio.create_task(self._simulate_user(index, FIRST_USER_ID + index)))
+                if args.ramp:
+                    await asyncio.sleep(args.ramp / args.users)
+            await asyncio.gather(*users)
+            wall = time.monotonic() - started
+            histograms = await self._scrape_metrics()
+            return self._build_report(wall, histograms)
+        finally:
+            for task in (tracker, sampler):
+                if task:
+                    task.cancel()
+            await self._stop_bot()
+            await self._session.close()
+            await self.media.stop()
+            await self.telegram.stop()
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="VortexFetchBot offline end-to-end benchmark")
+    parser.add_argument('--users', type=int, default=10, help="simulated users running at once")
+    parser.add_argument('--downloads', type=int, default=1, help="video links each user sends")
+    parser.add_argument('--songs', type=int, default=1, help="song buttons each user presses (after its first downloads)")
+    parser.add_argument('--transcriptions', type=int, default=1, help="voice notes each user sends")
+    parser.add_argument('--ramp', type=float, default=0.0, help="seconds over which users start (0 = all at once)")
+    parser.add_argument('--video-lengths', type=_int_list, default=[15, 60, 240], help="video fixture lengths in seconds")
+    parser.add_argument('--voice-lengths', type=_int_list, default=[5, 30, 120], help="voice fixture lengths in seconds")
+    parser.add_argument('--api-latency', type=float, default=0.02, help="delay of every fake Bot API call in seconds")
+    parser.add_argument('--upload-mbps', type=float, default=0.0, help="simulated upload bandwidth to Telegram (0 = unlimited)")
+    parser.add_argument('--shazam-latency', type=float, default=1.0, help="delay of every stubbed Shazam lookup in seconds")
+    parser.add_argument('--shazam-hit-rate', type=float, default=1.0, help="share of Shazam lookups that find the song")
+    parser.add_argument('--request-timeout', type=float, default=900, help="seconds to wait for one request")
+    parser.add_argument('--startup-timeout', type=float, default=300, help="seconds to wait for the bot to start")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="bot setting for this run (repeatable)")
+    parser.add_argument('--base-port', type=int, default=18080, help="first of the four local ports used")
+    parser.add_argument('--workdir', default='.benchmark', help="fixtures and the bot's working directory")
+    parser.add_argument('--output', help="write the report (JSON) here")
+    parser.add_argument('--save-baseline', help="write the report (JSON) here as the new baseline")
+    parser.add_argument('--baseline', help="compare with this saved report")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="relative change reported as worse/better")
+    args = parser.parse_args()
+
+    report = asyncio.run(Benchmark(args).run())
+    print()
+    print(format_report(report))
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"\nReport written to {path}.")
+    if args.baseline:
+        with open(args.baseline) as f:
+            lines, regressions = compare(report, json.load(f), args.tolerance)
+        print(f"\nCompared with {args.baseline}:")
+        print("\n".join(lines))
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) worse than the baseline by more than {args.tolerance:.0%}.")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
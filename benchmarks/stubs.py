@@ -0,0 +1,34 @@
+import os
+import random
+import asyncio
+
+
+class StubShazam:
+    """
+    Stands in for shazamio.Shazam: answers every lookup after BENCH_SHAZAM_LATENCY seconds, with
+    a match (at BENCH_SHAZAM_HIT_RATE) whose video link is the song fixture at BENCH_SONG_URL.
+    """
+
+    def __init__(self):
+        self.latency = float(os.getenv('BENCH_SHAZAM_LATENCY', '1.0'))
+        self.hit_rate = float(os.getenv('BENCH_SHAZAM_HIT_RATE', '1.0'))
+        self.song_url = os.environ['BENCH_SONG_URL']
+
+    async def recognize(self, data: bytes) -> dict:
+        await asyncio.sleep(self.latency)
+        if random.random() >= self.hit_rate:
+            return {'matches': []}
+        return {
+            'matches': [{'id': 'bench'}],
+            'track': {
+                'title': 'Benchmark Song',
+                'subtitle': 'VortexFetchBot',
+                'sections': [{'type': 'VIDEO', 'youtubeurl': self.song_url}],
+            },
+        }
+
+
+def install() -> None:
+    """Replaces Shazam in the song recognizer of this process."""
+    from utils import recognition
+    recognition.Shazam = StubShazam
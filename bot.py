@@ -1,4 +1,6 @@
 
+import argparse
+import functools
 from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 
 # --- Local Imports ---
@@ -6,29 +8,75 @@ from config import settings, logger
 import database
 
 from handlers import general, callbacks
+import webhook
+from worker import EmbeddedWorkers
+from database import db, user_activity
+from utils.job_queue import job_queue, job_watcher
+from utils.metrics_exporter import metrics_exporter
+from utils.helpers import load_extractors
 
-async def post_init(application: Application) -> None:
+async def post_init(application: Application, serve_metrics: bool = False) -> None:
     """Post-initialization function to set bot commands."""
     await application.bot.set_my_commands([
         ('start', 'Botni ishga tushirish'),
         ('help', 'Yordam'),
+        ('lang', 'Transkripsiya tili'),
         ('stats', 'Statistika (admin uchun)'),
+        ('clearcache', 'Keshni tozalash (admin uchun)'),
+        ('shazamstats', "Qo'shiq aniqlash statistikasi (admin uchun)"),
+        ('latency', "Bosqichlar kechikishi (admin uchun)"),
     ])
+    # Media jobs run in worker processes (worker.py); the bot shows their queue positions and failures.
+    user_activity.start()
+    job_watcher.start(application.bot)
+    metrics_exporter.start()
+    # Cache lookups of incoming links may need yt-dlp's extractor list.
+    await load_extractors()
+    if serve_metrics:
+        await metrics_exporter.serve(settings.METRICS_HOST, settings.METRICS_PORT)
 
-def main() -> None:
-    """Initializes and runs the bot."""
-    # Setup environment (create directories, cookie files, etc.) before anything else
-    settings.setup_environment()
+async def post_shutdown(application: Application) -> None:
+    """Stops background tasks and flushes buffered data when the bot shuts down."""
+    await user_activity.stop()
+    await job_watcher.stop()
+    await metrics_exporter.stop()
+    await job_queue.close()
+    db.close()
 
-    logger.info("Bot is starting...")
+def application_builder() -> ApplicationBuilder:
+    """Returns a builder with the bot's token and Bot API server settings (shared with the media workers)."""
+    builder = Application.builder().token(settings.TOKEN)
+    # Optional self-hosted Bot API server: larger files, and uploads are sent as file:// paths.
+    if settings.BOT_API_BASE_URL:
+        builder = builder.base_url(settings.BOT_API_BASE_URL).local_mode(settings.BOT_API_LOCAL_MODE)
+        if settings.BOT_API_BASE_FILE_URL:
+            builder = builder.base_file_url(settings.BOT_API_BASE_FILE_URL)
+        logger.info(f"Using Bot API server {settings.BOT_API_BASE_URL} (local mode: {settings.BOT_API_LOCAL_MODE}).")
+    return builder
 
-    # Create the Application and pass it your bot's token.
-    application = Application.builder().token(settings.TOKEN).post_init(post_init).build()
+def build_application(serve_metrics: bool = False) -> Application:
+    """
+    Creates the Application with all handlers registered. With `serve_metrics` the application
+    also serves the metrics of all processes on METRICS_PORT (only the bot's main process does).
+    """
+    # Updates are processed concurrently so light commands never wait behind each other;
+    # media jobs only go into the job queue (utils/job_queue.py) and run in worker processes.
+    application = (
+        application_builder()
+        .concurrent_updates(True)
+        .post_init(functools.partial(post_init, serve_metrics=serve_metrics))
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Register command handlers
     application.add_handler(CommandHandler("start", general.start))
     application.add_handler(CommandHandler("help", general.help_command))
+    application.add_handler(CommandHandler("lang", general.lang_command))
     application.add_handler(CommandHandler("stats", general.stats_command))
+    application.add_handler(CommandHandler("clearcache", general.clear_cache_command))
+    application.add_handler(CommandHandler("shazamstats", general.shazam_stats_command))
+    application.add_handler(CommandHandler("latency", general.latency_command))
 
     # Register message handlers for different types of content
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, general.handle_message))
@@ -36,10 +84,37 @@ def main() -> None:
 
     # Register callback query handler for inline buttons
     application.add_handler(CallbackQueryHandler(callbacks.button))
+    return application
+
+def main() -> None:
+    """Initializes and runs the bot."""
+    parser = argparse.ArgumentParser(description="VortexFetchBot")
+    parser.add_argument('--worker-port', type=int, help="run as a bot worker behind a webhook ingress on this port")
+    parser.add_argument('--worker-host', default='127.0.0.1', help="address the bot worker listens on")
+    args = parser.parse_args()
+
+    # Setup environment (create directories, cookie files, etc.) before anything else
+    settings.setup_environment()
+
+    logger.info("Bot is starting...")
+
+    if args.worker_port:
+        # A bot worker on another machine, listed in the ingress's BOT_WORKER_URLS.
+        webhook.run_worker(build_application, args.worker_port, args.worker_host)
+        return
 
-    # Run the bot until the user presses Ctrl-C
-    logger.info("Bot has started successfully. Polling for updates...")
-    application.run_polling()
+    # Media worker processes for the queued jobs (unless JOB_WORKERS is empty and they run elsewhere).
+    media_workers = EmbeddedWorkers(settings.JOB_WORKERS)
+    media_workers.start()
+    try:
+        if settings.WEBHOOK_URL:
+            webhook.run_webhook(functools.partial(build_application, serve_metrics=True))
+        else:
+            # Run the bot until the user presses Ctrl-C
+            logger.info("Bot has started successfully. Polling for updates...")
+            build_application(serve_metrics=True).run_polling()
+    finally:
+        media_workers.stop()
 
 if __name__ == '__main__':
     main()
@@ -14,6 +14,19 @@ class ConfigError(Exception):
     """Custom exception for configuration-related errors."""
     pass
 
+def parse_job_workers(value: str) -> list[dict[str, int]]:
+    """Parses "download=3,song=2;transcribe=1" into one {job type: concurrency} dict per worker process."""
+    processes = []
+    for group in value.split(';'):
+        counts = {}
+        for item in group.split(','):
+            if item.strip():
+                kind, _, count = item.partition('=')
+                counts[kind.strip()] = int(count or '1')
+        if counts:
+            processes.append(counts)
+    return processes
+
 class Config:
     """Manages loading, validation, and access to all configuration settings."""
     def __init__(self):
@@ -24,12 +37,126 @@ class Config:
         self.ADMIN_ID_STR = os.getenv('ADMIN_ID')
         self.ADMIN_ID = None
 
+        # --- Webhook Mode (polling is used when WEBHOOK_URL is not set) ---
+        # Public HTTPS base URL Telegram sends updates to, e.g. https://bot.example.com
+        self.WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+        self.WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+        self.WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+        self.WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+        self.WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+        # Bot worker processes behind the webhook ingress; updates of one user always go to the same one
+        self.BOT_PROCESSES = int(os.getenv('BOT_PROCESSES', '1'))
+        self.BOT_WORKER_BASE_PORT = int(os.getenv('BOT_WORKER_BASE_PORT', '9100'))
+        # Comma-separated URLs of bot workers on other machines (replaces the local BOT_PROCESSES)
+        self.BOT_WORKER_URLS = [url.strip() for url in os.getenv('BOT_WORKER_URLS', '').split(',') if url.strip()]
+
+        # --- Local Bot API Server (optional; files are then sent by path, up to 2000 MB) ---
+        # e.g. BOT_API_BASE_URL=http://localhost:8081/bot and BOT_API_BASE_FILE_URL=http://localhost:8081/file/bot
+        self.BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL')
+        self.BOT_API_BASE_FILE_URL = os.getenv('BOT_API_BASE_FILE_URL')
+        self.BOT_API_LOCAL_MODE = bool(self.BOT_API_BASE_URL) and os.getenv('BOT_API_LOCAL_MODE', 'true').lower() == 'true'
+
         # --- Bot Behavior --- 
-        self.MAX_FILE_SIZE_MB = 49
+        self.MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', '2000' if self.BOT_API_LOCAL_MODE else '49'))
+        # Read timeout of uploads; a local server answers only after it has uploaded the file to Telegram itself
+        self.UPLOAD_TIMEOUT = float(os.getenv('UPLOAD_TIMEOUT', '3600' if self.BOT_API_LOCAL_MODE else '300'))
+
+        # --- Whisper Models (tiers from the cheapest to the best; each job gets one by duration and load) ---
+        self.WHISPER_MODELS = [m.strip() for m in os.getenv('WHISPER_MODELS', 'base').split(',') if m.strip()]
+        self.WHISPER_BEAM_SIZES = [int(b) for b in os.getenv('WHISPER_BEAM_SIZES', '1').split(',') if b.strip()]
+        # Seconds a transcription should take at most (queue included); longer estimates get a cheaper tier
+        self.WHISPER_LATENCY_TARGET = float(os.getenv('WHISPER_LATENCY_TARGET', '60'))
+        self.WHISPER_DEVICE = os.getenv('WHISPER_DEVICE', 'cpu')
+        self.WHISPER_COMPUTE_TYPE = os.getenv('WHISPER_COMPUTE_TYPE', 'int8')
+        # Load every tier when a worker starts (otherwise on first use)
+        self.WHISPER_PRELOAD_MODELS = os.getenv('WHISPER_PRELOAD_MODELS', 'true').lower() == 'true'
+
+        # --- Whisper Worker Processes (each holds its own warm models) ---
+        self.WHISPER_WORKERS = int(os.getenv('WHISPER_WORKERS', '1'))
+        self.WHISPER_CPU_THREADS = int(os.getenv('WHISPER_CPU_THREADS', str(max(1, (os.cpu_count() or 1) // self.WHISPER_WORKERS))))
+        self.WHISPER_NUM_WORKERS = int(os.getenv('WHISPER_NUM_WORKERS', '1'))
+        self.WHISPER_MAX_PENDING = int(os.getenv('WHISPER_MAX_PENDING', '8'))
+        self.WHISPER_JOB_TIMEOUT = float(os.getenv('WHISPER_JOB_TIMEOUT', '1800'))
+        # Voice notes and audio files up to this size are downloaded into memory instead of to disk
+        self.TRANSCRIBE_IN_MEMORY_MB = float(os.getenv('TRANSCRIBE_IN_MEMORY_MB', '5'))
+        # Media at least this long (seconds) is split at silences and transcribed in parallel by all Whisper workers
+        self.TRANSCRIBE_PARALLEL_MIN_SECONDS = float(os.getenv('TRANSCRIBE_PARALLEL_MIN_SECONDS', '600'))
+        self.TRANSCRIBE_CHUNK_SECONDS = float(os.getenv('TRANSCRIBE_CHUNK_SECONDS', '60'))
+        # A detected language is remembered for the chat (and skips detection next time) from this probability on
+        self.LANGUAGE_MEMORY_MIN_PROBABILITY = float(os.getenv('LANGUAGE_MEMORY_MIN_PROBABILITY', '0.8'))
+
+        # --- Job Scheduling (concurrent heavy media jobs) ---
+        self.MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', '6'))
+        self.MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', '1'))
+        self.DOWNLOAD_CONCURRENCY = int(os.getenv('DOWNLOAD_CONCURRENCY', '3'))
+        self.AUDIO_CONCURRENCY = int(os.getenv('AUDIO_CONCURRENCY', '2'))
+        self.TRANSCRIBE_CONCURRENCY = int(os.getenv('TRANSCRIBE_CONCURRENCY', str(self.WHISPER_WORKERS)))
+
+        # --- Job Queue (handlers only enqueue media jobs; media worker processes run them) ---
+        # 'sqlite' (the bot database) or 'redis' (needs the redis package and a server at REDIS_URL)
+        self.JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND', 'sqlite').lower()
+        self.REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+        # Media worker processes bot.py starts itself: ';' separates processes, each a list of job type=concurrency.
+        # Empty = start none (run `python worker.py --jobs ...` yourself, e.g. on other machines)
+        self.JOB_WORKERS = parse_job_workers(os.getenv(
+            'JOB_WORKERS',
+            f"download={self.DOWNLOAD_CONCURRENCY},song={self.AUDIO_CONCURRENCY};transcribe={self.TRANSCRIBE_CONCURRENCY}"
+        ))
+        # A running job whose worker stops renewing its lease for this long is retried, up to JOB_MAX_ATTEMPTS runs
+        self.JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '60'))
+        self.JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '2'))
+        self.JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1'))
+
+        # --- yt-dlp Worker Processes (0 = run the yt-dlp CLI for every download) ---
+        self.YTDLP_WORKERS = int(os.getenv('YTDLP_WORKERS', str(self.DOWNLOAD_CONCURRENCY)))
+        self.YTDLP_JOB_TIMEOUT = float(os.getenv('YTDLP_JOB_TIMEOUT', '1800'))
+
+        # --- Song Recognition (Shazam on short in-memory audio windows) ---
+        self.SHAZAM_WINDOW_SECONDS = float(os.getenv('SHAZAM_WINDOW_SECONDS', '12'))
+        # Window centres as fractions of the media duration
+        self.SHAZAM_WINDOW_OFFSETS = [float(x) for x in os.getenv('SHAZAM_WINDOW_OFFSETS', '0.5,0.2,0.8').split(',')]
+        self.SHAZAM_TIMEOUT = float(os.getenv('SHAZAM_TIMEOUT', '20'))
+
+        # --- YouTube Search for Recognized Songs ---
+        self.SONG_SEARCH_CONCURRENCY = int(os.getenv('SONG_SEARCH_CONCURRENCY', '4'))
+        self.SONG_SEARCH_TIMEOUT = float(os.getenv('SONG_SEARCH_TIMEOUT', '15'))
+        self.SONG_SEARCH_CACHE_TTL_SECONDS = int(os.getenv('SONG_SEARCH_CACHE_TTL_DAYS', '30')) * 24 * 3600
+        # Searches that found nothing are retried after this long
+        self.SONG_SEARCH_MISS_TTL_SECONDS = int(os.getenv('SONG_SEARCH_MISS_TTL_HOURS', '6')) * 3600
+
+        # --- Result Cache (Telegram file_ids of already uploaded media) ---
+        self.MEDIA_CACHE_TTL_SECONDS = int(os.getenv('MEDIA_CACHE_TTL_DAYS', '30')) * 24 * 3600
+        self.MEDIA_CACHE_MAX_ENTRIES = int(os.getenv('MEDIA_CACHE_MAX_ENTRIES', '50000'))
+
+        # Song download buttons stop working after this long; the most recently used ones are also kept in memory
+        self.SONG_ENTRY_TTL_SECONDS = int(os.getenv('SONG_ENTRY_TTL_DAYS', '7')) * 24 * 3600
+        self.SONG_ENTRY_CACHE_SIZE = int(os.getenv('SONG_ENTRY_CACHE_SIZE', '10000'))
+
+        # --- User Registration (write-behind buffer flushed to the database) ---
+        self.USER_FLUSH_INTERVAL = float(os.getenv('USER_FLUSH_INTERVAL', '5'))
+        self.USER_FLUSH_SIZE = int(os.getenv('USER_FLUSH_SIZE', '500'))
+
+        # --- Metrics (per-stage latencies, traffic, cache hit rates; shared between processes via the database) ---
+        # Prometheus endpoint http://METRICS_HOST:METRICS_PORT/metrics of the bot's main process (0 = off)
+        self.METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+        self.METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '15'))
+        # Counts of stopped processes are kept for this long
+        self.METRICS_RETENTION_HOURS = float(os.getenv('METRICS_RETENTION_HOURS', '24'))
 
         # --- File Paths ---
         self.DOWNLOAD_PATH = 'downloads'
+        # Disk budget of the download directory (0 = no limit) and free space that must always remain
+        self.DOWNLOAD_QUOTA_MB = int(os.getenv('DOWNLOAD_QUOTA_MB', '10240'))
+        self.MIN_FREE_DISK_MB = int(os.getenv('MIN_FREE_DISK_MB', '1024'))
+        # How long a new job waits for disk space before it is rejected
+        self.DISK_WAIT_TIMEOUT = float(os.getenv('DISK_WAIT_TIMEOUT', '60'))
+        # Files and job directories left behind (e.g. by a crash) are removed after this age
+        self.ORPHAN_MAX_AGE_HOURS = float(os.getenv('ORPHAN_MAX_AGE_HOURS', '6'))
+        self.JANITOR_INTERVAL = float(os.getenv('JANITOR_INTERVAL', '600'))
         self.DB_FILE = "bot_users.db"
+        self.DB_READER_THREADS = int(os.getenv('DB_READER_THREADS', '2'))
+        self.DB_CACHE_KB = int(os.getenv('DB_CACHE_KB', '20000'))
         # --- Optional Cookie File Paths ---
         self.YOUTUBE_COOKIE_FILE = os.getenv('YOUTUBE_COOKIE_FILE')
         self.INSTAGRAM_COOKIE_FILE = os.getenv('INSTAGRAM_COOKIE_FILE')
@@ -52,6 +179,9 @@ class Config:
             except ValueError:
                 raise ConfigError("FATAL: ADMIN_ID is not a valid integer. Please check your .env file.")
 
+        if not self.WHISPER_MODELS or not self.WHISPER_BEAM_SIZES or min(self.WHISPER_BEAM_SIZES) < 1:
+            raise ConfigError("FATAL: WHISPER_MODELS needs at least one model and WHISPER_BEAM_SIZES positive integers.")
+
     def setup_environment(self):
         """Creates necessary directories and validates file paths. Should be called once at startup."""
         # Create download directory
@@ -1,11 +1,176 @@
 import sqlite3
+import asyncio
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Optional
 from config import settings
+from utils.metrics import time_stage
 
 logger = logging.getLogger(__name__)
 
+# --- SQL Statements ---
+# Kept as constants so each connection's statement cache reuses the prepared statements.
+UPSERT_USER_SQL = '''
+    INSERT INTO users (user_id, first_name, last_name, username, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        first_name = excluded.first_name, last_name = excluded.last_name,
+        username = excluded.username, last_seen = excluded.last_seen
+'''
+COUNT_USERS_SQL = "SELECT value FROM counters WHERE name = 'users'"
+USERS_PAGE_SQL = "SELECT * FROM users ORDER BY last_seen DESC, user_id DESC LIMIT ?"
+# Keyset pagination: rows strictly after / before a (last_seen, user_id) cursor, served from idx_users_last_seen.
+USERS_AFTER_CURSOR_SQL = '''
+    SELECT * FROM users WHERE (last_seen, user_id) < (?, ?)
+    ORDER BY last_seen DESC, user_id DESC LIMIT ?
+'''
+USERS_BEFORE_CURSOR_SQL = '''
+    SELECT * FROM users WHERE (last_seen, user_id) > (?, ?)
+    ORDER BY last_seen ASC, user_id ASC LIMIT ?
+'''
+ROLLUP_SQL = "SELECT bucket, active_users, new_users FROM activity_rollup WHERE period = ? AND bucket >= ? ORDER BY bucket DESC"
+GET_CACHED_MEDIA_SQL = "SELECT * FROM media_cache WHERE media_key = ? AND created_at >= ?"
+TOUCH_CACHED_MEDIA_SQL = "UPDATE media_cache SET last_hit = ?, hits = hits + 1 WHERE media_key = ?"
+UPSERT_CACHED_MEDIA_SQL = '''
+    INSERT INTO media_cache (media_key, file_id, caption, song_title, song_url, created_at, last_hit)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(media_key) DO UPDATE SET
+        file_id = excluded.file_id, caption = excluded.caption,
+        song_title = excluded.song_title, song_url = excluded.song_url,
+        created_at = excluded.created_at, last_hit = excluded.last_hit
+'''
+EXPIRE_CACHED_MEDIA_SQL = "DELETE FROM media_cache WHERE created_at < ?"
+TRIM_CACHED_MEDIA_SQL = '''
+    DELETE FROM media_cache WHERE media_key IN (
+        SELECT media_key FROM media_cache ORDER BY last_hit DESC LIMIT -1 OFFSET ?
+    )
+'''
+
+
+# Rollup periods and the SQL expression that turns a timestamp column into the period's bucket key.
+# Must match rollup_bucket() below.
+ROLLUP_BUCKETS = {
+    'day': "substr({column}, 1, 10)",
+    'week': "strftime('%Y-W%W', {column})",
+}
+
+def rollup_bucket(period: str, moment: datetime) -> str:
+    """Returns the activity_rollup bucket key of a moment, e.g. '2024-05-01' (day) or '2024-W17' (week)."""
+    return moment.strftime('%Y-%m-%d' if period == 'day' else '%Y-W%W')
+
+GET_SONG_SEARCH_SQL = "SELECT video_id, created_at FROM song_search_cache WHERE query_key = ?"
+UPSERT_SONG_SEARCH_SQL = '''
+    INSERT INTO song_search_cache (query_key, video_id, created_at) VALUES (?, ?, ?)
+    ON CONFLICT(query_key) DO UPDATE SET video_id = excluded.video_id, created_at = excluded.created_at
+'''
+EXPIRE_SONG_SEARCH_SQL = "DELETE FROM song_search_cache WHERE created_at < ?"
+GET_SONG_ENTRY_SQL = "SELECT full_title, youtube_url, created_at FROM song_entries WHERE song_id = ? AND created_at >= ?"
+INSERT_SONG_ENTRY_SQL = "INSERT OR REPLACE INTO song_entries (song_id, full_title, youtube_url, created_at) VALUES (?, ?, ?, ?)"
+EXPIRE_SONG_ENTRIES_SQL = "DELETE FROM song_entries WHERE created_at < ?"
+
+# --- Job queue ---
+INSERT_JOB_SQL = "INSERT INTO jobs (kind, user_id, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+# Jobs whose worker stopped renewing the lease go back to the queue, or fail once they used up their attempts.
+REQUEUE_EXPIRED_JOBS_SQL = '''
+    UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, updated_at = ?
+    WHERE status = 'running' AND lease_until < ? AND attempts < ?
+'''
+FAIL_EXPIRED_JOBS_SQL = '''
+    UPDATE jobs SET status = 'failed', error = 'lease expired', lease_until = NULL, updated_at = ?
+    WHERE status = 'running' AND lease_until < ? AND attempts >= ?
+'''
+# Takes the oldest queued job of the given kinds whose user is below the per-user limit, in one atomic statement.
+CLAIM_JOB_SQL = '''
+    UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, updated_at = ?
+    WHERE job_id = (
+        SELECT job_id FROM jobs
+        WHERE status = 'queued' AND kind IN ({kinds})
+          AND user_id NOT IN (SELECT user_id FROM jobs WHERE status = 'running' GROUP BY user_id HAVING COUNT(*) >= ?)
+        ORDER BY job_id LIMIT 1
+    )
+    RETURNING job_id, kind, user_id, payload, attempts, created_at
+'''
+RENEW_JOB_LEASE_SQL = "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE job_id = ? AND worker = ? AND status = 'running'"
+FINISH_JOB_SQL = '''
+    UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, updated_at = ?
+    WHERE job_id = ? AND worker = ? AND status = 'running'
+'''
+# A job interrupted by a worker shutdown is queued again without counting the interrupted run.
+REQUEUE_JOB_SQL = '''
+    UPDATE jobs SET status = 'queued', attempts = attempts - 1, worker = NULL, lease_until = NULL, updated_at = ?
+    WHERE job_id = ? AND worker = ? AND status = 'running'
+'''
+QUEUED_JOBS_SQL = "SELECT job_id, kind FROM jobs WHERE status = 'queued' ORDER BY job_id"
+TAKE_FINISHED_JOBS_SQL = '''
+    UPDATE jobs SET collected = 1 WHERE job_id IN (
+        SELECT job_id FROM jobs WHERE status IN ('done', 'failed') AND collected = 0 ORDER BY job_id LIMIT ?
+    )
+    RETURNING job_id, kind, user_id, payload, status, attempts, result, error, created_at, updated_at
+'''
+PURGE_JOBS_SQL = "DELETE FROM jobs WHERE collected = 1 AND updated_at < ?"
+# Finished jobs are kept this long after the bot has seen them.
+JOB_RETENTION_SECONDS = 24 * 3600
+SAVE_METRICS_SNAPSHOT_SQL = "INSERT OR REPLACE INTO metrics_snapshots (process, data, updated_at) VALUES (?, ?, ?)"
+GET_METRICS_SNAPSHOTS_SQL = "SELECT process, data, updated_at FROM metrics_snapshots WHERE updated_at >= ?"
+EXPIRE_METRICS_SNAPSHOTS_SQL = "DELETE FROM metrics_snapshots WHERE updated_at < ?"
+# Languages are remembered per user in each chat; user_id 0 holds the chat's latest detected language,
+# a fallback hint for members without one of their own (it is never pinned).
+CHAT_LANGUAGE_USER = 0
+GET_LANGUAGE_SQL = '''
+    SELECT language, probability, pinned, user_id = 0 AS chat_wide FROM transcription_languages
+    WHERE chat_id = ? AND user_id IN (?, 0)
+    ORDER BY user_id = 0 LIMIT 1
+'''
+# A detected language never replaces one pinned with /lang.
+REMEMBER_LANGUAGE_SQL = '''
+    INSERT INTO transcription_languages (chat_id, user_id, language, probability, pinned, updated_at) VALUES (?, ?, ?, ?, 0, ?)
+    ON CONFLICT(chat_id, user_id) DO UPDATE SET
+        language = excluded.language, probability = excluded.probability, updated_at = excluded.updated_at
+    WHERE transcription_languages.pinned = 0
+'''
+PIN_LANGUAGE_SQL = '''
+    INSERT OR REPLACE INTO transcription_languages (chat_id, user_id, language, probability, pinned, updated_at)
+    VALUES (?, ?, ?, NULL, 1, ?)
+'''
+FORGET_LANGUAGE_SQL = "DELETE FROM transcription_languages WHERE chat_id = ? AND user_id = ?"
+
+# --- Disk reservations ---
+# A scope is one download directory on one host; all processes working in it share its reservations.
+# The reservation is only inserted if the live reservations of the scope plus the new one stay within
+# both the room left on the disk and the quota minus the idle usage measured by the scope's janitor.
+RESERVE_DISK_SQL = '''
+    INSERT INTO disk_reservations (path, scope, process, bytes, expires_at)
+    SELECT :path, :scope, :process, :bytes, :expires_at
+    WHERE (SELECT COALESCE(SUM(bytes), 0) FROM disk_reservations WHERE scope = :scope AND expires_at >= :now) + :bytes
+        <= MIN(:room, :quota - (SELECT COALESCE(MAX(idle_bytes), 0) FROM disk_janitors WHERE scope = :scope))
+'''
+RESIZE_DISK_RESERVATION_SQL = "UPDATE disk_reservations SET bytes = ? WHERE path = ?"
+RELEASE_DISK_RESERVATION_SQL = "DELETE FROM disk_reservations WHERE path = ?"
+RELEASE_PROCESS_DISK_RESERVATIONS_SQL = "DELETE FROM disk_reservations WHERE process = ?"
+RENEW_DISK_RESERVATIONS_SQL = "UPDATE disk_reservations SET expires_at = ? WHERE process = ?"
+EXPIRE_DISK_RESERVATIONS_SQL = "DELETE FROM disk_reservations WHERE scope = ? AND expires_at < ?"
+ACTIVE_DISK_RESERVATIONS_SQL = "SELECT path FROM disk_reservations WHERE scope = ?"
+# The janitor lease of a scope moves to another process only once its holder stopped renewing it.
+CLAIM_DISK_JANITOR_SQL = '''
+    INSERT INTO disk_janitors (scope, process, idle_bytes, expires_at) VALUES (?, ?, 0, ?)
+    ON CONFLICT(scope) DO UPDATE SET process = excluded.process, expires_at = excluded.expires_at
+    WHERE disk_janitors.process = excluded.process OR disk_janitors.expires_at < ?
+'''
+SET_DISK_IDLE_USAGE_SQL = "UPDATE disk_janitors SET idle_bytes = ? WHERE scope = ? AND process = ?"
+RELEASE_DISK_JANITOR_SQL = "UPDATE disk_janitors SET expires_at = 0 WHERE process = ?"
+
 class Database:
+    """
+    Async access to the SQLite database.
+
+    Queries never run on the event loop: all writes go through a single writer thread with
+    its own connection, and reads run on a small pool of reader threads, each with its own
+    read-only connection. In WAL mode readers never block the writer (and vice versa), so
+    /stats queries do not hold up registration writes.
+    """
     _instance = None
 
     def __new__(cls):
@@ -15,20 +180,61 @@ class Database:
         return cls._instance
 
     def _initialize(self):
-        """Initializes the database connection and creates tables."""
+        """Opens the database, switches it to WAL mode, creates tables and starts the worker threads."""
         try:
-            self.conn = sqlite3.connect(settings.DB_FILE, check_same_thread=False)
-            self.conn.row_factory = sqlite3.Row
-            self._create_tables()
-            logger.info(f"Database connection to '{settings.DB_FILE}' established.")
+            self._local = threading.local()
+            self._background_tasks: set[asyncio.Task] = set()
+            self._connections: list[sqlite3.Connection] = []
+            self._connections_lock = threading.Lock()
+            setup_conn = self._connect()
+            setup_conn.execute("PRAGMA journal_mode=WAL")
+            self._create_tables(setup_conn)
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+            self._readers = ThreadPoolExecutor(max_workers=settings.DB_READER_THREADS, thread_name_prefix='db-reader')
+            logger.info(f"Database '{settings.DB_FILE}' opened in WAL mode ({settings.DB_READER_THREADS} reader thread(s)).")
         except sqlite3.Error as e:
             logger.error(f"Database connection failed: {e}", exc_info=True)
             raise
 
-    def _create_tables(self):
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Opens a tuned connection. Connections are only used by the thread that opened them."""
+        # check_same_thread=False is only needed so close() can close every connection at shutdown.
+        conn = sqlite3.connect(settings.DB_FILE, check_same_thread=False, cached_statements=256, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL; fsync only at checkpoints
+        conn.execute(f"PRAGMA cache_size=-{settings.DB_CACHE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            conn.execute("PRAGMA query_only=ON")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def _thread_connection(self, read_only: bool) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect(read_only=read_only)
+        return conn
+
+    async def _read(self, func, *args):
+        """Runs `func(conn, *args)` on a reader thread."""
+        def run():
+            return func(self._thread_connection(read_only=True), *args)
+        return await asyncio.get_running_loop().run_in_executor(self._readers, run)
+
+    async def _write(self, func, *args):
+        """Runs `func(conn, *args)` in a transaction on the writer thread (timed as the 'db_write' stage)."""
+        def run():
+            conn = self._thread_connection(read_only=False)
+            with conn:
+                return func(conn, *args)
+        with time_stage('db_write'):
+            return await asyncio.get_running_loop().run_in_executor(self._writer, run)
+
+    def _create_tables(self, conn: sqlite3.Connection):
         """Creates the necessary database tables if they don't exist."""
-        with self.conn:
-            self.conn.execute('''
+        with conn:
+            conn.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     user_id INTEGER PRIMARY KEY,
                     first_name TEXT,
@@ -38,45 +244,463 @@ class Database:
                     last_seen TEXT NOT NULL
                 )
             ''')
-        logger.info("'users' table initialized.")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS media_cache (
+                    media_key TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    caption TEXT,
+                    song_title TEXT,
+                    song_url TEXT,
+                    created_at REAL NOT NULL,
+                    last_hit REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_media_cache_last_hit ON media_cache (last_hit)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS song_search_cache (
+                    query_key TEXT PRIMARY KEY,
+                    video_id TEXT,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_song_search_cache_created_at ON song_search_cache (created_at)")
+            # Songs offered through inline "download" buttons, shared by all bot processes.
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS song_entries (
+                    song_id TEXT PRIMARY KEY,
+                    full_title TEXT NOT NULL,
+                    youtube_url TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_song_entries_created_at ON song_entries (created_at)")
+            # Media jobs waiting for, or run by, the media worker processes (the SQLite job queue backend).
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_until REAL,
+                    result TEXT,
+                    error TEXT,
+                    collected INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, kind, job_id)")
+            # The latest metrics snapshot of every bot and media worker process (see utils/metrics_exporter.py).
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS metrics_snapshots (
+                    process TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            # The transcription language of each user in each chat (detected, or pinned with /lang),
+            # plus the chat's latest detected language under user_id 0.
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS transcription_languages (
+                    chat_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    language TEXT NOT NULL,
+                    probability REAL,
+                    pinned INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (chat_id, user_id)
+                )
+            ''')
+            # Disk space reserved by running jobs of every process, and the janitor of each download directory (utils/workspace.py).
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS disk_reservations (
+                    path TEXT PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    process TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_disk_reservations_scope ON disk_reservations (scope, expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_disk_reservations_process ON disk_reservations (process)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS disk_janitors (
+                    scope TEXT PRIMARY KEY,
+                    process TEXT NOT NULL,
+                    idle_bytes INTEGER NOT NULL DEFAULT 0,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self._create_stats_tables(conn)
+        logger.info(
+            "'users', 'media_cache', 'song_search_cache', 'song_entries', 'jobs', 'metrics_snapshots', 'transcription_languages', "
+            "'disk_reservations', 'disk_janitors' and statistics tables initialized."
+        )
 
-    def update_user(self, user_id: int, first_name: str, last_name: str, username: str):
-        """Adds a new user or updates an existing one's details and last_seen timestamp."""
-        now = datetime.now(settings.TASHKENT_TZ).strftime("%Y-%m-%d %H:%M:%S")
-        with self.conn:
-            cursor = self.conn.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-            if cursor.fetchone():
-                self.conn.execute('''
-                    UPDATE users 
-                    SET first_name = ?, last_name = ?, username = ?, last_seen = ? 
-                    WHERE user_id = ?
-                ''', (first_name, last_name, username, now, user_id))
-            else:
-                self.conn.execute('''
-                    INSERT INTO users (user_id, first_name, last_name, username, first_seen, last_seen) 
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (user_id, first_name, last_name, username, now, now))
-
-    def get_total_user_count(self) -> int:
+    def _create_stats_tables(self, conn: sqlite3.Connection):
+        """
+        Creates the index and the incrementally maintained aggregates used by /stats.
+
+        Triggers on `users` keep the total user count in `counters` and per-day / per-week
+        active and new user numbers in `activity_rollup`, so /stats never scans the users table.
+        A user counts as active in a day (week) the first time their last_seen moves into it.
+        """
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen, user_id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS activity_rollup (
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                active_users INTEGER NOT NULL DEFAULT 0,
+                new_users INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, bucket)
+            )
+        ''')
+        for period, bucket in ROLLUP_BUCKETS.items():
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_users_new_{period} AFTER INSERT ON users
+                BEGIN
+                    INSERT INTO activity_rollup (period, bucket, active_users, new_users)
+                    VALUES ('{period}', {bucket.format(column='NEW.first_seen')}, 0, 1)
+                    ON CONFLICT (period, bucket) DO UPDATE SET new_users = new_users + 1;
+                    INSERT INTO activity_rollup (period, bucket, active_users, new_users)
+                    VALUES ('{period}', {bucket.format(column='NEW.last_seen')}, 1, 0)
+                    ON CONFLICT (period, bucket) DO UPDATE SET active_users = active_users + 1;
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_users_active_{period} AFTER UPDATE OF last_seen ON users
+                WHEN {bucket.format(column='OLD.last_seen')} <> {bucket.format(column='NEW.last_seen')}
+                BEGIN
+                    INSERT INTO activity_rollup (period, bucket, active_users, new_users)
+                    VALUES ('{period}', {bucket.format(column='NEW.last_seen')}, 1, 0)
+                    ON CONFLICT (period, bucket) DO UPDATE SET active_users = active_users + 1;
+                END
+            ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_count AFTER INSERT ON users
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = 'users';
+            END
+        ''')
+
+        # First run on an existing database: seed the counter and the rollups from the users table once.
+        # Past activity is only known through each user's latest last_seen, so seeded active counts are a lower bound.
+        seeded = conn.execute("INSERT OR IGNORE INTO counters (name, value) SELECT 'users', COUNT(*) FROM users").rowcount
+        if seeded:
+            for period, bucket in ROLLUP_BUCKETS.items():
+                conn.execute(f'''
+                    INSERT INTO activity_rollup (period, bucket, new_users)
+                    SELECT '{period}', {bucket.format(column='first_seen')} AS b, COUNT(*) FROM users WHERE true GROUP BY b
+                    ON CONFLICT (period, bucket) DO UPDATE SET new_users = excluded.new_users
+                ''')
+                conn.execute(f'''
+                    INSERT INTO activity_rollup (period, bucket, active_users)
+                    SELECT '{period}', {bucket.format(column='last_seen')} AS b, COUNT(*) FROM users WHERE true GROUP BY b
+                    ON CONFLICT (period, bucket) DO UPDATE SET active_users = excluded.active_users
+                ''')
+
+    async def upsert_users(self, rows: list[tuple]):
+        """
+        Adds or updates many users in one transaction.
+        Each row is (user_id, first_name, last_name, username, first_seen, last_seen);
+        first_seen is only used for users that are not in the table yet.
+        """
+        await self._write(lambda conn: conn.executemany(UPSERT_USER_SQL, rows))
+
+    async def get_total_user_count(self) -> int:
         """Returns the total number of users in the database."""
-        with self.conn:
-            cursor = self.conn.execute("SELECT COUNT(*) FROM users")
-            return cursor.fetchone()[0]
+        return await self._read(lambda conn: conn.execute(COUNT_USERS_SQL).fetchone()[0])
+
+    async def get_users_page(self, limit: int, cursor: Optional[tuple[str, int]] = None, before: bool = False) -> list[sqlite3.Row]:
+        """
+        Returns one page of users ordered by last seen time (newest first), using keyset pagination.
+        `cursor` is the (last_seen, user_id) of the row the page starts after, or before if `before` is set.
+        """
+        if cursor is None:
+            return await self._read(lambda conn: conn.execute(USERS_PAGE_SQL, (limit,)).fetchall())
+        if before:
+            rows = await self._read(lambda conn: conn.execute(USERS_BEFORE_CURSOR_SQL, (*cursor, limit)).fetchall())
+            return rows[::-1]
+        return await self._read(lambda conn: conn.execute(USERS_AFTER_CURSOR_SQL, (*cursor, limit)).fetchall())
+
+    async def get_activity_rollup(self, period: str, since: str) -> list[sqlite3.Row]:
+        """Returns (bucket, active_users, new_users) rows of a rollup period from bucket `since` on, newest first."""
+        return await self._read(lambda conn: conn.execute(ROLLUP_SQL, (period, since)).fetchall())
+
+    async def get_cached_media(self, media_key: str) -> sqlite3.Row | None:
+        """Returns a fresh cache entry for a media key and records the hit, or None on a miss."""
+        now = time.time()
+        row = await self._read(lambda conn: conn.execute(
+            GET_CACHED_MEDIA_SQL, (media_key, now - settings.MEDIA_CACHE_TTL_SECONDS)
+        ).fetchone())
+        if row:
+            # Hit bookkeeping only feeds LRU eviction, so it does not need to be awaited.
+            task = asyncio.create_task(self._write(lambda conn: conn.execute(TOUCH_CACHED_MEDIA_SQL, (now, media_key))))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+        return row
+
+    async def cache_media(self, media_key: str, file_id: str, caption: str, song_title: str | None, song_url: str | None):
+        """Stores the Telegram file_id and recognition result for a media key, evicting old entries."""
+        now = time.time()
+
+        def store(conn: sqlite3.Connection):
+            conn.execute(UPSERT_CACHED_MEDIA_SQL, (media_key, file_id, caption, song_title, song_url, now, now))
+            # TTL eviction first, then trim the least recently used entries down to the size limit.
+            conn.execute(EXPIRE_CACHED_MEDIA_SQL, (now - settings.MEDIA_CACHE_TTL_SECONDS,))
+            conn.execute(TRIM_CACHED_MEDIA_SQL, (settings.MEDIA_CACHE_MAX_ENTRIES,))
+        await self._write(store)
 
-    def get_users_paginated(self, page: int, limit: int = 10) -> list[sqlite3.Row]:
-        """Returns a paginated list of users, ordered by their last seen time."""
-        offset = (page - 1) * limit
-        with self.conn:
-            cursor = self.conn.execute("SELECT * FROM users ORDER BY last_seen DESC LIMIT ? OFFSET ?", (limit, offset))
-            return cursor.fetchall()
+    async def invalidate_media_cache(self, media_key: str | None = None) -> int:
+        """Removes one cache entry, or the whole cache if no key is given. Returns the number of removed entries."""
+        if media_key is None:
+            return await self._write(lambda conn: conn.execute("DELETE FROM media_cache").rowcount)
+        return await self._write(lambda conn: conn.execute("DELETE FROM media_cache WHERE media_key = ?", (media_key,)).rowcount)
+
+    async def get_song_search(self, query_key: str) -> sqlite3.Row | None:
+        """Returns the cached (video_id, created_at) of a song search; video_id is NULL for a cached miss."""
+        return await self._read(lambda conn: conn.execute(GET_SONG_SEARCH_SQL, (query_key,)).fetchone())
+
+    async def cache_song_search(self, query_key: str, video_id: str | None, max_age: float):
+        """Stores a song search result (None for "nothing found") and drops results older than `max_age` seconds."""
+        now = time.time()
+
+        def store(conn: sqlite3.Connection):
+            conn.execute(UPSERT_SONG_SEARCH_SQL, (query_key, video_id, now))
+            conn.execute(EXPIRE_SONG_SEARCH_SQL, (now - max_age,))
+        await self._write(store)
+
+    async def save_song_entry(self, song_id: str, full_title: str, youtube_url: str):
+        """Stores the song behind a download button and drops entries older than SONG_ENTRY_TTL."""
+        now = time.time()
+
+        def store(conn: sqlite3.Connection):
+            conn.execute(INSERT_SONG_ENTRY_SQL, (song_id, full_title, youtube_url, now))
+            conn.execute(EXPIRE_SONG_ENTRIES_SQL, (now - settings.SONG_ENTRY_TTL_SECONDS,))
+        await self._write(store)
+
+    async def get_song_entry(self, song_id: str) -> dict | None:
+        """Returns {'full_title', 'youtube_url', 'created_at'} of a download button, or None if it is unknown or expired."""
+        row = await self._read(lambda conn: conn.execute(
+            GET_SONG_ENTRY_SQL, (song_id, time.time() - settings.SONG_ENTRY_TTL_SECONDS)
+        ).fetchone())
+        return dict(row) if row else None
+
+    async def enqueue_job(self, kind: str, user_id: int, payload: str) -> int:
+        """Adds a queued job and returns its id. `payload` is the job's JSON text."""
+        now = time.time()
+        return await self._write(lambda conn: conn.execute(INSERT_JOB_SQL, (kind, user_id, payload, now, now)).lastrowid)
+
+    async def claim_job(self, kinds: list[str], worker: str, lease: float, max_attempts: int, per_user_limit: int) -> sqlite3.Row | None:
+        """
+        Marks the oldest claimable job of `kinds` as running by `worker` and returns it, or None.
+        Expired leases are handled first, so jobs of a crashed worker are picked up again.
+        """
+        now = time.time()
+        claim_sql = CLAIM_JOB_SQL.format(kinds=', '.join('?' * len(kinds)))
+
+        def claim(conn: sqlite3.Connection):
+            conn.execute(REQUEUE_EXPIRED_JOBS_SQL, (now, now, max_attempts))
+            conn.execute(FAIL_EXPIRED_JOBS_SQL, (now, now, max_attempts))
+            return conn.execute(claim_sql, (worker, now + lease, now, *kinds, per_user_limit)).fetchone()
+        return await self._write(claim)
+
+    async def renew_job_lease(self, job_id: int, worker: str, lease: float) -> bool:
+        """Extends a running job's lease. Returns False if the job is no longer run by `worker`."""
+        now = time.time()
+        return await self._write(lambda conn: conn.execute(RENEW_JOB_LEASE_SQL, (now + lease, now, job_id, worker)).rowcount) > 0
+
+    async def finish_job(self, job_id: int, worker: str, status: str, result: str | None, error: str | None):
+        """Records the outcome ('done' or 'failed') of a job run by `worker`."""
+        await self._write(lambda conn: conn.execute(FINISH_JOB_SQL, (status, result, error, time.time(), job_id, worker)))
+
+    async def requeue_job(self, job_id: int, worker: str):
+        await self._write(lambda conn: conn.execute(REQUEUE_JOB_SQL, (time.time(), job_id, worker)))
+
+    async def get_queued_jobs(self) -> list[sqlite3.Row]:
+        """Returns (job_id, kind) of all queued jobs, oldest first."""
+        return await self._read(lambda conn: conn.execute(QUEUED_JOBS_SQL).fetchall())
+
+    async def take_finished_jobs(self, limit: int) -> list[sqlite3.Row]:
+        """Returns finished jobs not taken before (each is returned once) and drops old taken ones."""
+        now = time.time()
+
+        def take(conn: sqlite3.Connection):
+            rows = conn.execute(TAKE_FINISHED_JOBS_SQL, (limit,)).fetchall()
+            conn.execute(PURGE_JOBS_SQL, (now - JOB_RETENTION_SECONDS,))
+            return rows
+        return await self._write(take)
+
+    async def save_metrics_snapshot(self, process: str, data: str, max_age: float):
+        """Stores a process's metrics snapshot and drops snapshots of processes silent for `max_age` seconds."""
+        now = time.time()
+
+        def store(conn: sqlite3.Connection):
+            conn.execute(SAVE_METRICS_SNAPSHOT_SQL, (process, data, now))
+            conn.execute(EXPIRE_METRICS_SNAPSHOTS_SQL, (now - max_age,))
+        await self._write(store)
+
+    async def get_metrics_snapshots(self, since: float) -> list[sqlite3.Row]:
+        """Returns (process, data, updated_at) of the snapshots stored since `since`."""
+        return await self._read(lambda conn: conn.execute(GET_METRICS_SNAPSHOTS_SQL, (since,)).fetchall())
+
+    async def get_language(self, chat_id: int, user_id: int) -> sqlite3.Row | None:
+        """
+        Returns (language, probability, pinned, chat_wide) of a user in a chat, or else the chat's latest
+        detected language (chat_wide set), or None if neither is known yet.
+        """
+        return await self._read(lambda conn: conn.execute(GET_LANGUAGE_SQL, (chat_id, user_id)).fetchone())
+
+    async def remember_language(self, chat_id: int, user_id: int, language: str, probability: float):
+        """Stores the language detected for a user in a chat (unless they pinned one) and as the chat's fallback."""
+        now = time.time()
+
+        def remember(conn: sqlite3.Connection):
+            conn.execute(REMEMBER_LANGUAGE_SQL, (chat_id, user_id, language, probability, now))
+            conn.execute(REMEMBER_LANGUAGE_SQL, (chat_id, CHAT_LANGUAGE_USER, language, probability, now))
+        await self._write(remember)
+
+    async def pin_language(self, chat_id: int, user_id: int, language: str | None):
+        """Pins a user's transcription language in a chat; None forgets it, so it is detected again."""
+        if language is None:
+            await self._write(lambda conn: conn.execute(FORGET_LANGUAGE_SQL, (chat_id, user_id)))
+        else:
+            await self._write(lambda conn: conn.execute(PIN_LANGUAGE_SQL, (chat_id, user_id, language, time.time())))
+
+    async def reserve_disk(self, path: str, scope: str, process: str, size: int, room: int, quota: int, lease: float) -> bool:
+        """
+        Reserves `size` bytes for a job directory if the scope's live reservations plus `size` fit in both
+        `room` (free disk space above the minimum) and `quota` minus the idle usage. Returns False otherwise.
+        """
+        now = time.time()
+        params = {
+            'path': path, 'scope': scope, 'process': process, 'bytes': size,
+            'expires_at': now + lease, 'now': now, 'room': room, 'quota': quota,
+        }
+        return await self._write(lambda conn: conn.execute(RESERVE_DISK_SQL, params).rowcount) > 0
+
+    async def resize_disk_reservation(self, path: str, size: int):
+        await self._write(lambda conn: conn.execute(RESIZE_DISK_RESERVATION_SQL, (size, path)))
+
+    async def release_disk_reservation(self, path: str):
+        await self._write(lambda conn: conn.execute(RELEASE_DISK_RESERVATION_SQL, (path,)))
+
+    async def renew_disk_reservations(self, process: str, lease: float):
+        """Extends the leases of all reservations held by `process`."""
+        await self._write(lambda conn: conn.execute(RENEW_DISK_RESERVATIONS_SQL, (time.time() + lease, process)))
+
+    async def release_process_disk(self, process: str):
+        """Drops the reservations and the janitor lease of a process that is shutting down."""
+        def release(conn: sqlite3.Connection):
+            conn.execute(RELEASE_PROCESS_DISK_RESERVATIONS_SQL, (process,))
+            conn.execute(RELEASE_DISK_JANITOR_SQL, (process,))
+        await self._write(release)
+
+    async def claim_disk_janitor(self, scope: str, process: str, lease: float) -> bool:
+        """Takes or renews the janitor lease of a scope. Returns True if `process` holds it."""
+        now = time.time()
+        return await self._write(lambda conn: conn.execute(CLAIM_DISK_JANITOR_SQL, (scope, process, now + lease, now)).rowcount) > 0
+
+    async def get_active_disk_reservations(self, scope: str) -> set[str]:
+        """Drops expired reservations of a scope (their processes died) and returns the paths of the rest."""
+        def active(conn: sqlite3.Connection):
+            conn.execute(EXPIRE_DISK_RESERVATIONS_SQL, (scope, time.time()))
+            return {row['path'] for row in conn.execute(ACTIVE_DISK_RESERVATIONS_SQL, (scope,))}
+        return await self._write(active)
+
+    async def set_disk_idle_usage(self, scope: str, process: str, size: int):
+        """Stores the janitor's measurement of the scope's usage outside active jobs."""
+        await self._write(lambda conn: conn.execute(SET_DISK_IDLE_USAGE_SQL, (size, scope, process)))
 
     def close(self):
-        """Closes the database connection."""
-        if self.conn:
-            self.conn.close()
-            logger.info("Database connection closed.")
+        """Waits for queued queries, then closes all connections."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        logger.info("Database connections closed.")
+
+class UserActivityBuffer:
+    """
+    Write-behind buffer for user registration.
+
+    Handlers only record activity in memory (deduplicated per user); a background task
+    writes the buffered users to the database in one batch on an interval, as soon as the
+    buffer reaches a size limit, and once more at shutdown.
+    """
+
+    def __init__(self, database: Database, flush_interval: float, flush_size: int):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending: dict[int, list] = {}
+        self._size_reached = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, user_id: int, first_name: str, last_name: str, username: str):
+        """Records that a user was active now. Never touches the disk."""
+        now = datetime.now(settings.TASHKENT_TZ).strftime("%Y-%m-%d %H:%M:%S")
+        row = self._pending.get(user_id)
+        if row:
+            row[1:4] = first_name, last_name, username
+            row[5] = now
+        else:
+            self._pending[user_id] = [user_id, first_name, last_name, username, now, now]
+            if len(self._pending) >= self.flush_size:
+                self._size_reached.set()
+
+    async def flush(self):
+        """Writes all buffered users to the database in one batch."""
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, {}
+        self._size_reached.clear()
+        try:
+            await self.database.upsert_users([tuple(row) for row in rows.values()])
+            logger.debug(f"Flushed activity of {len(rows)} user(s) to the database.")
+        except Exception as e:
+            logger.error(f"Failed to flush user activity ({len(rows)} users): {e}", exc_info=True)
+            # Put the rows back, keeping any newer activity recorded meanwhile.
+            for user_id, row in rows.items():
+                newer = self._pending.get(user_id)
+                if newer:
+                    newer[4] = row[4]
+                else:
+                    self._pending[user_id] = row
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._size_reached.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        """Starts the background flush task. Must be called from the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background task and flushes whatever is still buffered."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
 
 # --- Global Singleton Instance ---
 # Other modules can `from database import db` and use its methods.
 db = Database()
+user_activity = UserActivityBuffer(db, settings.USER_FLUSH_INTERVAL, settings.USER_FLUSH_SIZE)
 
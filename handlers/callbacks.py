@@ -1,11 +1,18 @@
 import os
 import html
-from telegram import Update, CallbackQuery
+from telegram import Bot, Update, CallbackQuery, Message
 from telegram.ext import ContextTypes
 
 from config import settings, logger
-from utils.helpers import _run_yt_dlp_with_progress, find_first_file, add_metadata_to_song
-from handlers.general import _generate_stats_message_and_keyboard
+from utils.helpers import add_metadata_to_song, open_for_upload
+from utils.downloader import download_media
+from utils.workspace import workspace, DiskQuotaExceeded
+from utils.scheduler import scheduler
+from utils.status import status_updater
+from utils.metrics import time_stage, transferred_bytes
+from utils.job_queue import Job
+from utils.callback_state import song_buttons
+from handlers.general import _generate_stats_message_and_keyboard, _decode_stats_cursor, _queue_position_reporter, _submit_job
 
 async def _handle_stats_pagination(query: CallbackQuery) -> None:
     """Handles the logic for stats pagination."""
@@ -15,8 +22,8 @@ async def _handle_stats_pagination(query: CallbackQuery) -> None:
         return
 
     try:
-        page = int(query.data.split('_')[2])
-        message_text, reply_markup = await _generate_stats_message_and_keyboard(page)
+        page, direction, cursor = _decode_stats_cursor(query.data)
+        message_text, reply_markup = await _generate_stats_message_and_keyboard(page, direction, cursor)
         await query.edit_message_text(
             text=message_text,
             reply_markup=reply_markup,
@@ -44,10 +51,10 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 
 async def _handle_song_download(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handles the logic for downloading a song."""
+    """Handles the song download button: shows the status and queues the download for a media worker."""
     user_id = query.from_user.id
     song_id = query.data.replace('dl_song_', '')
-    song_data = context.bot_data.get(song_id)
+    song_data = await song_buttons.get(song_id)
 
     logger.info(f"Download button pressed: song_id={song_id}, song_data={song_data}")
 
@@ -77,9 +84,40 @@ async def _handle_song_download(query: CallbackQuery, context: ContextTypes.DEFA
             text=text_to_send,
             parse_mode='HTML'
         )
-    audio_path = None
+    await _submit_job(
+        'song',
+        user_id,
+        {'song_id': song_id, 'full_title': full_title, 'youtube_url': youtube_url, 'message': query.message.to_dict()},
+        status_message,
+        f"{full_title} yuklanmoqda..."
+    )
+
+async def run_song_job(bot: Bot, job: Job) -> None:
+    """Media worker side of a 'song' job."""
+    payload = job.payload
+    await _download_song(
+        bot,
+        job.user_id,
+        payload['full_title'],
+        payload['youtube_url'],
+        Message.de_json(payload['message'], bot),
+        Message.de_json(payload['status_message'], bot)
+    )
+
+async def _download_song(
+    bot: Bot,
+    user_id: int,
+    full_title: str,
+    youtube_url: str,
+    button_message: Message,
+    status_message: Message
+) -> None:
+    """Downloads a song as MP3 with metadata and sends it. Runs in a media worker."""
+    job_dir = None
     try:
-        output_template = os.path.join(settings.DOWNLOAD_PATH, f'{user_id}_{song_id}_%(title)s.%(ext)s')
+        # The source audio stream plus the converted MP3.
+        job_dir = await workspace.open('song', user_id, reserve=2 * settings.MAX_FILE_SIZE_MB * 1024 * 1024)
+        output_template = os.path.join(job_dir.path, '%(title).150B.%(ext)s')
         command = [
             'yt-dlp',
             '--extract-audio', # Extract audio
@@ -98,54 +136,64 @@ async def _handle_song_download(query: CallbackQuery, context: ContextTypes.DEFA
         if settings.YOUTUBE_COOKIE_FILE and os.path.exists(settings.YOUTUBE_COOKIE_FILE):
             command.extend(['--cookies', settings.YOUTUBE_COOKIE_FILE])
 
-        return_code, stdout, stderr = await _run_yt_dlp_with_progress(command, query.message, f"🎵 <b>{html.escape(full_title)}</b> yuklanmoqda...")
+        async with scheduler.job('download', user_id, on_queued=_queue_position_reporter(status_message, f"{full_title} yuklanmoqda...")):
+            with time_stage('song_download', 'youtube') as stage:
+                result = await download_media(command, status_message, f"🎵 <b>{html.escape(full_title)}</b> yuklanmoqda...")
+                if not result.ok:
+                    stage.outcome = 'error'
 
-        if ("Sign in to confirm" in stderr or "Signature extraction failed" in stderr):
-            await query.edit_message_text(
+        error_message = result.error or ""
+        if ("Sign in to confirm" in error_message or "Signature extraction failed" in error_message):
+            await status_updater.edit(
+                status_message,
                 f"❌ <b>{html.escape(full_title)}</b> qo'shig'ini yuklab bo'lmadi. YouTube himoyasi tufayli bu faylga kirish cheklangan.",
                 parse_mode='HTML'
             )
             return
 
-        if return_code != 0:
-            logger.error(f"Error downloading song {full_title}: {stderr}")
-            await query.edit_message_text("❌ Qo'shiqni yuklashda xatolik.", parse_mode='HTML')
+        if not result.ok and result.error_class != 'FileNotFoundError':
+            logger.error(f"Error downloading song {full_title}: {error_message}")
+            await status_updater.edit(status_message, "❌ Qo'shiqni yuklashda xatolik.", parse_mode='HTML')
             return
 
-        audio_path = find_first_file(settings.DOWNLOAD_PATH, f'{user_id}_{song_id}_')
+        audio_path = result.filepath
         if not audio_path:
-            await query.edit_message_text("❌ Yuklangan qo'shiq fayli topilmadi.", parse_mode='HTML')
+            await status_updater.edit(status_message, "❌ Yuklangan qo'shiq fayli topilmadi.", parse_mode='HTML')
             return
 
+        transferred_bytes.inc(os.path.getsize(audio_path), direction='download', platform='youtube')
+
         # Add metadata
-        await query.edit_message_text(f"🎵 Metadata qo'shilmoqda...", parse_mode='HTML')
+        await status_updater.edit(status_message, f"🎵 Metadata qo'shilmoqda...", parse_mode='HTML')
         artist, title = (full_title.split(' - ', 1) + [full_title])[:2]
-        await add_metadata_to_song(audio_path, title, artist)
+        async with scheduler.job('audio', user_id):
+            with time_stage('song_metadata'):
+                await add_metadata_to_song(audio_path, title, artist)
 
-        await query.edit_message_text(f"✅ <b>{html.escape(full_title)}</b> yuklandi! Yuborilmoqda...", parse_mode='HTML')
+        await status_updater.edit(status_message, f"✅ <b>{html.escape(full_title)}</b> yuklandi! Yuborilmoqda...", parse_mode='HTML')
 
-        with open(audio_path, 'rb') as audio_file:
-            await context.bot.send_audio(
-                chat_id=query.message.chat_id,
+        with time_stage('song_upload'), open_for_upload(audio_path) as audio_file:
+            await bot.send_audio(
+                chat_id=button_message.chat_id,
                 audio=audio_file,
                 title=title,
                 performer=artist,
-                caption=f"#VortexFetchBot | @{context.bot.username}"
+                caption=f"#VortexFetchBot | @{bot.username}"
             )
-        await query.message.delete() # Delete the original status message
+        transferred_bytes.inc(os.path.getsize(audio_path), direction='upload', platform='youtube')
+        status_updater.discard(status_message)
+        await button_message.delete() # Delete the original status message
 
+    except DiskQuotaExceeded as e:
+        logger.warning(f"Rejected song download for user {user_id}: {e}")
+        await status_updater.edit(status_message, "⏳ Server hozir juda band. Iltimos, birozdan so'ng qayta urinib ko'ring.")
     except Exception as e:
         logger.error(f"Error processing song download: {e}", exc_info=True)
         error_message = f"<b>Xatolik:</b>\n<code>{html.escape(str(e))}</code>"
         try:
-            if status_message.text:
-                await status_message.edit_text(error_message, parse_mode='HTML')
-            elif status_message.caption:
-                await status_message.edit_caption(caption=error_message, parse_mode='HTML')
+            await status_updater.edit(status_message, error_message, parse_mode='HTML')
         except Exception as inner_e:
             logger.error(f"Failed to send final error message: {inner_e}")
     finally:
-        if audio_path and os.path.exists(audio_path):
-            os.remove(audio_path)
-        if song_id in context.bot_data:
-            del context.bot_data[song_id]
+        if job_dir:
+            await job_dir.close()
@@ -1,23 +1,34 @@
 import os
 import html
-import uuid
 import ffmpeg
 import asyncio
-import functools
 import math
 import tempfile
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, constants, Message, error as telegram_error
+import time
+from datetime import datetime, timedelta
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, constants, Message, error as telegram_error
 from telegram.ext import ContextTypes
-from shazamio import Shazam
 from urllib.parse import urlparse, parse_qs
 from youtubesearchpython import VideosSearch
-from yt_dlp import YoutubeDL
 
 from config import settings, logger
 from utils.decorators import register_user
-from utils.helpers import find_first_file, _run_yt_dlp_with_progress, _run_ffmpeg_async
-from transcriber_whisper import transcribe_whisper_sync, transcribe_whisper_stream, transcribe_whisper_full
-from database import db
+from utils.helpers import get_media_key, format_bytes, open_for_upload
+from utils.downloader import download_media, probe_media
+from utils.formats import FormatChoice, select_format, upload_rate
+from utils.workspace import workspace, DiskQuotaExceeded
+from transcriber_whisper import SUPPORTED_LANGUAGES, transcribe_in_pool
+from utils.process_pool import WorkerPoolFull, WorkerJobTimeout, WorkerJobError
+from utils.scheduler import scheduler
+from utils.transcript import StreamingTranscript
+from utils.status import status_updater
+from utils.recognition import recognize_song, recognition_summary
+from utils.metrics import time_stage, platform_of, transferred_bytes, cache_requests
+from utils.metrics_exporter import metrics_exporter, latency_report
+from utils.song_search import song_search
+from utils.job_queue import Job, job_queue, job_watcher
+from utils.callback_state import song_buttons
+from database import db, rollup_bucket
 
 
 # --- Command Handlers ---
@@ -54,6 +65,7 @@ Sizga video yuklash, qo'shiqni aniqlash va ovozni matnga o'girishda yordam beram
 <b>Asosiy Buyruqlar:</b>
 • /start - Botni qayta ishga tushirish
 • /help - Yordam menyusini ko'rsatish
+• /lang - Transkripsiya tilini tanlash (masalan: /lang uz)
 
 Savol va takliflar bo'lsa, bemalol murojaat qiling! 😊
 """
@@ -80,6 +92,97 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.error(f"Failed to generate stats: {e}", exc_info=True)
         await update.message.reply_text("Statistikani ko'rsatishda xatolik yuz berdi.")
 
+@register_user
+async def clear_cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Invalidates cached media results: one entry for a given URL, or everything. Admin-only command."""
+    user = update.effective_user
+    if not user or user.id != settings.ADMIN_ID:
+        await update.message.reply_text("Bu buyruq faqat administrator uchun mavjud.")
+        logger.warning(f"Unauthorized cache clear attempt by user {user.id if user else 'Unknown'}.")
+        return
+
+    if context.args:
+        media_key = await get_media_key(context.args[0])
+        removed = await db.invalidate_media_cache(media_key)
+        logger.info(f"Admin invalidated cache entry '{media_key}' ({removed} removed).")
+        await update.message.reply_text(f"Kesh yozuvi o'chirildi: {media_key} ({removed} ta).")
+    else:
+        removed = await db.invalidate_media_cache()
+        logger.info(f"Admin cleared the whole media cache ({removed} entries).")
+        await update.message.reply_text(f"Kesh to'liq tozalandi ({removed} ta yozuv).")
+
+@register_user
+async def shazam_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows per-window song recognition latency and hit-rate statistics. Admin-only command."""
+    user = update.effective_user
+    if not user or user.id != settings.ADMIN_ID:
+        await update.message.reply_text("Bu buyruq faqat administrator uchun mavjud.")
+        logger.warning(f"Unauthorized shazam stats access attempt by user {user.id if user else 'Unknown'}.")
+        return
+
+    await update.message.reply_text(
+        "🎶 <b>Qo'shiq aniqlash statistikasi</b>\n\n" + recognition_summary(await metrics_exporter.collect()),
+        parse_mode='HTML'
+    )
+
+@register_user
+async def latency_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows p50/p95 latencies of the queue and every media job stage, across all processes. Admin-only command."""
+    user = update.effective_user
+    if not user or user.id != settings.ADMIN_ID:
+        await update.message.reply_text("Bu buyruq faqat administrator uchun mavjud.")
+        logger.warning(f"Unauthorized latency stats access attempt by user {user.id if user else 'Unknown'}.")
+        return
+
+    try:
+        report = latency_report(await metrics_exporter.collect())
+    except Exception as e:
+        logger.error(f"Failed to collect metrics: {e}", exc_info=True)
+        await update.message.reply_text("Statistikani ko'rsatishda xatolik yuz berdi.")
+        return
+    await update.message.reply_text("⏱ <b>Kechikishlar</b>\n\n" + report, parse_mode='HTML')
+
+@register_user
+async def lang_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Shows the user's transcription language in this chat, pins one (/lang uz) or returns to
+    auto-detection (/lang auto). Pins are per user, so in groups they only affect the sender.
+    """
+    chat_id, user_id = update.effective_chat.id, update.effective_user.id
+    if not context.args:
+        remembered = await db.get_language(chat_id, user_id)
+        if not remembered:
+            text = "🌐 Til har safar avtomatik aniqlanadi."
+        elif remembered['pinned']:
+            text = f"📌 Transkripsiya tili: <b>{remembered['language']}</b> (qadalgan)."
+        elif remembered['chat_wide']:
+            text = (
+                f"💬 Bu chatda oxirgi aniqlangan til: <b>{remembered['language']}</b>. "
+                "Sizning tilingiz birinchi transkripsiyada aniqlanadi."
+            )
+        else:
+            text = (
+                f"🧠 Eslab qolingan til: <b>{remembered['language']}</b>. "
+                "Boshqa tilda gapirsangiz, til qayta aniqlanadi."
+            )
+        await update.message.reply_text(
+            text + "\n\nTilni qadash: <code>/lang uz</code>\nAvtomatik aniqlash: <code>/lang auto</code>", parse_mode='HTML'
+        )
+        return
+
+    code = context.args[0].lower()
+    if code == 'auto':
+        await db.pin_language(chat_id, user_id, None)
+        await update.message.reply_text("✅ Til endi avtomatik aniqlanadi.")
+    elif code in SUPPORTED_LANGUAGES:
+        await db.pin_language(chat_id, user_id, code)
+        logger.info(f"User {user_id} pinned transcription language '{code}' in chat {chat_id}.")
+        await update.message.reply_text(f"📌 Transkripsiya tili qadaldi: <b>{code}</b>", parse_mode='HTML')
+    else:
+        await update.message.reply_text(
+            f"❌ Noma'lum til kodi: <code>{html.escape(code)}</code>. Masalan: uz, ru, en.", parse_mode='HTML'
+        )
+
 # --- Message Handlers ---
 
 @register_user
@@ -88,7 +191,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if update.message and update.message.text:
         url = update.message.text
         if url.startswith('http://') or url.startswith('https://'):
-            await _download_video_from_url(url, update, context)
+            await _enqueue_download(url, update)
         else:
             await update.message.reply_text(
                 "Iltimos, video yuklash uchun to'g'ri havolani (URL) yuboring yoki ovozni matnga o'girish uchun media fayl yuboring."
@@ -97,39 +200,60 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 @register_user
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles audio, video, and voice messages for transcription."""
-    await _transcribe_media(update, context)
+    message = update.message
+    if not (message.audio or message.video or message.voice):
+        await message.reply_text("Transkripsiya uchun media fayl topilmadi.")
+        return
+    status_message = await message.reply_text("Fayl qabul qilindi. Whisper modelida tahlil qilinmoqda...")
+    await _submit_job('transcribe', message.from_user.id, {'update': update.to_dict()}, status_message, "Whisper modelida tahlil qilinmoqda...")
+
+# --- Job Queue (the bot only queues media jobs; worker.py runs them) ---
+
+async def _submit_job(kind: str, user_id: int, payload: dict, status_message: Message, resume_text: str) -> None:
+    """Queues a media job for the worker processes. Its queue position is shown until a worker takes it."""
+    try:
+        job_id = await job_queue.enqueue(kind, user_id, {**payload, 'status_message': status_message.to_dict()})
+    except Exception as e:
+        logger.error(f"Failed to queue a {kind} job for user {user_id}: {e}", exc_info=True)
+        await status_updater.edit(status_message, "Kechirasiz, kutilmagan xatolik yuz berdi.")
+        return
+    job_watcher.track(job_id, _queue_position_reporter(status_message, resume_text))
+
+async def _enqueue_download(url: str, update: Update) -> None:
+    """Answers a link from the result cache, or queues its download."""
+    if await _send_cached_video(await get_media_key(url), update):
+        return
+    status_message = await update.message.reply_text("Yuklanmoqda...")
+    await _submit_job('download', update.message.from_user.id, {'url': url, 'update': update.to_dict()}, status_message, "Yuklanmoqda...")
+
+async def run_download_job(bot: Bot, job: Job) -> None:
+    """Media worker side of a 'download' job."""
+    update = Update.de_json(job.payload['update'], bot)
+    await _download_video_from_url(job.payload['url'], update, Message.de_json(job.payload['status_message'], bot))
+
+async def run_transcribe_job(bot: Bot, job: Job) -> None:
+    """Media worker side of a 'transcribe' job."""
+    update = Update.de_json(job.payload['update'], bot)
+    await _transcribe_media(update, Message.de_json(job.payload['status_message'], bot))
 
 # --- Helper Functions (Business Logic) ---
 
-def search_youtube_with_ytdlp(query: str) -> str | None:
-    ydl_opts = {
-        'quiet': True,
-        'skip_download': True,
-        'format': 'bestaudio/best',
-        'noplaylist': True,
-        'default_search': 'ytsearch',
-        'extract_flat': 'in_playlist'
-    }
-    with YoutubeDL(ydl_opts) as ydl:
-        try:
-            result = ydl.extract_info(query, download=False)
-            if 'entries' in result and result['entries']:
-                return f"https://www.youtube.com/watch?v={result['entries'][0]['id']}"
-        except Exception as e:
-            logger.error(f"yt-dlp YouTube search error: {e}")
-    return None
-
-async def _download_video_from_url(url: str, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Core logic to download a video from a given URL."""
+async def _download_video_from_url(url: str, update: Update, status_message: Message) -> None:
+    """Core logic to download a video from a given URL. Runs in a media worker."""
     user_id = update.message.from_user.id
-    status_message = await update.message.reply_text("Yuklanmoqda...")
-    video_path = None
+    media_key = await get_media_key(url)
+    platform = platform_of(url)
+    job_dir = None
+    recognition_task = None
     try:
-        output_template = os.path.join(settings.DOWNLOAD_PATH, f'{user_id}_{update.message.message_id}_%(title)s.%(ext)s')
+        limit_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+        # Merging separate video and audio streams briefly needs room for both and the output.
+        job_dir = await workspace.open('video', user_id, reserve=2 * limit_bytes)
+        output_template = os.path.join(job_dir.path, '%(title).150B.%(ext)s')
         command = [
             'yt-dlp',
-            # Let yt-dlp choose the best quality by not specifying format
-            '--max-filesize', '1.8G',
+            # The format is chosen by the probe below; this only guards against underestimated sizes
+            '--max-filesize', f"{settings.MAX_FILE_SIZE_MB}m",
             '--merge-output-format', 'mp4',  # Ensure final output is mp4
             '-o', output_template, url
         ]
@@ -144,61 +268,57 @@ async def _download_video_from_url(url: str, update: Update, context: ContextTyp
             command.extend(['--cookies', settings.YOUTUBE_COOKIE_FILE])
             logger.info(f"Using YouTube cookie file: {settings.YOUTUBE_COOKIE_FILE}")
 
-        return_code, stdout, stderr = await _run_yt_dlp_with_progress(command, status_message, "Yuklanmoqda...")
-
-        # First, check if yt-dlp reported an error
-        if return_code != 0:
-            error_message = stderr or stdout or "Noma'lum xato"
-            # Try to extract a title from the URL if clean_caption is not available
+        async with scheduler.job('download', user_id, on_queued=_queue_position_reporter(status_message, "Yuklanmoqda...")):
+            # --- Probe: pick a format that fits the upload limit before downloading anything ---
             try:
-                # Try to extract from the URL (for YouTube links)
-                parsed_url = urlparse(url)
-                if 'youtube.com' in url or 'youtu.be' in url:
-                    qs = parse_qs(parsed_url.query)
-                    video_title = qs.get('v', [os.path.basename(parsed_url.path)])[0]
-                else:
-                    video_title = os.path.basename(parsed_url.path)
-            except Exception:
-                video_title = url
-
-            if "Sign in to confirm" in error_message or "Signature extraction failed" in error_message:
-                error_text = (
-                    f"❌ <b>{html.escape(video_title)}</b> videoni yuklab bo'lmadi. "
-                    "YouTube bu faylni faqat ro'yxatdan o'tgan foydalanuvchilarga ko'rsatmoqda yoki himoya o'rnatilgan."
-                )
-            else:
-                error_text = (
-                    f"❌ <b>{html.escape(video_title)}</b> videoni yuklab bo'lmadi.\n"
-                    f"Sabab: {html.escape(error_message[:1000])}"
-                )
-            await status_message.edit_text(error_text, parse_mode='HTML')
+                with time_stage('probe', platform):
+                    summary = await probe_media(command)
+            except WorkerJobError as e:
+                await status_updater.edit(status_message, _download_error_text(url, e.message), parse_mode='HTML')
+                return
+            choice = select_format(summary, limit_bytes)
+            _log_format_choice(url, choice)
+            if choice.action in ('reject', 'audio_only'):
+                await _offer_smaller_alternative(status_message, url, summary, choice)
+                return
+            if choice.action == 'download':
+                command[1:1] = ['-f', choice.format_spec]
+                await job_dir.shrink_reservation(2 * choice.size)
+
+            with time_stage('download', platform) as stage:
+                result = await download_media(command, status_message, "Yuklanmoqda...")
+                if not result.ok:
+                    stage.outcome = 'error'
+
+        # First, check if yt-dlp reported an error (a missing file is reported separately below)
+        if not result.ok and result.error_class != 'FileNotFoundError':
+            await status_updater.edit(status_message, _download_error_text(url, result.error), parse_mode='HTML')
             return
 
-        # After download, find the file using the correct prefix
-        file_prefix = f"{user_id}_{update.message.message_id}"
-        video_path = find_first_file(settings.DOWNLOAD_PATH, file_prefix)
-
         # Check if a file was actually downloaded
+        video_path = result.filepath
         if not video_path:
-            logger.error(f"File not found after download for {url}, despite yt-dlp exiting with code 0.")
-            logger.error(f"yt-dlp stdout: {stdout}")
-            logger.error(f"yt-dlp stderr: {stderr}")
-            await status_message.edit_text(
+            logger.error(f"File not found after download for {url}, despite yt-dlp reporting no error.")
+            logger.error(f"yt-dlp output: {result.error}")
+            await status_updater.edit(
+                status_message,
                 "❌ Xatolik: Video fayl topilmadi. Bu shaxsiy (private) video bo'lishi, "
                 "havola noto'g'ri bo'lishi yoki cookie faylingiz eskirgan bo'lishi mumkin."
             )
             return
 
         logger.info(f"Downloaded to: {video_path}")
+        transferred_bytes.inc(os.path.getsize(video_path), direction='download', platform=platform)
 
-        await status_message.edit_text("✅ Video muvaffaqiyatli yuklandi!")
+        await status_updater.edit(status_message, "✅ Video yuklandi. Yuborilmoqda va qo'shiq aniqlanmoqda...")
 
-        # --- Recognize Song ---
-        inline_markup = await _recognize_and_offer_song_download(context, status_message, video_path, user_id, update.update_id)
+        # --- Recognize Song (in the background, overlapping the upload) ---
+        recognition_task = asyncio.create_task(
+            _recognize_in_audio_pool(status_message, video_path, user_id)
+        )
 
         # --- Send Video to User ---
-        await status_message.edit_text("Video yuborilmoqda...")
-        clean_caption = ' '.join(os.path.basename(video_path).split('_')[2:])
+        clean_caption = result.info.get('title') or os.path.splitext(os.path.basename(video_path))[0]
         
         # Retry logic for Telegram API timeout
         max_retries = 3
@@ -207,91 +327,209 @@ async def _download_video_from_url(url: str, update: Update, context: ContextTyp
         
         for attempt in range(max_retries):
             try:
-                with open(video_path, 'rb') as video_file:
-                    # Use read() to get file object instead of passing path directly
-                    await update.message.reply_video(
+                upload_started = time.monotonic()
+                with time_stage('upload', platform), open_for_upload(video_path) as video_file:
+                    sent_message = await update.message.reply_video(
                         video=video_file,
                         caption=clean_caption,
-                        reply_markup=inline_markup,
-                        read_timeout=300,  # 5 minutes timeout for large files
+                        read_timeout=settings.UPLOAD_TIMEOUT,
                         write_timeout=300,
                         connect_timeout=60,
                         pool_timeout=60
                     )
+                upload_rate.record(os.path.getsize(video_path), time.monotonic() - upload_started)
+                transferred_bytes.inc(os.path.getsize(video_path), direction='upload', platform=platform)
                 break  # Success, break out of retry loop
             except telegram_error.TimedOut as e:
                 last_exception = e
                 if attempt == max_retries - 1:
                     logger.error(f"Failed to upload video after {max_retries} attempts")
-                    await status_message.edit_text("❌ Xatolik: Video hajmi juda katta yoki internet tezligi sekin.")
+                    await status_updater.edit(status_message, "❌ Xatolik: Video hajmi juda katta yoki internet tezligi sekin.")
                     return
                 await asyncio.sleep(retry_delay)
                 retry_delay *= 2  # Exponential backoff
                 logger.warning(f"Upload attempt {attempt + 1} failed, retrying...")
             except Exception as e:
                 logger.error(f"Unexpected error during video upload: {e}", exc_info=True)
-                await status_message.edit_text("❌ Xatolik: Videoni yuklashda kutilmagan xato yuz berdi.")
+                await status_updater.edit(status_message, "❌ Xatolik: Videoni yuklashda kutilmagan xato yuz berdi.")
                 return
 
+        # The video is already with the user; attach the song button once recognition finishes.
+        inline_markup, song = await recognition_task
+        if inline_markup:
+            try:
+                await sent_message.edit_reply_markup(reply_markup=inline_markup)
+            except telegram_error.TelegramError as e:
+                logger.warning(f"Could not attach song keyboard to the sent video: {e}")
+                inline_markup = None
+
+        await _store_cached_video(media_key, sent_message, clean_caption, song)
+
         if not inline_markup:
-            await status_message.edit_text("✅ Video yuborildi. Unda musiqa topilmadi.")
+            await status_updater.edit(status_message, "✅ Video yuborildi. Unda musiqa topilmadi.")
         else:
+            status_updater.discard(status_message)
             await status_message.delete()
 
+    except DiskQuotaExceeded as e:
+        logger.warning(f"Rejected download for user {user_id}: {e}")
+        await status_updater.edit(status_message, "⏳ Server hozir juda band. Iltimos, birozdan so'ng qayta urinib ko'ring.")
     except Exception as e:
         logger.error(f"Unexpected error during video download: {e}", exc_info=True)
-        await status_message.edit_text("Kechirasiz, kutilmagan xatolik yuz berdi.")
+        await status_updater.edit(status_message, "Kechirasiz, kutilmagan xatolik yuz berdi.")
     finally:
-        if video_path and os.path.exists(video_path):
-            os.remove(video_path)
+        # Recognition still reads the file if the upload failed early; stop it before deleting.
+        if recognition_task and not recognition_task.done():
+            recognition_task.cancel()
+            await asyncio.gather(recognition_task, return_exceptions=True)
+        if job_dir:
+            await job_dir.close()
+
+def _download_error_text(url: str, error_message: str | None) -> str:
+    """Builds the user-facing (HTML) text for a failed download or probe."""
+    error_message = error_message or "Noma'lum xato"
+    # Try to extract a title from the URL if clean_caption is not available
+    try:
+        # Try to extract from the URL (for YouTube links)
+        parsed_url = urlparse(url)
+        if 'youtube.com' in url or 'youtu.be' in url:
+            qs = parse_qs(parsed_url.query)
+            video_title = qs.get('v', [os.path.basename(parsed_url.path)])[0]
+        else:
+            video_title = os.path.basename(parsed_url.path)
+    except Exception:
+        video_title = url
+
+    if "Sign in to confirm" in error_message or "Signature extraction failed" in error_message:
+        return (
+            f"❌ <b>{html.escape(video_title)}</b> videoni yuklab bo'lmadi. "
+            "YouTube bu faylni faqat ro'yxatdan o'tgan foydalanuvchilarga ko'rsatmoqda yoki himoya o'rnatilgan."
+        )
+    return (
+        f"❌ <b>{html.escape(video_title)}</b> videoni yuklab bo'lmadi.\n"
+        f"Sabab: {html.escape(error_message[:1000])}"
+    )
 
-async def _recognize_and_offer_song_download(
-    context: ContextTypes.DEFAULT_TYPE,
+def _log_format_choice(url: str, choice: FormatChoice) -> None:
+    """Logs the probe's decision and the bandwidth/disk and upload time it saves compared to the default format."""
+    if choice.action == 'unknown':
+        logger.info(f"No size information for {url}; downloading the default format with a size guard.")
+        return
+    saved = choice.saved_bytes
+    logger.info(
+        f"Format selection for {url}: {choice.action} {choice.format_spec or ''} (~{format_bytes(choice.size)}), "
+        f"best available {choice.best_spec} (~{format_bytes(choice.best_size)}); "
+        f"saved ~{format_bytes(saved)} of download and disk, ~{upload_rate.estimate_seconds(saved):.0f}s of upload."
+    )
+
+async def _offer_smaller_alternative(
+    status_message: Message,
+    url: str,
+    summary: dict,
+    choice: FormatChoice
+) -> None:
+    """Tells the user the video does not fit the upload limit, offering the audio only where that fits."""
+    limit_text = f"{settings.MAX_FILE_SIZE_MB} MB"
+    title = summary.get('title') or url
+    status_updater.discard(status_message)
+    if summary.get('is_live'):
+        await status_message.edit_text("❌ Jonli efirni yuklab bo'lmaydi.")
+    elif choice.action == 'audio_only':
+        await status_message.edit_text(
+            f"⚠️ <b>{html.escape(title)}</b> videosi (~{format_bytes(choice.best_size)}) "
+            f"Telegram chegarasiga ({limit_text}) sig'maydi. Faqat audiosini yuklab olishingiz mumkin:",
+            parse_mode='HTML',
+            reply_markup=await _build_song_keyboard(title, url)
+        )
+    else:
+        await status_message.edit_text(
+            f"❌ <b>{html.escape(title)}</b> juda katta (~{format_bytes(choice.best_size)}). "
+            f"Telegram orqali yuborish chegarasi: {limit_text}.",
+            parse_mode='HTML'
+        )
+
+def _queue_position_reporter(status_message: Message, resume_text: str):
+    """
+    Returns an `on_queued` callback for the job scheduler that shows the user's queue position
+    in the status message. The message is left as is when the job starts without waiting.
+    """
+    async def report(position: int) -> None:
+        text = f"⏳ Navbatdasiz: <b>{position}</b>-o'rin.\n<i>{html.escape(resume_text)}</i>"
+        status_updater.update(status_message, text, 'HTML')
+    return report
+
+async def _send_cached_video(media_key: str, update: Update) -> bool:
+    """Answers from the result cache without downloading or uploading. Returns True on a cache hit."""
+    cached = await db.get_cached_media(media_key)
+    if not cached:
+        cache_requests.inc(cache='media', result='miss')
+        return False
+
+    inline_markup = None
+    if cached['song_url']:
+        inline_markup = await _build_song_keyboard(cached['song_title'], cached['song_url'])
+    try:
+        await update.message.reply_video(video=cached['file_id'], caption=cached['caption'], reply_markup=inline_markup)
+    except telegram_error.BadRequest as e:
+        # The file_id is no longer accepted by Telegram; drop it and fall back to a fresh download.
+        logger.warning(f"Cached file_id for {media_key} rejected by Telegram: {e}")
+        await db.invalidate_media_cache(media_key)
+        cache_requests.inc(cache='media', result='miss')
+        return False
+    cache_requests.inc(cache='media', result='hit')
+    logger.info(f"Cache hit for {media_key}")
+    return True
+
+async def _store_cached_video(media_key: str, sent_message: Message, caption: str, song: dict | None) -> None:
+    """Remembers the file_id of an uploaded video (and its recognized song) for later requests."""
+    media = sent_message.video or sent_message.animation or sent_message.document
+    if not media:
+        return
+    try:
+        await db.cache_media(
+            media_key,
+            media.file_id,
+            caption,
+            song['full_title'] if song else None,
+            song['youtube_url'] if song else None
+        )
+    except Exception as e:
+        logger.error(f"Failed to cache result for {media_key}: {e}", exc_info=True)
+
+async def _build_song_keyboard(full_title: str, youtube_url: str) -> InlineKeyboardMarkup:
+    """
+    Registers a song for the download callback and returns the inline keyboard offering it.
+    The same track always gets the same button, and any bot process can answer it.
+    """
+    song_id = await song_buttons.register(full_title, youtube_url)
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("🎵 Yuklab olish (Audio)", callback_data=f"dl_song_{song_id}")
+    ]])
+
+async def _recognize_in_audio_pool(
     status_message: Message,
     video_filepath: str,
-    user_id: int,
-    update_id: int
-) -> InlineKeyboardMarkup | None:
-    """Extracts audio, recognizes a song, and offers a download if found."""
+    user_id: int
+) -> tuple[InlineKeyboardMarkup | None, dict | None]:
+    """Runs song recognition inside an 'audio' scheduler slot."""
+    async with scheduler.job('audio', user_id):
+        return await _recognize_and_offer_song_download(status_message, video_filepath)
+
+async def _recognize_and_offer_song_download(
+    status_message: Message,
+    video_filepath: str
+) -> tuple[InlineKeyboardMarkup | None, dict | None]:
+    """Recognizes a song from short in-memory audio windows and offers a download if found. Returns the keyboard and the song."""
     logger.info("Recognizing song...")
-    audio_path = None
-    delete_audio_file = True  # Default to deleting the file
     try:
-        # Audio ajratiladi
-        audio_path = os.path.join(settings.DOWNLOAD_PATH, f"{user_id}_{update_id}_shazam.wav")
-        # Try stereo and higher bitrate for better Shazam results
-        await _run_ffmpeg_async(functools.partial(
-            ffmpeg.input(video_filepath).output(
-                audio_path,
-                format='wav',
-                acodec='pcm_s16le',
-                ac=2,  # stereo
-                ar='44100',
-                audio_bitrate='192k'
-            ).run,
-            overwrite_output=True, quiet=True
-        ))
-        logger.info(f"Audio extracted for Shazam: {audio_path}")
-
-        # Shazam yordamida aniqlash
-        shazam = Shazam()
-        try:
-            recognition_result = await asyncio.wait_for(shazam.recognize(audio_path), timeout=45.0)
-        except Exception as e:
-            logger.error(f"Shazam recognize error: {e}")
-            await status_message.edit_text("Shazam aniqlashda xatolik yoki vaqt tugashi. Yordam uchun ajratilgan audio yuborilmoqda.")
-            delete_audio_file = False # Keep file for debugging
-            return None
-
-        track_info = recognition_result.get('track')
+        with time_stage('recognize') as stage:
+            track_info = await recognize_song(video_filepath)
+            if not track_info:
+                stage.outcome = 'miss'
         if not track_info:
-            await status_message.edit_text("Qo'shiq topilmadi. Yordam uchun ajratilgan audio yuborilmoqda.")
-            logger.warning(f"No track found by Shazam for {audio_path}")
-            delete_audio_file = False # Keep file for debugging
-            return None
-
-        # On success, we don't need the local audio file anymore
-        delete_audio_file = True
+            await status_updater.edit(status_message, "Qo'shiq topilmadi.")
+            logger.warning(f"No track found by Shazam for {video_filepath}")
+            return None, None
 
         # Youtube URL olish (Shazamdan yoki qidiruvdan)
         youtube_url = next((
@@ -309,138 +547,197 @@ async def _recognize_and_offer_song_download(
             youtube_source = "Shazam orqali topildi"
         else:
             logger.info(f"Shazam'dan YouTube havolasi topilmadi. '{full_title}' uchun YouTube'da qidirilmoqda...")
-            youtube_url = search_youtube_with_ytdlp(full_title)
+            with time_stage('song_search') as stage:
+                youtube_url = await song_search.find_youtube_url(full_title)
+                if not youtube_url:
+                    stage.outcome = 'miss'
             if youtube_url:
                 youtube_source = "YouTube qidiruvi (yt-dlp) orqali topildi"
 
         logger.info(f"Song recognized: {full_title}")
         if youtube_url:
-            await status_message.edit_text(
+            await status_updater.edit(
+                status_message,
                 f"🎶 Qo'shiq topildi: <b>{html.escape(full_title)}</b>\n<i>{youtube_source}</i>", parse_mode='HTML'
             )
-            song_id = str(uuid.uuid4())
-            context.bot_data[song_id] = {
-                'full_title': full_title,
-                'youtube_url': youtube_url
-            }
-            return InlineKeyboardMarkup([[ 
-                InlineKeyboardButton("🎵 Yuklab olish (Audio)", callback_data=f"dl_song_{song_id}")
-            ]])
+            song = {'full_title': full_title, 'youtube_url': youtube_url}
+            return await _build_song_keyboard(full_title, youtube_url), song
         else:
             logger.warning(f"'{full_title}' uchun YouTube'dan havola topilmadi.")
             await status_message.reply_text(
                 f"<b>{html.escape(full_title)}</b> aniqlandi, ammo yuklab olish uchun mos havola topilmadi.",
                 parse_mode='HTML'
             )
-            return None
+            return None, None
 
     except ffmpeg.Error as e:
         logger.error(f"ffmpeg error: {e.stderr.decode() if e.stderr else e}")
-        await status_message.edit_text("Audioni ajratib olishda xatolik.")
-        delete_audio_file = False
-    except asyncio.TimeoutError:
-        logger.warning(f"Shazam recognition timed out for {video_filepath}")
-        await status_message.edit_text("Qo'shiqni aniqlash vaqti tugadi.")
-        delete_audio_file = False
+        await status_updater.edit(status_message, "Audioni ajratib olishda xatolik.")
     except Exception as e:
         logger.error(f"Error recognizing song: {e}", exc_info=True)
-        await status_message.edit_text("Qo'shiqni aniqlashda xatolik.")
-        delete_audio_file = False
-    finally:
-        # Send the extracted audio to the user for debugging if we decided not to delete it
-        if not delete_audio_file and audio_path and os.path.exists(audio_path):
-            logger.info(f"Not deleting {audio_path} for debugging purposes.")
-            try:
-                with open(audio_path, 'rb') as audio_file:
-                    await status_message.reply_audio(audio=audio_file, caption="Aniqlash uchun ishlatilgan audio")
-            except Exception as e:
-                logger.warning(f"Could not send extracted audio for debugging: {e}")
-        elif delete_audio_file and audio_path and os.path.exists(audio_path):
-            logger.info(f"Deleting temporary audio file: {audio_path}")
-            os.remove(audio_path)
-    return None
+        await status_updater.edit(status_message, "Qo'shiqni aniqlashda xatolik.")
+    return None, None
+
 
+async def _remember_language(chat_id: int, user_id: int, outcome: dict) -> None:
+    """Stores a confidently detected language as the user's (and the chat's fallback) hint for the next transcriptions."""
+    probability = outcome.get('probability')
+    if probability is not None and probability >= settings.LANGUAGE_MEMORY_MIN_PROBABILITY:
+        await db.remember_language(chat_id, user_id, outcome['language'], probability)
 
-async def _transcribe_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Core logic to transcribe a media file using Whisper only, with language auto-detection and chunking."""
+
+async def _transcribe_media(update: Update, status_message: Message) -> None:
+    """
+    Core logic to transcribe a media file using Whisper only, with language auto-detection and chunking.
+    Runs in a media worker.
+    """
     message = update.message
     user_id = message.from_user.id
     file_to_download = message.audio or message.video or message.voice
-
-    if not file_to_download:
-        await message.reply_text("Transkripsiya uchun media fayl topilmadi.")
-        return
-
-    status_message = await message.reply_text("Fayl qabul qilindi. Whisper modelida tahlil qilinmoqda...")
-    downloaded_file_path, output_audio_path = None, None
+    job_dir = None
+    streaming_transcript = None
     try:
-        file_id = file_to_download.file_id
-        file = await context.bot.get_file(file_id)
-        original_filename = getattr(file_to_download, 'file_name', f'{file_id}.ogg')
-        downloaded_file_path = os.path.join(settings.DOWNLOAD_PATH, f"{user_id}_{file_id}_{original_filename}")
-        await file.download_to_drive(downloaded_file_path)
-        logger.info(f"File downloaded for transcription: {downloaded_file_path}")
-
-        audio_path_to_transcribe = downloaded_file_path
-        if message.video:
-            await status_message.edit_text("Videodan audio ajratib olinmoqda...")
-            output_audio_path = os.path.join(settings.DOWNLOAD_PATH, f"{user_id}_{file_id}_extracted.mp3")
-            await _run_ffmpeg_async(functools.partial(
-                ffmpeg.input(downloaded_file_path).output(output_audio_path, acodec='libmp3lame', ar='16000').run,
-                overwrite_output=True, quiet=True
-            ))
-            audio_path_to_transcribe = output_audio_path
-
-        await status_message.edit_text("Audio tahlil qilinmoqda (Whisper)...")
-        loop = asyncio.get_event_loop()
-        transcript, detected_lang = await loop.run_in_executor(None, transcribe_whisper_full, audio_path_to_transcribe)
+        file_size = file_to_download.file_size or 0
+        # Small voice notes and audio files stay in memory; the Whisper worker decodes the bytes directly.
+        in_memory = not message.video and 0 < file_size <= settings.TRANSCRIBE_IN_MEMORY_MB * 1024 * 1024
+        if not in_memory:
+            job_dir = await workspace.open('transcribe', user_id, reserve=file_size)
+        with time_stage('download', 'telegram'):
+            file = await file_to_download.get_file()
+            if in_memory:
+                audio = bytes(await file.download_as_bytearray())
+                downloaded_size = len(audio)
+            else:
+                original_filename = getattr(file_to_download, 'file_name', None) or f'{file_to_download.file_id}.ogg'
+                audio = os.path.join(job_dir.path, os.path.basename(original_filename))
+                await file.download_to_drive(audio)
+                downloaded_size = os.path.getsize(audio)
+        transferred_bytes.inc(downloaded_size, direction='download', platform='telegram')
+        logger.info(f"File downloaded for transcription ({downloaded_size} bytes): {'in memory' if in_memory else audio}")
+
+        async with scheduler.job('transcribe', user_id, on_queued=_queue_position_reporter(status_message, "Audio tahlil qilinmoqda (Whisper)...")):
+            await status_updater.edit(status_message, "Audio tahlil qilinmoqda (Whisper)...")
+            # Segments are shown as they are decoded instead of after the whole file is done.
+            streaming_transcript = StreamingTranscript(status_message)
+            # Transcriptions still waiting for a media worker make the tiering policy pick cheaper models.
+            backlog = (await job_queue.queue_depths()).get('transcribe', 0)
+            remembered = await db.get_language(message.chat_id, user_id)
+            language_outcome = {}
+            with time_stage('transcribe'):
+                transcript, detected_lang = await transcribe_in_pool(
+                    audio, on_segment=streaming_transcript.add_segment, duration=file_to_download.duration, backlog=backlog,
+                    language=remembered['language'] if remembered else None, pinned=bool(remembered and remembered['pinned']),
+                    on_language=language_outcome.update
+                )
+            await _remember_language(message.chat_id, user_id, language_outcome)
         if transcript and transcript.strip():
-            lang_text = f"\U0001F310 Aniqlangan til: <b>{detected_lang}</b>\n"
-            chunks = [transcript[i:i+4096] for i in range(0, len(transcript), 4096)]
-            await status_message.edit_text(lang_text + "\u2705 <b>Transkripsiya yakunlandi!</b>\n---\n" + chunks[0], parse_mode='HTML')
-            for chunk in chunks[1:]:
-                await update.message.reply_text(chunk, parse_mode='HTML')
+            await streaming_transcript.finish(detected_lang)
         else:
-            await status_message.edit_text("\u274C Transkripsiya natijasi topilmadi.")
-    except ffmpeg.Error as e:
-        error_details = e.stderr.decode() if e.stderr else "Noma'lum xato"
-        logger.error(f"ffmpeg error during audio extraction: {error_details}")
-        await status_message.edit_text(f"Videodan audioni ajratib olishda xatolik: {error_details[:100]}")
+            await status_updater.edit(status_message, "\u274C Transkripsiya natijasi topilmadi.")
+    except DiskQuotaExceeded as e:
+        logger.warning(f"Rejected transcription for user {user_id}: {e}")
+        await status_updater.edit(status_message, "⏳ Hozir navbat juda band. Iltimos, birozdan so'ng qayta urinib ko'ring.")
+    except WorkerPoolFull:
+        logger.warning(f"Transcription queue is full; rejecting job from user {user_id}.")
+        await status_updater.edit(status_message, "⏳ Hozir navbat juda band. Iltimos, birozdan so'ng qayta urinib ko'ring.")
+    except WorkerJobTimeout:
+        logger.warning(f"Transcription timed out for user {user_id}.")
+        await status_updater.edit(status_message, "❌ Transkripsiya vaqti tugadi. Fayl juda uzun bo'lishi mumkin.")
+    except WorkerJobError as e:
+        logger.error(f"Transcription failed in the Whisper worker for user {user_id}: {e}")
+        if e.error_class == 'AudioDecodeError':
+            await status_updater.edit(status_message, f"Fayldan audioni o'qishda xatolik: {e.message[:100]}")
+        else:
+            await status_updater.edit(status_message, "Faylni qayta ishlashda kutilmagan xatolik.")
     except Exception as e:
         logger.error(f"Error in transcription process: {e}", exc_info=True)
-        await status_message.edit_text("Faylni qayta ishlashda kutilmagan xatolik.")
+        await status_updater.edit(status_message, "Faylni qayta ishlashda kutilmagan xatolik.")
     finally:
-        for path in [downloaded_file_path, output_audio_path]:
-            if path and os.path.exists(path):
-                os.remove(path)
+        if streaming_transcript:
+            await streaming_transcript.stop()
+        if job_dir:
+            await job_dir.close()
 
 STATS_PAGE_LIMIT = 10
+# Days of new-user history shown by /stats.
+STATS_NEW_USERS_DAYS = 7
+
+
+def _encode_stats_cursor(page: int, direction: str, user) -> str:
+    """
+    Builds the callback data of a stats navigation button: the target page, the direction ('n'ext or
+    'p'revious) and the (last_seen, user_id) keyset cursor of the row the page starts after/before.
+    """
+    stamp = user['last_seen'].replace('-', '').replace(' ', '').replace(':', '')
+    return f"stats_page_{page}_{direction}_{stamp}_{user['user_id']}"
+
+
+def _decode_stats_cursor(data: str) -> tuple[int, str | None, tuple[str, int] | None]:
+    """Parses stats navigation callback data into (page, direction, cursor). Raises ValueError/IndexError if malformed."""
+    parts = data.split('_')
+    page = int(parts[2])
+    if len(parts) == 3:
+        return page, None, None
+    direction, stamp, user_id = parts[3], parts[4], int(parts[5])
+    if direction not in ('n', 'p') or len(stamp) != 14:
+        raise ValueError(f"Invalid stats cursor: {data}")
+    last_seen = datetime.strptime(stamp, "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+    return page, direction, (last_seen, user_id)
+
+
+async def _activity_summary() -> str:
+    """Returns the active/new user lines of /stats, read from the pre-aggregated rollups."""
+    now = datetime.now(settings.TASHKENT_TZ)
+    today, this_week = rollup_bucket('day', now), rollup_bucket('week', now)
+    since = rollup_bucket('day', now - timedelta(days=STATS_NEW_USERS_DAYS - 1))
+    days = await db.get_activity_rollup('day', since)
+    weeks = await db.get_activity_rollup('week', this_week)
+    active_today = next((row['active_users'] for row in days if row['bucket'] == today), 0)
+    new_today = next((row['new_users'] for row in days if row['bucket'] == today), 0)
+    active_week = next((row['active_users'] for row in weeks if row['bucket'] == this_week), 0)
+    new_recent = sum(row['new_users'] for row in days)
+    return (
+        f"Bugun faol: <b>{active_today}</b> (yangi: <b>{new_today}</b>)\n"
+        f"Shu hafta faol: <b>{active_week}</b>\n"
+        f"Oxirgi {STATS_NEW_USERS_DAYS} kunda yangi: <b>{new_recent}</b>\n"
+    )
+
 
-async def _generate_stats_message_and_keyboard(page: int) -> tuple[str, InlineKeyboardMarkup | None]:
-    """Generates the statistics message and pagination keyboard for a given page."""
-    total_users = db.get_total_user_count()
+async def _generate_stats_message_and_keyboard(
+    page: int, direction: str | None = None, cursor: tuple[str, int] | None = None
+) -> tuple[str, InlineKeyboardMarkup | None]:
+    """
+    Generates the statistics message and pagination keyboard for a given page.
+    Pages are fetched by keyset (`cursor` and `direction` come from the navigation button), so
+    every page costs the same index range scan no matter how deep it is.
+    """
+    total_users = await db.get_total_user_count()
     if total_users == 0:
         return "Foydalanuvchilar hali mavjud emas.", None
 
-    users = db.get_users_paginated(page=page + 1, limit=STATS_PAGE_LIMIT)
+    users = await db.get_users_page(STATS_PAGE_LIMIT, cursor=cursor, before=direction == 'p')
+    if direction == 'p' and len(users) < STATS_PAGE_LIMIT:
+        # Rows moved to the top since the previous page was shown; start over from the first page.
+        page, users = 0, await db.get_users_page(STATS_PAGE_LIMIT)
     if not users:
         return "Bu sahifada foydalanuvchilar topilmadi.", None
 
-    message_text = f"📊 <b>Bot Statistikasi</b> 📊\n\nJami foydalanuvchilar: <b>{total_users}</b>\n\n"
+    message_text = f"📊 <b>Bot Statistikasi</b> 📊\n\nJami foydalanuvchilar: <b>{total_users}</b>\n"
+    message_text += await _activity_summary() + "\n"
     message_text += "<b>Oxirgi kirgan foydalanuvchilar:</b>\n"
     for user in users:
         display_name = user['first_name'] or user['username'] or str(user['user_id'])
         last_seen = user['last_seen']
         message_text += f"- <a href='tg://user?id={user['user_id']}'>{display_name}</a> (So'nggi faollik: {last_seen})\n"
 
-    total_pages = math.ceil(total_users / STATS_PAGE_LIMIT)
+    total_pages = max(1, math.ceil(total_users / STATS_PAGE_LIMIT))
     message_text += f"\nSahifa: {page + 1}/{total_pages}"
 
     navigation_buttons = []
     if page > 0:
-        navigation_buttons.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"stats_page_{page - 1}"))
-    if page < total_pages - 1:
-        navigation_buttons.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"stats_page_{page + 1}"))
+        navigation_buttons.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=_encode_stats_cursor(page - 1, 'p', users[0])))
+    if page < total_pages - 1 and len(users) == STATS_PAGE_LIMIT:
+        navigation_buttons.append(InlineKeyboardButton("Keyingi ➡️", callback_data=_encode_stats_cursor(page + 1, 'n', users[-1])))
 
     keyboard = [navigation_buttons] if navigation_buttons else None
     return message_text, InlineKeyboardMarkup(keyboard) if keyboard else None
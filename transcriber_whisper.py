@@ -1,31 +1,274 @@
+import time
+import asyncio
+import itertools
+import subprocess
+import numpy as np
 from faster_whisper import WhisperModel
+from faster_whisper.vad import VadOptions, get_speech_timestamps
 
-MODEL_SIZE = "base"  # or "small", "medium", "large-v2"
-
-# Model is loaded once per process
-_model = None
-
-def get_model():
-    global _model
-    if _model is None:
-        _model = WhisperModel(MODEL_SIZE, device="cpu", compute_type="int8")
-    return _model
-
-def transcribe_whisper_sync(audio_path):
-    model = get_model()
-    segments, info = model.transcribe(audio_path, beam_size=1)
-    text = " ".join([segment.text.strip() for segment in segments])
-    return text
-
-def transcribe_whisper_stream(audio_path):
-    model = get_model()
-    segments, info = model.transcribe(audio_path, beam_size=1)
-    for idx, segment in enumerate(segments, start=1):
-        yield idx, len(segments), segment.text.strip()
-
-def transcribe_whisper_full(audio_path):
-    model = get_model()
-    segments, info = model.transcribe(audio_path, beam_size=1)
-    text = " ".join([segment.text.strip() for segment in segments])
-    detected_lang = getattr(info, "language", "unknown")
-    return text, detected_lang 
\ No newline at end of file
+from config import settings, logger
+from utils.process_pool import ProcessWorkerPool, serve
+from utils.metrics import stage_seconds, whisper_rtf, language_hints, language_detection_seconds
+from utils.whisper_policy import ModelChoice, model_policy
+
+# Whisper works on 16 kHz mono audio; inputs are decoded straight to that as float32 samples.
+SAMPLE_RATE = 16000
+# Language codes Whisper can be told to use (for /lang). faster-whisper only exposes the list through a
+# loaded model (`supported_languages`), so the bot reads the tokenizer's table; the version is pinned in
+# requirements.txt and the worker still checks each hint against its model.
+try:
+    from faster_whisper.tokenizer import _LANGUAGE_CODES as _WHISPER_LANGUAGE_CODES
+except ImportError:
+    _WHISPER_LANGUAGE_CODES = ()
+    logger.warning("faster-whisper's language list is unavailable; /lang cannot pin languages.")
+SUPPORTED_LANGUAGES = frozenset(_WHISPER_LANGUAGE_CODES)
+
+# A language hint is dropped when the first segment decodes below this average log-probability
+# (Whisper's own threshold for a failed decode).
+HINT_MIN_AVG_LOGPROB = -1.0
+
+# Models are loaded once per process and kept, by name (the tiers of WHISPER_MODELS)
+_models: dict[str, WhisperModel] = {}
+_model_options = {'cpu_threads': 0, 'num_workers': 1}
+
+def get_model(name: str | None = None) -> WhisperModel:
+    """Returns a loaded model; the best configured tier by default."""
+    name = name or settings.WHISPER_MODELS[-1]
+    if name not in _models:
+        _models[name] = WhisperModel(
+            name, device=settings.WHISPER_DEVICE, compute_type=settings.WHISPER_COMPUTE_TYPE, **_model_options
+        )
+    return _models[name]
+
+class AudioDecodeError(Exception):
+    """Raised when ffmpeg cannot decode the input audio."""
+    pass
+
+def decode_audio(source, start: float = 0.0, duration: float | None = None) -> np.ndarray:
+    """
+    Decodes a file path or the bytes of a media file into 16 kHz mono float32 samples through an
+    ffmpeg pipe, in a single pass and without writing intermediate files.
+    `start`/`duration` (seconds) decode only part of the input.
+    """
+    from_memory = isinstance(source, (bytes, bytearray))
+    clip = (['-ss', f"{start:.3f}"] if start else []) + (['-t', f"{duration:.3f}"] if duration else [])
+    command = [
+        'ffmpeg', '-nostdin', '-loglevel', 'error', '-threads', '0', *clip,
+        '-i', 'pipe:0' if from_memory else source,
+        '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 'f32le', 'pipe:1',
+    ]
+    process = subprocess.run(command, input=source if from_memory else None, capture_output=True)
+    if process.returncode != 0:
+        raise AudioDecodeError(process.stderr.decode(errors='replace').strip() or f"ffmpeg exited with {process.returncode}")
+    return np.frombuffer(process.stdout, dtype=np.float32)
+
+def plan_chunks(audio: np.ndarray, chunk_seconds: float) -> list[tuple[float, float]]:
+    """
+    Splits audio into (start, end) chunks of at most about `chunk_seconds`, cut in the silences
+    between the speech regions found by the Silero VAD. Audio without speech gives no chunks.
+    """
+    vad_options = VadOptions(min_silence_duration_ms=500, max_speech_duration_s=chunk_seconds)
+    chunks: list[list[float]] = []
+    for speech in get_speech_timestamps(audio, vad_options):
+        start, end = speech['start'] / SAMPLE_RATE, speech['end'] / SAMPLE_RATE
+        if chunks and end - chunks[-1][0] <= chunk_seconds:
+            chunks[-1][1] = end
+        else:
+            chunks.append([start, end])
+    return [(start, end) for start, end in chunks]
+
+def transcribe_whisper_chunk(audio, offset: float, language: str, model_name: str | None = None, beam_size: int = 1) -> list[tuple[str, float, float]]:
+    """Transcribes one chunk of a longer recording; returns (text, start, end) with absolute timestamps."""
+    model = get_model(model_name)
+    segments, _ = model.transcribe(audio, beam_size=beam_size, language=language)
+    return [(segment.text.strip(), offset + segment.start, offset + segment.end) for segment in segments]
+
+def open_segments(audio, model_name: str | None, beam_size: int, hint: str | None, pinned: bool, emit):
+    """
+    Starts decoding with the chat's language `hint`, which skips Whisper's language detection pass.
+    Unless the hint is pinned, it is dropped when the first segment decodes with low confidence (the
+    user probably switched language) and the language is detected after all.
+    Returns the lazy segment iterator and the language; reports the outcome with a {'hint', ...} event.
+    """
+    model = get_model(model_name)
+    if hint and hint in model.supported_languages:
+        segments, _ = model.transcribe(audio, beam_size=beam_size, language=hint)
+        first = next(segments, None)
+        if pinned or first is None or first.avg_logprob >= HINT_MIN_AVG_LOGPROB:
+            emit({'hint': 'pinned' if pinned else 'hit', 'language': hint, 'probability': None})
+            return itertools.chain([first] if first else [], segments), hint
+    started = time.monotonic()
+    language, probability, _ = model.detect_language(audio)
+    emit({
+        'hint': 'fallback' if hint else 'detected', 'language': language, 'probability': probability,
+        'detected': time.monotonic() - started,
+    })
+    segments, _ = model.transcribe(audio, beam_size=beam_size, language=language)
+    return segments, language
+
+# --- Worker Process Pool ---
+
+def _plan_job(job: dict, emit) -> dict:
+    """Decodes the whole input once to find its duration, speech chunks and language."""
+    started = time.monotonic()
+    audio = decode_audio(job['audio'])
+    emit({'decoded': time.monotonic() - started})
+    chunks = plan_chunks(audio, job['plan'])
+    language = "unknown"
+    if job.get('pinned') and job['language'] in get_model(job['model']).supported_languages:
+        language = job['language']
+        emit({'hint': 'pinned', 'language': language, 'probability': None})
+    elif chunks:
+        # Detection costs little next to a long recording, so remembered (unpinned) hints are re-checked here.
+        started = time.monotonic()
+        language, probability, _ = get_model(job['model']).detect_language(
+            audio, vad_filter=True, language_detection_segments=3
+        )
+        emit({'hint': 'detected', 'language': language, 'probability': probability, 'detected': time.monotonic() - started})
+    return {'duration': len(audio) / SAMPLE_RATE, 'chunks': chunks, 'language': language}
+
+def _handle_job(job: dict, emit):
+    """
+    Runs one transcription job inside a worker process, streaming segments if asked to.
+    Reports the time spent in the model per second of audio with a {'transcribed', 'audio'} event.
+    """
+    if 'plan' in job:
+        return _plan_job(job, emit)
+    if 'clip' in job:
+        start, end = job['clip']
+        audio = decode_audio(job['audio'], start, end - start)
+        started = time.monotonic()
+        segments = transcribe_whisper_chunk(audio, start, job['language'], job['model'], job['beam_size'])
+        emit({'transcribed': time.monotonic() - started, 'audio': len(audio) / SAMPLE_RATE})
+        return segments
+
+    started = time.monotonic()
+    audio = decode_audio(job['audio'])
+    emit({'decoded': time.monotonic() - started})
+    duration = len(audio) / SAMPLE_RATE
+    started = time.monotonic()
+    segments, language = open_segments(audio, job['model'], job['beam_size'], job.get('language'), job.get('pinned', False), emit)
+    texts = []
+    for segment in segments:
+        texts.append(segment.text.strip())
+        if job.get('stream'):
+            emit({'text': texts[-1], 'end': segment.end, 'duration': duration})
+    emit({'transcribed': time.monotonic() - started, 'audio': duration})
+    return " ".join(texts), language
+
+def _worker_main(conn, cpu_threads: int, num_workers: int) -> None:
+    """Worker process entry point: loads (warms) the models, then serves jobs."""
+    _model_options.update(cpu_threads=cpu_threads, num_workers=num_workers)
+    for name in (settings.WHISPER_MODELS if settings.WHISPER_PRELOAD_MODELS else settings.WHISPER_MODELS[-1:]):
+        get_model(name)
+    serve(conn, _handle_job)
+
+# Each worker process holds its own warm models; jobs beyond WHISPER_MAX_PENDING are rejected.
+whisper_pool = ProcessWorkerPool(
+    name='whisper',
+    target=_worker_main,
+    args=(settings.WHISPER_CPU_THREADS, settings.WHISPER_NUM_WORKERS),
+    size=settings.WHISPER_WORKERS,
+    max_pending=settings.WHISPER_MAX_PENDING,
+    job_timeout=settings.WHISPER_JOB_TIMEOUT,
+)
+
+def _event_handler(work: dict, model: str, on_segment=None, on_language=None):
+    """
+    Handles a job's events: decode timings, model time and language hint outcomes go to metrics/`work`,
+    segments to `on_segment` and the language outcome to `on_language`.
+    """
+    def on_event(event: dict) -> None:
+        if 'decoded' in event:
+            stage_seconds.observe(event['decoded'], stage='decode_audio', platform='', outcome='ok')
+        elif 'hint' in event:
+            language_hints.inc(result=event['hint'])
+            if 'detected' in event:
+                language_detection_seconds.observe(event['detected'], model=model)
+            if on_language:
+                on_language(event)
+        elif 'transcribed' in event:
+            work['seconds'] += event['transcribed']
+            work['audio'] += event['audio']
+        elif on_segment:
+            on_segment(event)
+    return on_event
+
+async def _transcribe_chunked(audio: str | bytes, choice: ModelChoice, hint: dict, on_event, on_segment=None) -> tuple[str, str]:
+    """
+    Long-media mode: a worker splits the audio at silences, the chunks are transcribed in parallel
+    on the pool's workers, and their segments are stitched back (and streamed) in order.
+    """
+    plan = await whisper_pool.submit(
+        {'audio': audio, 'plan': settings.TRANSCRIBE_CHUNK_SECONDS, 'model': choice.model, **hint}, on_event=on_event
+    )
+    chunks, duration = plan['chunks'], plan['duration']
+    logger.info(f"Transcribing {duration:.0f}s of audio as {len(chunks)} chunk(s) on {whisper_pool.size} worker(s).")
+    results: list[list | None] = [None] * len(chunks)
+    emitted = 0
+    # One chunk per worker at a time, so a long recording does not fill the pool's pending limit.
+    slots = asyncio.Semaphore(whisper_pool.size)
+
+    async def run_chunk(index: int) -> None:
+        nonlocal emitted
+        job = {
+            'audio': audio, 'clip': chunks[index], 'language': plan['language'],
+            'model': choice.model, 'beam_size': choice.beam_size,
+        }
+        async with slots:
+            results[index] = await whisper_pool.submit(job, on_event=on_event)
+        # Segments are streamed only once every earlier chunk is done, to keep the text in order.
+        while emitted < len(results) and results[emitted] is not None:
+            if on_segment:
+                for text, _, end in results[emitted]:
+                    on_segment({'text': text, 'end': end, 'duration': duration})
+            emitted += 1
+
+    tasks = [asyncio.create_task(run_chunk(index)) for index in range(len(chunks))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    text = " ".join(text for chunk in results for text, _, _ in chunk)
+    return text, plan['language']
+
+async def transcribe_in_pool(
+    audio: str | bytes, on_segment=None, duration: float | None = None, backlog: int = 0,
+    language: str | None = None, pinned: bool = False, on_language=None,
+) -> tuple[str, str]:
+    """
+    Transcribes a media file (a path, or its bytes for small in-memory downloads) on the worker pool.
+    The worker decodes it itself, so video files need no separate audio extraction.
+    Media of at least TRANSCRIBE_PARALLEL_MIN_SECONDS (`duration`, if known) is split and transcribed
+    in parallel when the pool has more than one worker.
+    The model and beam size come from the tiering policy, given `duration` and the load: the pool's
+    pending jobs plus `backlog` (transcriptions still waiting in the job queue).
+    `language` is a hint that skips language detection; unless `pinned`, it is dropped when it decodes
+    badly. `on_language` gets {'hint', 'language', 'probability'} (probability only if detection ran).
+    Returns the text and the detected language.
+    If `on_segment` is given, it is called with {'text', 'end', 'duration'} for every decoded segment.
+    """
+    chunked = bool(duration) and duration >= settings.TRANSCRIBE_PARALLEL_MIN_SECONDS and whisper_pool.size > 1
+    load = (whisper_pool.pending + backlog) / whisper_pool.size
+    choice = model_policy.choose(duration, load, parallelism=whisper_pool.size if chunked else 1)
+    logger.info(
+        f"Whisper tier for {duration or 0:.0f}s of audio at load {load:.1f}: {choice.model}, "
+        f"beam {choice.beam_size} (~{choice.estimated_seconds:.0f}s)."
+    )
+    work = {'seconds': 0.0, 'audio': 0.0}
+    on_event = _event_handler(work, choice.model, on_segment, on_language)
+    hint = {'language': language, 'pinned': pinned}
+    if chunked:
+        result = await _transcribe_chunked(audio, choice, hint, on_event, on_segment)
+    else:
+        job = {
+            'audio': audio, 'stream': on_segment is not None, 'model': choice.model, 'beam_size': choice.beam_size, **hint
+        }
+        result = await whisper_pool.submit(job, on_event=on_event)
+    # The real-time factor of the model itself (queueing and decoding excluded) tunes the policy.
+    if work['audio']:
+        rtf = work['seconds'] / work['audio']
+        model_policy.record(choice.model, choice.beam_size, rtf)
+        whisper_rtf.observe(rtf, model=choice.model, beam=str(choice.beam_size))
+    return result
@@ -0,0 +1,64 @@
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+from config import settings
+from database import db
+
+
+def song_button_id(full_title: str, youtube_url: str) -> str:
+    """Deterministic id of a song button: the same track always gets the same (short) callback id."""
+    return hashlib.blake2b(f"{youtube_url}\n{full_title}".encode(), digest_size=10).hexdigest()
+
+
+class SongButtonStore:
+    """
+    State behind the "download song" inline buttons (callback data `dl_song_<id>`).
+
+    Entries are kept as compact (full_title, youtube_url, created_at) tuples in an LRU with at
+    most `max_entries` items and expire after `ttl` seconds. They are also written to the
+    database (song_entries), so buttons survive restarts and work in every bot and worker
+    process. Registering a track that is already known only refreshes its entry.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, str, float]] = OrderedDict()
+
+    def _remember(self, song_id: str, entry: tuple[str, str, float]) -> None:
+        self._entries[song_id] = entry
+        self._entries.move_to_end(song_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def register(self, full_title: str, youtube_url: str) -> str:
+        """Stores a song for its download button and returns the button's id."""
+        song_id = song_button_id(full_title, youtube_url)
+        now = time.time()
+        cached = self._entries.get(song_id)
+        # The stored entry is refreshed once it is half way to expiring, not on every recognition.
+        if cached is None or now - cached[2] > self.ttl / 2:
+            await db.save_song_entry(song_id, full_title, youtube_url)
+            cached = (full_title, youtube_url, now)
+        self._remember(song_id, cached)
+        return song_id
+
+    async def get(self, song_id: str) -> Optional[dict]:
+        """Returns {'full_title', 'youtube_url'} of a button, or None if it is unknown or expired."""
+        entry = self._entries.get(song_id)
+        if entry is not None and time.time() - entry[2] >= self.ttl:
+            del self._entries[song_id]
+            entry = None
+        if entry is None:
+            row = await db.get_song_entry(song_id)
+            if row is None:
+                return None
+            entry = (row['full_title'], row['youtube_url'], row['created_at'])
+        self._remember(song_id, entry)
+        return {'full_title': entry[0], 'youtube_url': entry[1]}
+
+
+# --- Global Singleton Instance ---
+song_buttons = SongButtonStore(ttl=settings.SONG_ENTRY_TTL_SECONDS, max_entries=settings.SONG_ENTRY_CACHE_SIZE)
@@ -1,11 +1,11 @@
 from functools import wraps
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import db
+from database import user_activity
 from config import logger
 
 def register_user(func):
-    """A decorator that registers/updates user info in the database before executing the command."""
+    """A decorator that records user info (buffered, written to the database in batches) before executing the command."""
     @wraps(func)
     async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         if update:
@@ -13,7 +13,7 @@ def register_user(func):
             if user:
                 try:
                     logger.debug(f"Registering user: {user.id} - {user.username}")
-                    db.update_user(
+                    user_activity.record(
                         user_id=user.id,
                         first_name=user.first_name,
                         last_name=user.last_name,
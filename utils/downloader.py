@@ -0,0 +1,218 @@
+import os
+import json
+import time
+from typing import Optional
+from telegram import Message
+
+from config import settings, logger
+from utils.helpers import _run_yt_dlp_with_progress, format_progress
+from utils.formats import summarize_info
+from utils.process_pool import ProcessWorkerPool, WorkerPoolFull, WorkerCrashed, WorkerJobError, WorkerJobTimeout, serve
+from utils.status import status_updater
+
+# Minimum delay between two progress events sent from a worker (yt-dlp calls its hook for every block).
+PROGRESS_EVENT_INTERVAL = 0.5
+# Info dict fields returned to the bot process; the full dict is large and mostly unused.
+RESULT_INFO_FIELDS = ('id', 'title', 'ext', 'duration', 'webpage_url', 'extractor_key', 'filesize', 'filesize_approx')
+
+
+class DownloadResult:
+    """Outcome of a yt-dlp download: the final file path and a few info fields, or the error."""
+    __slots__ = ('filepath', 'info', 'error_class', 'error')
+
+    def __init__(self, filepath: Optional[str] = None, info: Optional[dict] = None,
+                 error_class: Optional[str] = None, error: Optional[str] = None):
+        self.filepath = filepath
+        self.info = info or {}
+        self.error_class = error_class
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.filepath is not None
+
+
+# --- Worker (child process) side ---
+
+# Cookie jars loaded in this worker, by cookie file: (mtime, jar). Reused across jobs until the file is
+# replaced; jobs never save them back, so only an outside change (a new cookie file) moves the mtime.
+_cookie_jars: dict = {}
+
+
+class _MessageLog:
+    """yt-dlp logger that keeps the last messages, so a failed job can report why."""
+
+    def __init__(self):
+        self.lines: list[str] = []
+
+    def debug(self, msg: str) -> None:
+        if not msg.startswith('[debug] '):
+            self.lines = self.lines[-20:] + [msg]
+
+    info = debug
+
+    def warning(self, msg: str) -> None:
+        self.lines = self.lines[-20:] + [msg]
+
+    error = warning
+
+
+def _progress_hook(emit):
+    last_sent = 0.0
+
+    def hook(status: dict) -> None:
+        nonlocal last_sent
+        now = time.monotonic()
+        if status.get('status') != 'downloading' or now - last_sent < PROGRESS_EVENT_INTERVAL:
+            return
+        last_sent = now
+        emit({
+            'downloaded': status.get('downloaded_bytes'),
+            'total': status.get('total_bytes') or status.get('total_bytes_estimate'),
+            'speed': status.get('speed'),
+            'eta': status.get('eta'),
+        })
+    return hook
+
+
+def _shared_cookie_jar(cookiefile: str):
+    """Returns this worker's in-memory cookie jar for a cookie file, loading it on first use."""
+    from yt_dlp.cookies import YoutubeDLCookieJar
+
+    mtime = os.path.getmtime(cookiefile)
+    cached = _cookie_jars.get(cookiefile)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    jar = YoutubeDLCookieJar(cookiefile)
+    jar.load()
+    _cookie_jars[cookiefile] = (mtime, jar)
+    return jar
+
+
+def _youtube_dl(opts: dict):
+    """
+    Creates a YoutubeDL that uses this worker's shared cookie jar. The instance gets no cookie file, so
+    it never writes the jar back on exit: several pool and media worker processes share that file.
+    """
+    import yt_dlp
+
+    cookiefile = opts.get('cookiefile')
+    ydl = yt_dlp.YoutubeDL({**opts, 'cookiefile': None})
+    if cookiefile and os.path.exists(cookiefile):
+        # `cookiejar` is a cached property; pre-filling it skips parsing the file again.
+        ydl.__dict__['cookiejar'] = _shared_cookie_jar(cookiefile)
+    return ydl
+
+
+def _handle_job(job: dict, emit) -> dict:
+    """
+    Runs one download inside a worker process. `job['argv']` holds yt-dlp command line options and the URL.
+    With `job['probe']` set, only extracts the metadata and returns its summary (see utils.formats).
+    """
+    import yt_dlp
+
+    parsed = yt_dlp.parse_options(job['argv'])
+    log = _MessageLog()
+    if job.get('probe'):
+        with _youtube_dl({**parsed.ydl_opts, 'logger': log, 'ignoreerrors': False}) as ydl:
+            return summarize_info(ydl.extract_info(parsed.urls[0], download=False))
+
+    ydl_opts = {
+        **parsed.ydl_opts,
+        'logger': log,
+        'noprogress': True,
+        # Errors must raise so they reach the bot as a structured WorkerJobError.
+        'ignoreerrors': False,
+        'progress_hooks': [_progress_hook(emit)],
+    }
+    with _youtube_dl(ydl_opts) as ydl:
+        info = ydl.extract_info(parsed.urls[0], download=True)
+
+    downloads = (info or {}).get('requested_downloads') or []
+    filepath = downloads[-1].get('filepath') if downloads else None
+    if not filepath or not os.path.exists(filepath):
+        # Skipped downloads (e.g. --max-filesize) do not raise; the reason is in the log.
+        raise FileNotFoundError(log.lines[-1] if log.lines else "yt-dlp did not produce a file")
+    return {'filepath': filepath, 'info': {field: info.get(field) for field in RESULT_INFO_FIELDS}}
+
+
+def _worker_main(conn) -> None:
+    """Worker process entry point: imports yt-dlp and loads its extractors once, then serves jobs."""
+    from yt_dlp.extractor import gen_extractor_classes
+    gen_extractor_classes()
+    serve(conn, _handle_job)
+
+
+# --- Bot process side ---
+
+# Long-lived processes with yt-dlp already imported; YTDLP_WORKERS=0 runs every download with the CLI instead.
+ytdlp_pool = ProcessWorkerPool(
+    name='yt-dlp',
+    target=_worker_main,
+    args=(),
+    size=max(1, settings.YTDLP_WORKERS),
+    max_pending=max(1, settings.YTDLP_WORKERS) * 2,
+    job_timeout=settings.YTDLP_JOB_TIMEOUT,
+)
+
+
+async def _download_with_cli(command: list, status_message: Optional[Message], progress_prefix: str) -> DownloadResult:
+    """Fallback: runs the yt-dlp CLI in a new process and reads the final path from its output."""
+    # --print implies --quiet, so progress has to be re-enabled explicitly.
+    # Options may follow the URL (callers append --cookies last), so these are appended too.
+    command = [*command, '--progress', '--print', 'after_move:filepath']
+    return_code, stdout, stderr = await _run_yt_dlp_with_progress(command, status_message, progress_prefix)
+    filepath = next((line for line in reversed(stdout.splitlines()) if line and os.path.exists(line)), None)
+    if return_code != 0:
+        return DownloadResult(error_class='DownloadError', error=stderr or stdout or "Noma'lum xato")
+    if not filepath:
+        return DownloadResult(error_class='FileNotFoundError', error=stderr or stdout or "yt-dlp did not produce a file")
+    return DownloadResult(filepath=filepath)
+
+
+async def _probe_with_cli(command: list) -> dict:
+    """Fallback: dumps the info dict with the yt-dlp CLI. Raises WorkerJobError (as the pool does) on failure."""
+    return_code, stdout, stderr = await _run_yt_dlp_with_progress([*command, '--dump-single-json'], None, '')
+    if return_code != 0:
+        raise WorkerJobError('DownloadError', stderr or stdout or "Noma'lum xato")
+    return summarize_info(json.loads(stdout.splitlines()[-1]))
+
+
+async def probe_media(command: list) -> dict:
+    """
+    Fetches a media's metadata without downloading it and returns its summary (title, duration, formats).
+    `command` is the same yt-dlp command line the download will use. Raises WorkerJobError on failure.
+    """
+    if settings.YTDLP_WORKERS <= 0:
+        return await _probe_with_cli(command)
+    try:
+        return await ytdlp_pool.submit({'argv': command[1:], 'probe': True})
+    except (WorkerPoolFull, WorkerCrashed, WorkerJobTimeout) as e:
+        logger.warning(f"yt-dlp worker pool unavailable for probing ({e}); falling back to the CLI.")
+        return await _probe_with_cli(command)
+
+
+async def download_media(command: list, status_message: Optional[Message], progress_prefix: str) -> DownloadResult:
+    """
+    Downloads with yt-dlp. `command` is a yt-dlp command line ('yt-dlp', then options and the URL in any order).
+    Runs on the pre-warmed worker pool and falls back to the CLI if the pool is disabled, full or crashed.
+    """
+    if settings.YTDLP_WORKERS <= 0:
+        return await _download_with_cli(command, status_message, progress_prefix)
+
+    def on_progress(progress: dict) -> None:
+        if status_message:
+            status_updater.update(status_message, format_progress(progress_prefix, progress), 'HTML')
+
+    try:
+        result = await ytdlp_pool.submit({'argv': command[1:]}, on_event=on_progress)
+        return DownloadResult(filepath=result['filepath'], info=result['info'])
+    except WorkerJobError as e:
+        logger.warning(f"yt-dlp worker job failed ({e.error_class}): {e.message}")
+        return DownloadResult(error_class=e.error_class, error=e.message)
+    except WorkerJobTimeout as e:
+        logger.warning(f"yt-dlp worker job timed out: {e}")
+        return DownloadResult(error_class='WorkerJobTimeout', error=str(e))
+    except (WorkerPoolFull, WorkerCrashed) as e:
+        logger.warning(f"yt-dlp worker pool unavailable ({e}); falling back to the CLI.")
+        return await _download_with_cli(command, status_message, progress_prefix)
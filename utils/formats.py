@@ -0,0 +1,131 @@
+from typing import Optional
+
+# Format fields needed for size-aware selection; everything else in yt-dlp's info dict is dropped.
+FORMAT_FIELDS = ('format_id', 'ext', 'vcodec', 'acodec', 'height', 'filesize', 'filesize_approx', 'tbr', 'abr', 'vbr')
+# Estimated sizes are approximate (bitrate × duration, container overhead), so keep a margin below the limit.
+SIZE_SAFETY_FACTOR = 0.95
+# Size estimate of the MP3 the audio-only download produces (--audio-quality 0 is ~245 kbit/s VBR).
+MP3_BYTES_PER_SECOND = 256 * 1000 // 8
+# Containers that merge into the mp4 output without surprises; preferred when two choices are otherwise equal.
+MP4_FRIENDLY_EXTS = ('mp4', 'm4a')
+
+
+def summarize_info(info: dict) -> dict:
+    """Reduces a yt-dlp info dict to what format selection needs (small enough to pass between processes)."""
+    formats = info.get('formats') or [info]
+    return {
+        'title': info.get('title'),
+        'duration': info.get('duration'),
+        'is_live': bool(info.get('is_live')),
+        'formats': [{field: f.get(field) for field in FORMAT_FIELDS} for f in formats],
+    }
+
+
+def _has_video(f: dict) -> bool:
+    # A missing vcodec means "unknown" (typical for direct files), which is treated as video.
+    return f.get('vcodec') != 'none'
+
+
+def _has_audio(f: dict) -> bool:
+    return f.get('acodec') != 'none'
+
+
+def estimate_size(f: dict, duration: Optional[float]) -> Optional[float]:
+    """Returns the known or estimated size of a format in bytes, or None if it cannot be told."""
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size:
+        return float(size)
+    if f.get('tbr') and duration:
+        return f['tbr'] * 1000 / 8 * duration
+    return None
+
+
+class FormatChoice:
+    """Result of size-aware format selection."""
+    __slots__ = ('action', 'format_spec', 'size', 'height', 'best_size', 'best_spec')
+
+    # action is one of: 'download' (format_spec fits), 'unknown' (sizes unknown; download with yt-dlp's default),
+    # 'audio_only' (no video fits, the audio does) or 'reject' (nothing fits).
+    def __init__(self, action: str, format_spec: Optional[str] = None, size: Optional[float] = None,
+                 height: Optional[int] = None, best_size: Optional[float] = None, best_spec: Optional[str] = None):
+        self.action = action
+        self.format_spec = format_spec
+        self.size = size
+        self.height = height
+        self.best_size = best_size
+        self.best_spec = best_spec
+
+    @property
+    def saved_bytes(self) -> float:
+        """Bytes not downloaded compared to the best (largest) combination yt-dlp would fetch by default."""
+        if not self.best_size:
+            return 0.0
+        return max(0.0, self.best_size - (self.size if self.action == 'download' and self.size else 0.0))
+
+
+def _candidates(formats: list[dict], duration: Optional[float]) -> list[tuple[str, Optional[float], int, bool]]:
+    """All single-file and video+audio combinations as (format spec, size, height, mp4-friendly)."""
+    candidates = []
+    audios = [f for f in formats if _has_audio(f) and not _has_video(f)]
+    for f in formats:
+        if not _has_video(f):
+            continue
+        height = f.get('height') or 0
+        video_size = estimate_size(f, duration)
+        if _has_audio(f):
+            candidates.append((f['format_id'], video_size, height, f.get('ext') in MP4_FRIENDLY_EXTS))
+            continue
+        for audio in audios:
+            audio_size = estimate_size(audio, duration)
+            size = video_size + audio_size if video_size is not None and audio_size is not None else None
+            friendly = f.get('ext') in MP4_FRIENDLY_EXTS and audio.get('ext') in MP4_FRIENDLY_EXTS
+            candidates.append((f"{f['format_id']}+{audio['format_id']}", size, height, friendly))
+    return candidates
+
+
+def select_format(summary: dict, limit_bytes: int) -> FormatChoice:
+    """
+    Picks the best video (highest resolution, then mp4-friendly, then largest) whose known or estimated
+    size fits `limit_bytes`. Without a fitting video it offers audio only, or rejects the request.
+    """
+    duration = summary.get('duration')
+    formats = [f for f in summary.get('formats') or [] if f.get('format_id')]
+    if summary.get('is_live'):
+        return FormatChoice('reject')
+
+    sized = [c for c in _candidates(formats, duration) if c[1] is not None]
+    if not sized:
+        return FormatChoice('unknown')
+
+    rank = lambda c: (c[2], c[3], c[1])
+    best = max(sized, key=rank)
+    fitting = [c for c in sized if c[1] <= limit_bytes * SIZE_SAFETY_FACTOR]
+    if fitting:
+        spec, size, height, _ = max(fitting, key=rank)
+        return FormatChoice('download', spec, size, height, best_size=best[1], best_spec=best[0])
+
+    audio_sizes = [estimate_size(f, duration) for f in formats if _has_audio(f) and not _has_video(f)]
+    mp3_size = duration * MP3_BYTES_PER_SECOND if duration else min((s for s in audio_sizes if s), default=None)
+    if mp3_size is not None and mp3_size <= limit_bytes * SIZE_SAFETY_FACTOR:
+        return FormatChoice('audio_only', size=mp3_size, best_size=best[1], best_spec=best[0])
+    return FormatChoice('reject', best_size=best[1], best_spec=best[0])
+
+
+class TransferRate:
+    """Exponentially weighted average of observed transfer speed, used to estimate time saved."""
+
+    def __init__(self, initial_bytes_per_second: float, alpha: float = 0.2):
+        self.bytes_per_second = initial_bytes_per_second
+        self.alpha = alpha
+
+    def record(self, size: float, seconds: float) -> None:
+        if size > 0 and seconds > 0:
+            self.bytes_per_second += self.alpha * (size / seconds - self.bytes_per_second)
+
+    def estimate_seconds(self, size: float) -> float:
+        return size / self.bytes_per_second
+
+
+# --- Global Singleton Instance ---
+# Fed by the video upload loop; starts at a conservative 1 MB/s.
+upload_rate = TransferRate(1024 * 1024)
@@ -1,12 +1,18 @@
 import os
+import io
 import re
 import time
+import wave
 import asyncio
 from typing import Optional
 import functools
+import contextlib
+from pathlib import Path
+from urllib.parse import urlparse, parse_qsl, urlencode
 import ffmpeg
 from telegram import Message
-from config import logger
+from config import settings, logger
+from utils.status import status_updater
 
 
 async def add_metadata_to_song(audio_path: str, title: str, artist: str):
@@ -27,19 +33,146 @@ async def add_metadata_to_song(audio_path: str, title: str, artist: str):
     except Exception as e:
         logger.error(f"Unexpected error adding metadata to {audio_path}: {e}", exc_info=True)
 
-def find_first_file(directory: str, prefix: str) -> Optional[str]:
-    """Finds the first file in a directory that starts with a given prefix."""
-    try:
-        for f in os.listdir(directory):
-            if f.startswith(prefix):
-                return os.path.join(directory, f)
-    except FileNotFoundError:
-        logger.error(f"Directory not found for searching prefix '{prefix}': {directory}")
+# Query parameters that only carry sharing/tracking info and never change the media itself.
+_TRACKING_QUERY_PARAMS = {'si', 'igsh', 'igshid', 'feature', 'is_from_webapp', 'sender_device', 'lang', 't'}
+
+
+# Keys of the most common links, read straight from the URL in the same form yt-dlp's extractors give
+# ('<extractor>:<id>'). Playlist links, short links and other sites go through the extractor scan.
+_FAST_MEDIA_KEY_PATTERNS = [
+    ('youtube', re.compile(r'https?://(?:www\.|m\.)?youtube\.com/(?:watch\?(?:[^#]*&)?v=|shorts/|live/|embed/)([0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])')),
+    ('youtube', re.compile(r'https?://youtu\.be/([0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])')),
+    ('instagram', re.compile(r'https?://(?:www\.)?instagram\.com/(?:p|reels?|tv)/([^/?#&]+)')),
+    ('tiktok', re.compile(r'https?://(?:www\.)?tiktok\.com/@[\w.-]+/video/(\d+)')),
+]
+
+
+@functools.lru_cache(maxsize=1)
+def _get_extractor_classes() -> list:
+    """Returns yt-dlp's extractor classes (without the catch-all generic one), loaded once."""
+    from yt_dlp.extractor import gen_extractor_classes
+    return [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+
+
+async def load_extractors() -> None:
+    """Loads yt-dlp's extractors off the event loop, so the first link does not pay for it."""
+    await asyncio.get_running_loop().run_in_executor(None, _get_extractor_classes)
+
+
+def _fast_media_key(url: str) -> Optional[str]:
+    if re.search(r'[?&]list=', url):
+        return None
+    for extractor, pattern in _FAST_MEDIA_KEY_PATTERNS:
+        match = pattern.match(url)
+        if match:
+            return f"{extractor}:{match.group(1)}"
     return None
 
 
+def _scan_media_key(url: str) -> Optional[str]:
+    """Asks every yt-dlp extractor whether it handles the URL (slow: a few ms, more on first use)."""
+    for ie in _get_extractor_classes():
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            return f"{ie.ie_key().lower()}:{video_id}" if video_id else None
+    return None
+
+
+async def get_media_key(url: str) -> str:
+    """
+    Returns a normalized identity for the media behind a URL, e.g. 'youtube:dQw4w9WgXcQ'.
+    Different links to the same video (short links, tracking parameters, shorts/watch URLs)
+    map to the same key. Falls back to a cleaned-up URL for sites yt-dlp has no extractor for.
+    Common links are matched directly; others are scanned in an executor, off the event loop.
+    """
+    url = url.strip()
+    key = _fast_media_key(url) or await asyncio.get_running_loop().run_in_executor(None, _scan_media_key, url)
+    if key:
+        return key
+
+    parsed = urlparse(url)
+    host = parsed.netloc.lower().removeprefix('www.')
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parsed.query)
+        if k not in _TRACKING_QUERY_PARAMS and not k.startswith('utm_')
+    ))
+    return f"url:{host}{parsed.path.rstrip('/')}" + (f"?{query}" if query else "")
+
+@contextlib.contextmanager
+def open_for_upload(path: str):
+    """
+    Yields what to pass to a send_* method for a local file. With a local Bot API server the
+    absolute path is sent (as a file:// URI) and the server reads the file itself, so no bytes
+    go through Python; otherwise the file is opened and streamed.
+    """
+    if settings.BOT_API_LOCAL_MODE:
+        yield Path(os.path.abspath(path))
+        return
+    with open(path, 'rb') as file:
+        yield file
+
+
+# yt-dlp prints one machine-readable line per progress tick with this template (see --progress-template).
+_PROGRESS_MARKER = '[vfprogress]'
+_PROGRESS_TEMPLATE = (
+    'download:' + _PROGRESS_MARKER +
+    ' %(progress.downloaded_bytes)s %(progress.total_bytes)s %(progress.total_bytes_estimate)s'
+    ' %(progress.speed)s %(progress.eta)s'
+)
+
+
+def _parse_progress_line(line: str) -> Optional[dict]:
+    """Parses a progress line printed with _PROGRESS_TEMPLATE. Unknown values ('NA') become None."""
+    fields = line[len(_PROGRESS_MARKER):].split()
+    if len(fields) != 5:
+        return None
+
+    def number(value: str) -> Optional[float]:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+    downloaded, total, estimate, speed, eta = (number(value) for value in fields)
+    return {'downloaded': downloaded, 'total': total or estimate, 'speed': speed, 'eta': eta}
+
+
+def format_bytes(size: Optional[float]) -> str:
+    """Formats a byte count as a short human-readable string."""
+    if size is None:
+        return '?'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_progress(prefix: str, progress: dict) -> str:
+    """Renders parsed download progress as a status message text (HTML)."""
+    downloaded, total = progress['downloaded'], progress['total']
+    lines = [prefix]
+    if downloaded is not None and total:
+        percent = min(100.0, downloaded / total * 100)
+        filled = int(percent // 10)
+        lines.append(f"{'▓' * filled}{'░' * (10 - filled)} {percent:.0f}%")
+        lines.append(f"{format_bytes(downloaded)} / {format_bytes(total)}")
+    elif downloaded is not None:
+        lines.append(format_bytes(downloaded))
+    details = []
+    if progress['speed']:
+        details.append(f"⚡ {format_bytes(progress['speed'])}/s")
+    if progress['eta'] is not None:
+        minutes, seconds = divmod(int(progress['eta']), 60)
+        details.append(f"⏱ {minutes}:{seconds:02d}")
+    if details:
+        lines.append(" • ".join(details))
+    return "\n".join(lines)
+
+
 async def _run_yt_dlp_with_progress(command: list, status_message: Message, progress_text_prefix: str):
     """Runs yt-dlp, captures output, and reports progress."""
+    # Ask yt-dlp for one parseable progress line per tick instead of the interactive progress bar.
+    command = [command[0], '--newline', '--progress-template', _PROGRESS_TEMPLATE, *command[1:]]
     logger.debug(f"Running command: {' '.join(command)}")
     process = await asyncio.create_subprocess_exec(
         *command,
@@ -54,6 +187,11 @@ async def _run_yt_dlp_with_progress(command: list, status_message: Message, prog
             if not line:
                 break
             line_str = line.decode('utf-8', errors='ignore').strip()
+            if line_str.startswith(_PROGRESS_MARKER):
+                progress = _parse_progress_line(line_str)
+                if progress and status_message:
+                    status_updater.update(status_message, format_progress(progress_text_prefix, progress), 'HTML')
+                continue
             lines.append(line_str)
             logger.debug(f"yt-dlp {stream_name}: {line_str}")
         return "\n".join(lines)
@@ -76,4 +214,39 @@ async def _run_ffmpeg_async(func):
     """Runs a blocking ffmpeg function in a separate thread to avoid blocking the asyncio event loop."""
     loop = asyncio.get_running_loop()
     # functools.partial is used to pass the function with its arguments
-    await loop.run_in_executor(None, func)
+    return await loop.run_in_executor(None, func)
+
+
+async def probe_media_duration(path: str) -> Optional[float]:
+    """Returns the duration of a media file in seconds, or None if ffprobe cannot tell."""
+    try:
+        info = await _run_ffmpeg_async(functools.partial(ffmpeg.probe, path))
+        return float(info['format']['duration'])
+    except (ffmpeg.Error, KeyError, ValueError) as e:
+        logger.warning(f"Could not probe duration of {path}: {e}")
+        return None
+
+
+def _pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    """Wraps raw 16-bit mono PCM in a WAV container, in memory."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+async def extract_audio_window(path: str, offset: float, duration: float, sample_rate: int = 16000) -> bytes:
+    """
+    Decodes `duration` seconds of audio starting at `offset` straight into memory as a mono WAV,
+    through an ffmpeg pipe. Seeking happens on the input, so only the window itself is decoded.
+    """
+    pcm, _ = await _run_ffmpeg_async(functools.partial(
+        ffmpeg.input(path, ss=offset, t=duration)
+        .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate)
+        .run,
+        capture_stdout=True, capture_stderr=True
+    ))
+    return _pcm_to_wav(pcm, sample_rate)
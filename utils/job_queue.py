@@ -0,0 +1,348 @@
+import json
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+from telegram import Bot, Message
+
+from config import settings, logger
+from database import db
+from utils.status import status_updater
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Optional: only needed for JOB_QUEUE_BACKEND=redis
+    redis_asyncio = None
+
+# Job types the bot enqueues; each is run by the worker processes configured for it.
+JOB_KINDS = ('download', 'song', 'transcribe')
+
+
+class Job:
+    """A queued media job: its type, the user it is for, and the JSON payload the worker runs it from."""
+    __slots__ = ('id', 'kind', 'user_id', 'payload', 'attempts', 'status', 'result', 'error', 'created_at', 'updated_at')
+
+    def __init__(self, id: int, kind: str, user_id: int, payload: dict, attempts: int = 0, status: str = 'queued',
+                 result: Any = None, error: Optional[str] = None, created_at: float = 0.0, updated_at: float = 0.0):
+        self.id = id
+        self.kind = kind
+        self.user_id = user_id
+        self.payload = payload
+        self.attempts = attempts
+        self.status = status
+        self.result = result
+        self.error = error
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_row(cls, row) -> 'Job':
+        """Builds a job from a database row or a Redis hash (where every value is a string)."""
+        row = dict(row)
+        result = row.get('result')
+        return cls(
+            id=int(row['job_id']),
+            kind=row['kind'],
+            user_id=int(row['user_id']),
+            payload=json.loads(row['payload']),
+            attempts=int(row.get('attempts') or 0),
+            status=row.get('status') or 'running',
+            result=json.loads(result) if result else None,
+            error=row.get('error') or None,
+            created_at=float(row.get('created_at') or 0),
+            updated_at=float(row.get('updated_at') or 0),
+        )
+
+
+class SQLiteJobQueue:
+    """
+    Job queue in the bot's SQLite database. Works for the bot and media workers on one machine
+    (or sharing the database file); jobs survive restarts of either side.
+    """
+
+    def __init__(self, lease: float, max_attempts: int, per_user_limit: int):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.per_user_limit = per_user_limit
+
+    async def enqueue(self, kind: str, user_id: int, payload: dict) -> int:
+        return await db.enqueue_job(kind, user_id, json.dumps(payload))
+
+    async def claim(self, kinds: list[str], worker: str) -> Optional[Job]:
+        row = await db.claim_job(kinds, worker, self.lease, self.max_attempts, self.per_user_limit)
+        return Job.from_row(row) if row else None
+
+    async def renew(self, job: Job, worker: str) -> bool:
+        return await db.renew_job_lease(job.id, worker, self.lease)
+
+    async def finish(self, job: Job, worker: str, result: Any = None, error: Optional[str] = None) -> None:
+        await db.finish_job(job.id, worker, 'failed' if error else 'done', json.dumps(result), error)
+
+    async def requeue(self, job: Job, worker: str) -> None:
+        await db.requeue_job(job.id, worker)
+
+    async def queued_positions(self) -> dict[int, int]:
+        positions, counts = {}, {}
+        for row in await db.get_queued_jobs():
+            counts[row['kind']] = positions[row['job_id']] = counts.get(row['kind'], 0) + 1
+        return positions
+
+    async def queue_depths(self) -> dict[str, int]:
+        depths = dict.fromkeys(JOB_KINDS, 0)
+        for row in await db.get_queued_jobs():
+            depths[row['kind']] = depths.get(row['kind'], 0) + 1
+        return depths
+
+    async def take_finished(self, limit: int = 100) -> list[Job]:
+        return [Job.from_row(row) for row in await db.take_finished_jobs(limit)]
+
+    async def close(self) -> None:
+        pass
+
+
+# Redis layout: a hash per job, a list per job type (new jobs are pushed on the left, the oldest is on the
+# right), a sorted set of running jobs scored by lease expiry, running job counts per user, and a list of
+# finished jobs the bot has not taken yet. The scripts below keep every state change atomic.
+REDIS_PREFIX = 'vortex:jobs:'
+REDIS_JOB_RETENTION = 24 * 3600
+# How many of the oldest queued jobs of a type a claim looks at to find one whose user is below the limit.
+REDIS_CLAIM_SCAN = 50
+
+
+REDIS_EXPIRE_LEASES_LUA = """
+local prefix, now, max_attempts = ARGV[1], ARGV[2], tonumber(ARGV[3])
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', prefix .. 'running', '-inf', now)) do
+    local key = prefix .. 'job:' .. id
+    redis.call('ZREM', prefix .. 'running', id)
+    redis.call('HINCRBY', prefix .. 'user_running', redis.call('HGET', key, 'user_id'), -1)
+    if tonumber(redis.call('HGET', key, 'attempts')) < max_attempts then
+        redis.call('HSET', key, 'status', 'queued', 'worker', '', 'updated_at', now)
+        redis.call('RPUSH', prefix .. 'queue:' .. redis.call('HGET', key, 'kind'), id)
+    else
+        redis.call('HSET', key, 'status', 'failed', 'error', 'lease expired', 'updated_at', now)
+        redis.call('RPUSH', prefix .. 'finished', id)
+    end
+end
+"""
+
+REDIS_CLAIM_LUA = """
+local prefix, worker, now, lease_until = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local per_user_limit, scan = tonumber(ARGV[5]), tonumber(ARGV[6])
+for i = 7, #ARGV do
+    local queue = prefix .. 'queue:' .. ARGV[i]
+    local ids = redis.call('LRANGE', queue, -scan, -1)
+    for j = #ids, 1, -1 do
+        local id = ids[j]
+        local key = prefix .. 'job:' .. id
+        local user = redis.call('HGET', key, 'user_id')
+        if tonumber(redis.call('HGET', prefix .. 'user_running', user) or '0') < per_user_limit then
+            redis.call('LREM', queue, -1, id)
+            redis.call('HINCRBY', prefix .. 'user_running', user, 1)
+            redis.call('HINCRBY', key, 'attempts', 1)
+            redis.call('HSET', key, 'status', 'running', 'worker', worker, 'updated_at', now)
+            redis.call('ZADD', prefix .. 'running', lease_until, id)
+            return redis.call('HGETALL', key)
+        end
+    end
+end
+return false
+"""
+
+REDIS_RENEW_LUA = """
+local prefix, id, worker, lease_until = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+if redis.call('HGET', prefix .. 'job:' .. id, 'worker') ~= worker or not redis.call('ZSCORE', prefix .. 'running', id) then
+    return 0
+end
+redis.call('ZADD', prefix .. 'running', 'XX', lease_until, id)
+return 1
+"""
+
+# Ends a run: status 'queued' puts the job back (not counting the run), 'done'/'failed' record the outcome.
+REDIS_FINISH_LUA = """
+local prefix, id, worker, status, result, error, now, retention = ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5], ARGV[6], ARGV[7], ARGV[8]
+local key = prefix .. 'job:' .. id
+if redis.call('HGET', key, 'worker') ~= worker or redis.call('ZREM', prefix .. 'running', id) == 0 then
+    return 0
+end
+redis.call('HINCRBY', prefix .. 'user_running', redis.call('HGET', key, 'user_id'), -1)
+if status == 'queued' then
+    redis.call('HINCRBY', key, 'attempts', -1)
+    redis.call('HSET', key, 'status', 'queued', 'worker', '', 'updated_at', now)
+    redis.call('RPUSH', prefix .. 'queue:' .. redis.call('HGET', key, 'kind'), id)
+else
+    redis.call('HSET', key, 'status', status, 'result', result, 'error', error, 'updated_at', now)
+    redis.call('EXPIRE', key, retention)
+    redis.call('RPUSH', prefix .. 'finished', id)
+end
+return 1
+"""
+
+
+class RedisJobQueue:
+    """
+    Job queue on a Redis server, for media workers on other machines. Same behaviour as the
+    SQLite queue: FIFO per job type, per-user limits, leases, and retries of abandoned jobs.
+    """
+
+    def __init__(self, url: str, lease: float, max_attempts: int, per_user_limit: int):
+        if redis_asyncio is None:
+            raise RuntimeError("JOB_QUEUE_BACKEND=redis needs the 'redis' package: pip install redis")
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.per_user_limit = per_user_limit
+        # The client connects on first use, from whichever event loop the process runs.
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+        self._expire_leases = self._redis.register_script(REDIS_EXPIRE_LEASES_LUA)
+        self._claim = self._redis.register_script(REDIS_CLAIM_LUA)
+        self._renew = self._redis.register_script(REDIS_RENEW_LUA)
+        self._finish = self._redis.register_script(REDIS_FINISH_LUA)
+
+    async def enqueue(self, kind: str, user_id: int, payload: dict) -> int:
+        job_id = await self._redis.incr(REDIS_PREFIX + 'seq')
+        now = time.time()
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(f"{REDIS_PREFIX}job:{job_id}", mapping={
+                'job_id': job_id, 'kind': kind, 'user_id': user_id, 'payload': json.dumps(payload),
+                'status': 'queued', 'attempts': 0, 'worker': '', 'created_at': now, 'updated_at': now,
+            })
+            pipe.lpush(f"{REDIS_PREFIX}queue:{kind}", job_id)
+            await pipe.execute()
+        return job_id
+
+    async def claim(self, kinds: list[str], worker: str) -> Optional[Job]:
+        now = time.time()
+        await self._expire_leases(args=[REDIS_PREFIX, now, self.max_attempts])
+        fields = await self._claim(args=[
+            REDIS_PREFIX, worker, now, now + self.lease, self.per_user_limit, REDIS_CLAIM_SCAN, *kinds
+        ])
+        if not fields:
+            return None
+        return Job.from_row(zip(fields[::2], fields[1::2]))
+
+    async def renew(self, job: Job, worker: str) -> bool:
+        return bool(await self._renew(args=[REDIS_PREFIX, job.id, worker, time.time() + self.lease]))
+
+    async def finish(self, job: Job, worker: str, result: Any = None, error: Optional[str] = None) -> None:
+        await self._finish(args=[
+            REDIS_PREFIX, job.id, worker, 'failed' if error else 'done', json.dumps(result), error or '',
+            time.time(), REDIS_JOB_RETENTION,
+        ])
+
+    async def requeue(self, job: Job, worker: str) -> None:
+        await self._finish(args=[REDIS_PREFIX, job.id, worker, 'queued', '', '', time.time(), REDIS_JOB_RETENTION])
+
+    async def queued_positions(self) -> dict[int, int]:
+        positions = {}
+        for kind in JOB_KINDS:
+            ids = await self._redis.lrange(f"{REDIS_PREFIX}queue:{kind}", 0, -1)
+            # Newest first, so the last id is next in line.
+            for index, job_id in enumerate(ids):
+                positions[int(job_id)] = len(ids) - index
+        return positions
+
+    async def queue_depths(self) -> dict[str, int]:
+        return {kind: await self._redis.llen(f"{REDIS_PREFIX}queue:{kind}") for kind in JOB_KINDS}
+
+    async def take_finished(self, limit: int = 100) -> list[Job]:
+        ids = await self._redis.lpop(REDIS_PREFIX + 'finished', limit) or []
+        jobs = []
+        for job_id in ids:
+            fields = await self._redis.hgetall(f"{REDIS_PREFIX}job:{job_id}")
+            if fields:
+                jobs.append(Job.from_row(fields))
+        return jobs
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_job_queue():
+    """Returns the queue backend selected by JOB_QUEUE_BACKEND."""
+    options = dict(
+        lease=settings.JOB_LEASE_SECONDS,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        per_user_limit=settings.MAX_JOBS_PER_USER,
+    )
+    if settings.JOB_QUEUE_BACKEND == 'redis':
+        logger.info(f"Using the Redis job queue at {settings.REDIS_URL}.")
+        return RedisJobQueue(settings.REDIS_URL, **options)
+    return SQLiteJobQueue(**options)
+
+
+class JobWatcher:
+    """
+    The bot side of the queue. Shows the queue position of the jobs this process queued until
+    a worker takes them (from then on the worker edits the status message), and collects
+    finished jobs: a job that failed without its worker telling the user (the worker crashed
+    or the job raised) gets an error message here.
+    """
+
+    def __init__(self, queue, interval: float):
+        self.queue = queue
+        self.interval = interval
+        # job id -> [position callback, time queued, last reported position]
+        self._tracked: dict[int, list] = {}
+        self._bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, job_id: int, on_queued: Callable[[int], Awaitable[None]]) -> None:
+        """Reports the job's queue position with `on_queued(position)` while it waits."""
+        self._tracked[job_id] = [on_queued, time.monotonic(), None]
+
+    async def _report_positions(self) -> None:
+        positions = await self.queue.queued_positions()
+        now = time.monotonic()
+        for job_id, entry in list(self._tracked.items()):
+            position = positions.get(job_id)
+            if position is None:
+                del self._tracked[job_id]
+            elif position != entry[2] and now - entry[1] >= self.interval:
+                # Jobs taken within one interval never show a position.
+                entry[2] = position
+                try:
+                    await entry[0](position)
+                except Exception as e:
+                    logger.warning(f"Failed to report queue position of job {job_id}: {e}")
+
+    async def _collect_finished(self) -> None:
+        for job in await self.queue.take_finished():
+            took = job.updated_at - job.created_at
+            if job.status == 'done':
+                logger.info(f"Job {job.id} ({job.kind}) of user {job.user_id} done in {took:.1f}s ({job.attempts} run(s)).")
+                continue
+            logger.error(f"Job {job.id} ({job.kind}) of user {job.user_id} failed after {job.attempts} run(s): {job.error}")
+            try:
+                status_message = Message.de_json(job.payload['status_message'], self._bot)
+                await status_updater.edit(status_message, "Kechirasiz, kutilmagan xatolik yuz berdi. Iltimos, qayta urinib ko'ring.")
+            except Exception as e:
+                logger.warning(f"Could not tell user {job.user_id} about failed job {job.id}: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._tracked:
+                    await self._report_positions()
+                await self._collect_finished()
+            except Exception as e:
+                logger.error(f"Job watcher failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self, bot: Bot) -> None:
+        """Starts watching. Must be called from the running event loop."""
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# --- Global Singleton Instances ---
+# The bot enqueues with `job_queue.enqueue(...)`; media workers (worker.py) claim and finish jobs.
+job_queue = create_job_queue()
+job_watcher = JobWatcher(job_queue, settings.JOB_POLL_INTERVAL)
@@ -0,0 +1,270 @@
+import time
+import asyncio
+import threading
+from bisect import bisect_left
+from typing import Optional
+from urllib.parse import urlparse
+
+# Upper bounds (in seconds) of the latency histogram buckets; every histogram also has a +Inf bucket.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+# Whisper real-time factor: processing time divided by audio duration (below 1 is faster than real time).
+RTF_BUCKETS = (0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5)
+# Hosts reported as their own platform; everything else is 'other', so label values stay few.
+PLATFORM_HOSTS = {
+    'youtube.com': 'youtube', 'youtu.be': 'youtube',
+    'instagram.com': 'instagram',
+    'tiktok.com': 'tiktok',
+    'facebook.com': 'facebook', 'fb.watch': 'facebook',
+    'twitter.com': 'twitter', 'x.com': 'twitter',
+    'vk.com': 'vk',
+    'pinterest.com': 'pinterest', 'pin.it': 'pinterest',
+}
+
+
+def platform_of(url: str) -> str:
+    """Returns the platform label of a media URL ('youtube', 'instagram', ..., or 'other')."""
+    host = (urlparse(url).hostname or '').lower()
+    while host:
+        if host in PLATFORM_HOSTS:
+            return PLATFORM_HOSTS[host]
+        host = host.partition('.')[2]
+    return 'other'
+
+
+class _Metric:
+    def __init__(self, registry: 'MetricsRegistry', name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, object] = {}
+        self._lock = registry.lock
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(key), value] for key, value in self._values.items()]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.labels), 'values': values}
+
+
+class Counter(_Metric):
+    """A value that only goes up (requests, bytes)."""
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down (running jobs, queue depth)."""
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    Observations counted in fixed buckets, plus their sum. Fixed buckets make histograms of
+    different processes add up, and quantiles are estimated from the merged buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, help: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Non-cumulative counts per bucket (the last one is +Inf), then the sum.
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.labels),
+                'buckets': list(self.buckets), 'values': values}
+
+
+class MetricsRegistry:
+    """The metrics of one process. Snapshots are plain JSON-able dicts, so processes can share them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics[metric.name] = metric
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+
+def merge_snapshots(snapshots: list[dict], with_gauges: list[bool]) -> dict:
+    """
+    Adds up snapshots of several processes into {name: {..., 'values': {label values: value}}}.
+    Gauges describe the present, so they are only taken from snapshots whose `with_gauges` flag is set.
+    """
+    merged: dict[str, dict] = {}
+    for snapshot, gauges in zip(snapshots, with_gauges):
+        for name, metric in snapshot.items():
+            if metric['type'] == 'gauge' and not gauges:
+                continue
+            target = merged.setdefault(name, {**metric, 'values': {}})
+            values = target['values']
+            for key, value in metric['values']:
+                key = tuple(key)
+                if metric['type'] != 'histogram':
+                    values[key] = values.get(key, 0) + value
+                elif key not in values:
+                    values[key] = [list(value[0]), value[1]]
+                else:
+                    counts, total = values[key]
+                    values[key] = [[a + b for a, b in zip(counts, value[0])], total + value[1]]
+    return merged
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _label_text(names: list[str], values, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render_prometheus(merged: dict) -> str:
+    """Renders merged metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in sorted(merged.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric['values'].items()):
+            if metric['type'] != 'histogram':
+                lines.append(f"{name}{_label_text(metric['labels'], key)} {_format_value(value)}")
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip([*metric['buckets'], '+Inf'], counts):
+                cumulative += count
+                le = 'le="%s"' % (bound if bound == '+Inf' else _format_value(bound))
+                lines.append(f"{name}_bucket{_label_text(metric['labels'], key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(metric['labels'], key)} {_format_value(total)}")
+            lines.append(f"{name}_count{_label_text(metric['labels'], key)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def histogram_quantile(q: float, buckets: list[float], counts: list[int]) -> Optional[float]:
+    """Estimates a quantile from bucket counts, interpolating within the bucket (like Prometheus)."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            if index == len(buckets):
+                # Beyond the largest bound nothing is known but the bound itself.
+                return buckets[-1]
+            lower = buckets[index - 1] if index else 0.0
+            return lower + (buckets[index] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return buckets[-1]
+
+
+def sum_histogram(metric: Optional[dict], **match) -> tuple[list[int], float]:
+    """Adds up the series of a merged histogram whose labels match `match`. Returns (counts, sum)."""
+    if not metric:
+        return [], 0.0
+    counts, total = [0] * (len(metric['buckets']) + 1), 0.0
+    for key, (series_counts, series_total) in metric['values'].items():
+        labels = dict(zip(metric['labels'], key))
+        if all(labels.get(name) == value for name, value in match.items()):
+            counts = [a + b for a, b in zip(counts, series_counts)]
+            total += series_total
+    return counts, total
+
+
+class StageTimer:
+    """
+    Times one stage of a media job into `stage_seconds`, as a context manager. The outcome is
+    'ok', 'error' if the block raises, 'cancelled' if it is cancelled, or whatever the block
+    sets `outcome` to (e.g. 'miss' when nothing was found).
+    """
+
+    def __init__(self, stage: str, platform: str = ''):
+        self.stage = stage
+        self.platform = platform
+        self.outcome = 'ok'
+        self.elapsed = 0.0
+        self._started = 0.0
+
+    def __enter__(self) -> 'StageTimer':
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is not None and self.outcome == 'ok':
+            self.outcome = 'cancelled' if issubclass(exc_type, asyncio.CancelledError) else 'error'
+        self.elapsed = time.monotonic() - self._started
+        stage_seconds.observe(self.elapsed, stage=self.stage, platform=self.platform, outcome=self.outcome)
+        return False
+
+
+def time_stage(stage: str, platform: str = '') -> StageTimer:
+    """Usage: `with time_stage('download', platform) as stage: ...` (see StageTimer)."""
+    return StageTimer(stage, platform)
+
+
+# --- Global Singleton Instances ---
+# Every process records into its own registry; utils.metrics_exporter shares and serves them.
+registry = MetricsRegistry()
+stage_seconds = Histogram(
+    registry, 'vortex_stage_duration_seconds', "Duration of media job stages.", ('stage', 'platform', 'outcome')
+)
+job_seconds = Histogram(
+    registry, 'vortex_job_duration_seconds', "Time queued jobs waited for a worker (phase=wait) and ran (phase=run).",
+    ('kind', 'phase', 'outcome')
+)
+shazam_window_seconds = Histogram(
+    registry, 'vortex_shazam_window_duration_seconds', "Duration of Shazam lookups per audio window.", ('window', 'outcome')
+)
+whisper_rtf = Histogram(
+    registry, 'vortex_whisper_real_time_factor', "Whisper processing time divided by audio duration.", ('model', 'beam'),
+    RTF_BUCKETS
+)
+transferred_bytes = Counter(
+    registry, 'vortex_transferred_bytes_total', "Bytes downloaded from platforms and uploaded to Telegram.",
+    ('direction', 'platform')
+)
+cache_requests = Counter(registry, 'vortex_cache_requests_total', "Cache lookups by result.", ('cache', 'result'))
+recognitions = Counter(registry, 'vortex_song_recognitions_total', "Song recognitions by result.", ('result',))
+# result: hit (remembered language used), pinned (/lang), fallback (hint dropped after a low-confidence start),
+# detected (no usable hint).
+language_hints = Counter(registry, 'vortex_language_hints_total', "Transcriptions by language hint result.", ('result',))
+language_detection_seconds = Histogram(
+    registry, 'vortex_language_detection_seconds', "Duration of Whisper language detection passes.", ('model',)
+)
+active_jobs = Gauge(registry, 'vortex_active_jobs', "Media jobs running in worker processes.", ('kind',))
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import socket
+import asyncio
+from collections import defaultdict
+from typing import Optional
+from aiohttp import web
+
+from config import settings, logger
+from database import db
+from utils.helpers import format_bytes
+from utils.job_queue import job_queue
+from utils.metrics import (
+    MetricsRegistry, Gauge, registry, merge_snapshots, render_prometheus, histogram_quantile, sum_histogram
+)
+
+# A process whose snapshot is older than this many publish intervals no longer contributes gauges.
+FRESH_INTERVALS = 3
+# Content type of the Prometheus text exposition format.
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsExporter:
+    """
+    Shares the metrics of every bot and media worker process and serves their sum on /metrics.
+
+    Each process writes a snapshot of its registry to the database every `interval` seconds
+    (and once more when it stops). `collect()` adds up the snapshots with the live registry of
+    the calling process and the current queue depths; the Prometheus endpoint and the admin
+    commands both read it. Counters and histograms of stopped processes keep counting until
+    their snapshot is older than `retention`; gauges only come from recently published snapshots.
+    """
+
+    def __init__(self, registry: MetricsRegistry, interval: float, retention: float):
+        self.registry = registry
+        self.interval = interval
+        self.retention = retention
+        self.process = f"{socket.gethostname()}:{os.getpid()}"
+        # Queue depths are read from the queue when collecting, so they are never published.
+        self._queue_registry = MetricsRegistry()
+        self._queue_depth = Gauge(self._queue_registry, 'vortex_queue_depth', "Media jobs waiting in the job queue.", ('kind',))
+        self._task: Optional[asyncio.Task] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def publish(self) -> None:
+        await db.save_metrics_snapshot(self.process, json.dumps(self.registry.snapshot()), self.retention)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.publish()
+            except Exception as e:
+                logger.warning(f"Failed to publish metrics: {e}")
+
+    def start(self) -> None:
+        """Starts publishing this process's metrics. Must be called from the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def collect(self) -> dict:
+        """Returns the merged metrics of all processes (see utils.metrics.merge_snapshots)."""
+        try:
+            for kind, depth in (await job_queue.queue_depths()).items():
+                self._queue_depth.set(depth, kind=kind)
+        except Exception as e:
+            logger.warning(f"Could not read the job queue depths: {e}")
+        now = time.time()
+        snapshots = [self.registry.snapshot(), self._queue_registry.snapshot()]
+        with_gauges = [True, True]
+        for row in await db.get_metrics_snapshots(now - self.retention):
+            if row['process'] == self.process:
+                continue
+            snapshots.append(json.loads(row['data']))
+            with_gauges.append(now - row['updated_at'] <= FRESH_INTERVALS * self.interval)
+        return merge_snapshots(snapshots, with_gauges)
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        body = render_prometheus(await self.collect())
+        return web.Response(body=body.encode(), headers={'Content-Type': PROMETHEUS_CONTENT_TYPE})
+
+    async def serve(self, host: str, port: int) -> None:
+        """Serves http://host:port/metrics until `stop()`. A port of 0 disables the endpoint."""
+        if not port or self._runner:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError as e:
+            # Metrics are not worth failing the bot for (e.g. the port is taken by another instance).
+            logger.warning(f"Could not serve metrics on {host}:{port}: {e}")
+            await runner.cleanup()
+            return
+        self._runner = runner
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics.")
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            try:
+                await self.publish()
+            except Exception as e:
+                logger.warning(f"Failed to publish metrics: {e}")
+
+
+def _latency_text(buckets: list[float], counts: list[int]) -> str:
+    p50, p95 = histogram_quantile(0.5, buckets, counts), histogram_quantile(0.95, buckets, counts)
+    if p50 is None:
+        return "-"
+    return f"p50 {p50:.2f}s, p95 {p95:.2f}s"
+
+
+def _language_memory_text(hints: dict, detection: dict | None) -> str:
+    """Share of transcriptions that skipped language detection, and the detection time that saved."""
+    results = defaultdict(float)
+    for (result,), value in hints['values'].items():
+        results[result] += value
+    skipped = results['hit'] + results['pinned']
+    total = sum(results.values())
+    text = f"Til xotirasi: {skipped / total:.0%} ({skipped:.0f}/{total:.0f}), qayta aniqlash {results['fallback']:.0f} ta"
+    if detection:
+        # Every skipped detection saves about as long as an average detection pass takes.
+        count = sum(sum(counts) for counts, _ in detection['values'].values())
+        seconds = sum(spent for _, spent in detection['values'].values())
+        if count:
+            text += f", tejalgan vaqt ~{skipped * seconds / count:.0f}s"
+    return text
+
+
+def latency_report(merged: dict) -> str:
+    """Returns a human-readable (HTML) p50/p95 summary of the merged metrics."""
+    stages = merged.get('vortex_stage_duration_seconds')
+    jobs = merged.get('vortex_job_duration_seconds')
+    if not stages and not jobs:
+        return "Hali statistika yo'q."
+    lines = []
+
+    if jobs:
+        lines.append("<b>Navbat (kutish / bajarish)</b>")
+        for kind in sorted({key[0] for key in jobs['values']}):
+            wait, _ = sum_histogram(jobs, kind=kind, phase='wait')
+            run, _ = sum_histogram(jobs, kind=kind, phase='run')
+            lines.append(
+                f"• <b>{kind}</b>: kutish {_latency_text(jobs['buckets'], wait)}; "
+                f"bajarish {_latency_text(jobs['buckets'], run)} ({sum(run)} ta)"
+            )
+
+    if stages:
+        lines.append("\n<b>Bosqichlar</b>")
+        series = defaultdict(lambda: defaultdict(int))
+        for (stage, platform, outcome), (counts, _) in stages['values'].items():
+            series[(stage, platform)][outcome] += sum(counts)
+        for stage, platform in sorted(series):
+            counts, _ = sum_histogram(stages, stage=stage, platform=platform)
+            outcomes = series[(stage, platform)]
+            total = sum(outcomes.values())
+            name = f"{stage} ({platform})" if platform else stage
+            lines.append(
+                f"• <b>{name}</b>: {_latency_text(stages['buckets'], counts)}, {total} ta, "
+                f"xato {(outcomes['error'] + outcomes['cancelled']) / total:.0%}"
+            )
+
+    rtf = merged.get('vortex_whisper_real_time_factor')
+    if rtf:
+        for (model, beam), (counts, _) in sorted(rtf['values'].items()):
+            p50, p95 = histogram_quantile(0.5, rtf['buckets'], counts), histogram_quantile(0.95, rtf['buckets'], counts)
+            lines.append(f"\nWhisper RTF ({model}, beam {beam}): p50 {p50:.2f}, p95 {p95:.2f} ({sum(counts)} ta)")
+
+    transferred = merged.get('vortex_transferred_bytes_total')
+    if transferred:
+        totals = defaultdict(float)
+        for (direction, _), value in transferred['values'].items():
+            totals[direction] += value
+        lines.append(f"Trafik: yuklab olindi {format_bytes(totals['download'])}, yuborildi {format_bytes(totals['upload'])}")
+
+    caches = merged.get('vortex_cache_requests_total')
+    if caches:
+        results = defaultdict(lambda: defaultdict(float))
+        for (cache, result), value in caches['values'].items():
+            results[cache][result] += value
+        lines.append("Kesh: " + ", ".join(
+            f"{cache} {counts['hit'] / (counts['hit'] + counts['miss']):.0%} ({counts['hit']:.0f}/{counts['hit'] + counts['miss']:.0f})"
+            for cache, counts in sorted(results.items()) if counts['hit'] + counts['miss']
+        ))
+
+    hints = merged.get('vortex_language_hints_total')
+    if hints:
+        lines.append(_language_memory_text(hints, merged.get('vortex_language_detection_seconds')))
+
+    for name, title in (('vortex_active_jobs', "Bajarilmoqda"), ('vortex_queue_depth', "Navbatda")):
+        gauge = merged.get(name)
+        if gauge:
+            lines.append(f"{title}: " + ", ".join(f"{kind} {value:.0f}" for (kind,), value in sorted(gauge['values'].items())))
+    return "\n".join(lines)
+
+
+# --- Global Singleton Instance ---
+metrics_exporter = MetricsExporter(
+    registry, settings.METRICS_FLUSH_INTERVAL, settings.METRICS_RETENTION_HOURS * 3600
+)
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+from typing import Any, Callable, Optional
+
+# This module is imported by the worker processes too, so it must not depend on `config`.
+logger = logging.getLogger(__name__)
+
+# Delay before respawning a worker that died while starting up, to avoid a hot crash loop.
+RESPAWN_DELAY = 5.0
+
+
+class WorkerPoolFull(Exception):
+    """Raised when a pool already has its maximum number of pending jobs (back-pressure)."""
+    pass
+
+class WorkerJobTimeout(Exception):
+    """Raised when a job exceeds its timeout. The worker running it is killed and replaced."""
+    pass
+
+class WorkerCrashed(Exception):
+    """Raised when a worker process exits while running a job."""
+    pass
+
+class WorkerJobError(Exception):
+    """Raised when a job failed inside the worker. Carries the remote exception class name."""
+    def __init__(self, error_class: str, message: str):
+        super().__init__(f"{error_class}: {message}")
+        self.error_class = error_class
+        self.message = message
+
+
+# --- Worker (child process) side ---
+
+def serve(conn, handle_job: Callable[[dict, Callable[[Any], None]], Any]) -> None:
+    """
+    Runs the job loop inside a worker process. Call it from the worker's target function
+    once its expensive state (models, imports) is loaded.
+
+    `handle_job(job, emit)` runs one job; `emit(event)` streams an intermediate event back
+    to the submitter. A `None` job shuts the worker down.
+    """
+    conn.send(('ready', None))
+    emit = lambda event: conn.send(('event', event))
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+        try:
+            conn.send(('result', handle_job(job, emit)))
+        except Exception as e:
+            conn.send(('error', (type(e).__name__, str(e))))
+
+
+# --- Pool (bot process) side ---
+
+class _Worker:
+    """A worker process plus the thread that forwards its messages to the event loop."""
+
+    def __init__(self, ctx, target: Callable, args: tuple, loop: asyncio.AbstractEventLoop, index: int):
+        self.index = index
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=target, args=(child_conn, *args), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self._reader = threading.Thread(target=self._read_loop, args=(loop,), daemon=True)
+        self._reader.start()
+
+    def _read_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                message = ('exit', None)
+            try:
+                loop.call_soon_threadsafe(self.inbox.put_nowait, message)
+            except RuntimeError:
+                return  # Event loop already closed
+            if message[0] == 'exit':
+                return
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ProcessWorkerPool:
+    """
+    A pool of long-lived worker processes that keep expensive state (models, imports) warm.
+
+    Jobs are dispatched to idle workers; at most `max_pending` jobs may be queued or running
+    at once, beyond which `submit` raises `WorkerPoolFull`. A job that times out or is
+    cancelled kills its worker, which is then replaced by a fresh one.
+    """
+
+    def __init__(self, name: str, target: Callable, args: tuple, size: int, max_pending: int, job_timeout: float):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.size = size
+        self.max_pending = max_pending
+        self.job_timeout = job_timeout
+        self._ctx = multiprocessing.get_context('spawn')
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: set[_Worker] = set()
+        self._pending = 0
+        self._spawned = 0
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs currently queued or running."""
+        return self._pending
+
+    async def start(self) -> None:
+        """Starts all workers. They warm up in the background and become idle once ready."""
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            self._spawn()
+        logger.info(f"Worker pool '{self.name}' started with {self.size} process(es).")
+
+    def _spawn(self) -> None:
+        self._spawned += 1
+        worker = _Worker(self._ctx, self.target, self.args, asyncio.get_running_loop(), self._spawned)
+        self._workers.add(worker)
+        asyncio.create_task(self._await_ready(worker))
+
+    async def _await_ready(self, worker: _Worker) -> None:
+        kind, _ = await worker.inbox.get()
+        if kind == 'ready':
+            logger.info(f"Worker {self.name}#{worker.index} (pid {worker.process.pid}) is ready.")
+            self._idle.put_nowait(worker)
+            return
+        logger.error(f"Worker {self.name}#{worker.index} exited during startup; respawning in {RESPAWN_DELAY}s.")
+        self._discard(worker)
+        await asyncio.sleep(RESPAWN_DELAY)
+        if not self._closed:
+            self._spawn()
+
+    def _discard(self, worker: _Worker) -> None:
+        self._workers.discard(worker)
+        worker.kill()
+
+    def _replace(self, worker: _Worker) -> None:
+        self._discard(worker)
+        if not self._closed:
+            self._spawn()
+
+    async def submit(self, job: dict, timeout: Optional[float] = None, on_event: Optional[Callable[[Any], None]] = None) -> Any:
+        """
+        Runs a job on the next idle worker and returns its result.
+        `on_event` is called on the event loop for every event the job emits.
+        """
+        if self._closed:
+            raise RuntimeError(f"Worker pool '{self.name}' is shut down.")
+        if self._pending >= self.max_pending:
+            raise WorkerPoolFull(f"Worker pool '{self.name}' has {self._pending} pending jobs.")
+        await self.start()
+
+        self._pending += 1
+        try:
+            worker = await self._idle.get()
+            while not worker.process.is_alive():
+                logger.warning(f"Idle worker {self.name}#{worker.index} died; replacing it.")
+                self._replace(worker)
+                worker = await self._idle.get()
+            try:
+                result = await asyncio.wait_for(self._run(worker, job, on_event), timeout or self.job_timeout)
+            except WorkerJobError:
+                self._idle.put_nowait(worker)
+                raise
+            except asyncio.TimeoutError:
+                logger.warning(f"Job on worker {self.name}#{worker.index} timed out; replacing the worker.")
+                self._replace(worker)
+                raise WorkerJobTimeout(f"Job exceeded {timeout or self.job_timeout}s in pool '{self.name}'.")
+            except BaseException:
+                # Cancelled or crashed mid-job: the worker's state is unknown, so start a fresh one.
+                self._replace(worker)
+                raise
+            self._idle.put_nowait(worker)
+            return result
+        finally:
+            self._pending -= 1
+
+    async def _run(self, worker: _Worker, job: dict, on_event: Optional[Callable[[Any], None]]) -> Any:
+        worker.conn.send(job)
+        while True:
+            kind, payload = await worker.inbox.get()
+            if kind == 'event':
+                if on_event:
+                    on_event(payload)
+            elif kind == 'result':
+                return payload
+            elif kind == 'error':
+                raise WorkerJobError(*payload)
+            else:
+                raise WorkerCrashed(f"Worker {self.name}#{worker.index} exited while running a job.")
+
+    async def shutdown(self) -> None:
+        """Asks all workers to exit and kills the ones that do not."""
+        self._closed = True
+        for worker in list(self._workers):
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        loop = asyncio.get_running_loop()
+        for worker in list(self._workers):
+            await loop.run_in_executor(None, worker.process.join, 5)
+            worker.kill()
+        self._workers.clear()
+        logger.info(f"Worker pool '{self.name}' shut down.")
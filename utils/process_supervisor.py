@@ -0,0 +1,68 @@
+import signal
+import asyncio
+import threading
+import multiprocessing
+from typing import Callable, Optional
+
+from config import logger
+
+# Delay before restarting a supervised process that exited.
+RESTART_DELAY = 5.0
+
+
+async def wait_for_stop_signal() -> None:
+    """Waits for SIGINT/SIGTERM, so shutdown hooks run when a process is stopped or terminated."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop.wait()
+
+
+class ProcessSupervisor:
+    """
+    Keeps long-running child processes (bot workers, media workers) alive: each one is started
+    from a fresh interpreter and restarted after RESTART_DELAY whenever it exits, until `stop`.
+    Every process is watched by a daemon thread, so the supervisor works with or without an event loop.
+    """
+
+    def __init__(self):
+        self._ctx = multiprocessing.get_context('spawn')
+        self._processes: dict[str, multiprocessing.Process] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def add(self, name: str, target: Callable, args: tuple = ()) -> None:
+        """Starts `target(*args)` in a process named `name` and keeps it running."""
+        threading.Thread(target=self._supervise, args=(name, target, args), name=name, daemon=True).start()
+
+    def _supervise(self, name: str, target: Callable, args: tuple) -> None:
+        while True:
+            with self._lock:
+                if self._stopping.is_set():
+                    return
+                # Not a daemon: bot and media workers start process pools of their own.
+                process = self._ctx.Process(target=target, args=args, name=name)
+                process.start()
+                self._processes[name] = process
+            process.join()
+            if self._stopping.is_set():
+                return
+            logger.error(f"Process {name} exited with code {process.exitcode}; restarting in {RESTART_DELAY}s.")
+            self._stopping.wait(RESTART_DELAY)
+
+    def stop(self, timeout: Optional[float] = 30) -> None:
+        """Stops the processes with SIGTERM, so they run their shutdown hooks, and kills those that hang."""
+        with self._lock:
+            self._stopping.set()
+            processes = list(self._processes.values())
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
@@ -0,0 +1,123 @@
+import time
+import asyncio
+from typing import Optional
+from shazamio import Shazam
+
+from config import settings, logger
+from utils.helpers import probe_media_duration, extract_audio_window
+from utils.metrics import shazam_window_seconds, recognitions, histogram_quantile, sum_histogram
+
+# Shazam signatures are computed from 16 kHz mono audio, so decoding at a higher rate is wasted work.
+SHAZAM_SAMPLE_RATE = 16000
+# Windows shorter than this (in bytes of WAV data) hold too little audio for a signature.
+MIN_WINDOW_BYTES = SHAZAM_SAMPLE_RATE * 2 * 3
+# Cancellation message used when the shared deadline expires (as opposed to an early exit).
+_DEADLINE = 'deadline'
+# Outcomes of a window lookup (the `outcome` label of shazam_window_seconds).
+WINDOW_OUTCOMES = ('hit', 'miss', 'error', 'timeout', 'cancelled')
+
+
+def recognition_summary(merged: dict) -> str:
+    """
+    Returns a human-readable (HTML) report of per-window latency and hit rate, used to tune the
+    number and offsets of windows. `merged` is the merged metrics of all processes.
+    """
+    results = (merged.get('vortex_song_recognitions_total') or {}).get('values', {})
+    recognized, total = results.get(('found',), 0), results.get(('found',), 0) + results.get(('not_found',), 0)
+    if not total:
+        return "Hali statistika yo'q."
+    lines = [f"Aniqlashlar: <b>{total:.0f}</b>, topildi: <b>{recognized:.0f}</b> ({recognized / total:.0%})"]
+    windows = merged.get('vortex_shazam_window_duration_seconds')
+    for label in sorted({key[0] for key in windows['values']} if windows else ()):
+        counts = {outcome: sum_histogram(windows, window=label, outcome=outcome)[0] for outcome in WINDOW_OUTCOMES}
+        hits, completed = sum(counts['hit']), sum(counts['hit']) + sum(counts['miss'])
+        hit_rate = f"{hits / completed:.0%}" if completed else "-"
+        # Latency of lookups that got an answer; errors and cancellations say little about Shazam.
+        latencies = [a + b for a, b in zip(counts['hit'], counts['miss'])]
+        p50 = histogram_quantile(0.5, windows['buckets'], latencies)
+        p95 = histogram_quantile(0.95, windows['buckets'], latencies)
+        latency_text = f"p50 {p50:.1f}s, p95 {p95:.1f}s" if p50 is not None else "-"
+        lines.append(
+            f"• <b>{label}</b>: hit {hit_rate} ({hits}/{completed}), {latency_text}, "
+            f"xato {sum(counts['error'])}, vaqt tugadi {sum(counts['timeout'])}, bekor {sum(counts['cancelled'])}"
+        )
+    return "\n".join(lines)
+
+
+def get_windows(duration: Optional[float]) -> list[tuple[str, float]]:
+    """
+    Returns (label, start offset in seconds) for the windows to sample from media of the given duration.
+    The label is the configured fraction of the duration, so statistics stay comparable across media.
+    """
+    window = settings.SHAZAM_WINDOW_SECONDS
+    if not duration or duration <= window:
+        return [('full', 0.0)]
+    windows, offsets = [], set()
+    for fraction in settings.SHAZAM_WINDOW_OFFSETS:
+        offset = round(min(max(0.0, duration * fraction - window / 2), duration - window), 1)
+        if offset not in offsets:
+            offsets.add(offset)
+            windows.append((f"{fraction:g}", offset))
+    return windows
+
+
+async def _recognize_window(shazam: Shazam, media_path: str, label: str, offset: float) -> Optional[dict]:
+    """Decodes one window into memory and looks it up. Returns Shazam's track info on a confident match."""
+    started = time.monotonic()
+    outcome = 'error'
+    try:
+        audio = await extract_audio_window(media_path, offset, settings.SHAZAM_WINDOW_SECONDS, SHAZAM_SAMPLE_RATE)
+        if len(audio) < MIN_WINDOW_BYTES:
+            outcome = 'miss'
+            return None
+        result = await shazam.recognize(audio)
+        track = result.get('track')
+        # A track without any signature matches is not a real hit.
+        outcome = 'hit' if track and result.get('matches') else 'miss'
+        return track if outcome == 'hit' else None
+    except asyncio.CancelledError as e:
+        outcome = 'timeout' if e.args and e.args[0] == _DEADLINE else 'cancelled'
+        raise
+    except Exception as e:
+        logger.error(f"Shazam error for window '{label}' ({offset}s) of {media_path}: {e}")
+        return None
+    finally:
+        latency = time.monotonic() - started
+        shazam_window_seconds.observe(latency, window=label, outcome=outcome)
+        logger.debug(f"Shazam window '{label}' ({offset}s) of {media_path}: {outcome} in {latency:.2f}s")
+
+
+async def recognize_song(media_path: str) -> Optional[dict]:
+    """
+    Identifies the song in a media file from several short windows looked up concurrently.
+    All windows share one deadline; the first confident match wins and the other lookups are
+    cancelled. Returns Shazam's track info, or None if no window matched in time.
+    """
+    duration = await probe_media_duration(media_path)
+    shazam = Shazam()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.SHAZAM_TIMEOUT
+
+    pending = {
+        asyncio.create_task(_recognize_window(shazam, media_path, label, offset))
+        for label, offset in get_windows(duration)
+    }
+    track, deadline_reached = None, False
+    try:
+        while pending and not track:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0.0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                logger.warning(f"Song recognition deadline of {settings.SHAZAM_TIMEOUT}s reached for {media_path}.")
+                deadline_reached = True
+                break
+            track = next((task.result() for task in done if task.result()), None)
+    finally:
+        # Early exit (or an outer cancellation) cancels the remaining lookups.
+        for task in pending:
+            task.cancel(_DEADLINE if deadline_reached else None)
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    recognitions.inc(result='found' if track is not None else 'not_found')
+    return track
@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Optional
+
+from config import settings, logger
+
+# How often a waiting job re-checks its queue position to report it to the user.
+POSITION_REPORT_INTERVAL = 5.0
+
+
+class _Ticket:
+    """A single job waiting for (or holding) a slot in a pool."""
+    __slots__ = ('pool', 'user_id', 'granted')
+
+    def __init__(self, pool: str, user_id: int):
+        self.pool = pool
+        self.user_id = user_id
+        self.granted = asyncio.Event()
+
+
+class JobScheduler:
+    """
+    Bounds how many heavy media jobs run at once.
+
+    Each job type has its own pool with a concurrency limit, on top of a global limit
+    and a per-user limit. Waiting jobs are started in FIFO order per pool; a job whose
+    user is already at the per-user limit is skipped so it cannot block other users.
+    Slots must not be nested: a handler acquires one pool per stage, one stage at a time.
+    """
+
+    def __init__(self, pool_limits: dict[str, int], global_limit: int, per_user_limit: int):
+        self.pool_limits = pool_limits
+        self.global_limit = global_limit
+        self.per_user_limit = per_user_limit
+        self._waiting: dict[str, deque[_Ticket]] = {name: deque() for name in pool_limits}
+        self._pool_active: dict[str, int] = defaultdict(int)
+        self._user_active: dict[int, int] = defaultdict(int)
+        self._total_active = 0
+
+    def queue_position(self, ticket: _Ticket) -> int:
+        """Returns the 1-based position of a waiting ticket in its pool's queue."""
+        try:
+            return self._waiting[ticket.pool].index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Returns the number of active and waiting jobs per pool."""
+        return {
+            name: {'active': self._pool_active[name], 'waiting': len(self._waiting[name])}
+            for name in self.pool_limits
+        }
+
+    def _dispatch(self) -> None:
+        """Grants slots to every waiting ticket that fits the pool, global and per-user limits."""
+        for name, waiting in self._waiting.items():
+            for ticket in list(waiting):
+                if self._total_active >= self.global_limit:
+                    return
+                if self._pool_active[name] >= self.pool_limits[name]:
+                    break
+                if self._user_active.get(ticket.user_id, 0) >= self.per_user_limit:
+                    continue
+                waiting.remove(ticket)
+                self._pool_active[name] += 1
+                self._user_active[ticket.user_id] += 1
+                self._total_active += 1
+                ticket.granted.set()
+
+    def _release(self, ticket: _Ticket) -> None:
+        self._pool_active[ticket.pool] -= 1
+        self._user_active[ticket.user_id] -= 1
+        if self._user_active[ticket.user_id] <= 0:
+            del self._user_active[ticket.user_id]
+        self._total_active -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def job(
+        self,
+        pool: str,
+        user_id: int,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None
+    ):
+        """
+        Waits for a free slot in `pool` and holds it for the duration of the `async with` block.
+        While waiting, `on_queued(position)` is awaited whenever the queue position changes.
+        """
+        ticket = _Ticket(pool, user_id)
+        self._waiting[pool].append(ticket)
+        self._dispatch()
+
+        try:
+            last_position = None
+            while not ticket.granted.is_set():
+                position = self.queue_position(ticket)
+                if on_queued and position != last_position:
+                    last_position = position
+                    try:
+                        await on_queued(position)
+                    except Exception as e:
+                        logger.warning(f"Failed to report queue position for user {user_id}: {e}")
+                try:
+                    await asyncio.wait_for(ticket.granted.wait(), timeout=POSITION_REPORT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if ticket.granted.is_set():
+                self._release(ticket)
+            else:
+                self._waiting[pool].remove(ticket)
+            raise
+
+        logger.debug(f"Job started in pool '{pool}' for user {user_id}: {self.stats()}")
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+
+# --- Global Singleton Instance ---
+# Other modules can `from utils.scheduler import scheduler` and wrap heavy work in `scheduler.job(...)`.
+scheduler = JobScheduler(
+    pool_limits={
+        'download': settings.DOWNLOAD_CONCURRENCY,
+        'audio': settings.AUDIO_CONCURRENCY,
+        'transcribe': settings.TRANSCRIBE_CONCURRENCY,
+    },
+    global_limit=settings.MAX_CONCURRENT_JOBS,
+    per_user_limit=settings.MAX_JOBS_PER_USER,
+)
@@ -0,0 +1,106 @@
+import re
+import time
+import asyncio
+import threading
+import concurrent.futures
+from typing import Optional
+from yt_dlp import YoutubeDL
+
+from config import settings, logger
+from database import db
+from utils.metrics import cache_requests
+
+YTDL_SEARCH_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'noplaylist': True,
+    'default_search': 'ytsearch',
+    'extract_flat': 'in_playlist',
+}
+
+
+def normalize_query(query: str) -> str:
+    """Cache key of a search: case-folded, with whitespace collapsed, so "Artist - Title" variants share one entry."""
+    return re.sub(r'\s+', ' ', query).strip().casefold()
+
+
+class SongSearchService:
+    """
+    Finds the YouTube video of a recognized song ("artist - title") without blocking the event loop.
+
+    Searches run on a small thread pool, so at most SONG_SEARCH_CONCURRENCY run at once and one
+    slow search only delays its own caller. Each thread keeps one initialized YoutubeDL instance
+    (extractors are loaded once), results are cached in the database with a TTL, and concurrent
+    searches for the same song share a single lookup.
+    """
+
+    def __init__(self, concurrency: int, timeout: float, ttl: float, miss_ttl: float):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='song-search')
+        self._local = threading.local()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def _get_ydl(self) -> YoutubeDL:
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            ydl = self._local.ydl = YoutubeDL(YTDL_SEARCH_OPTIONS)
+        return ydl
+
+    def _search_sync(self, query: str) -> Optional[str]:
+        """Runs on a search thread. Returns the id of the first result, or None."""
+        result = self._get_ydl().extract_info(f"ytsearch1:{query}", download=False)
+        entries = (result or {}).get('entries') or []
+        return entries[0].get('id') if entries else None
+
+    async def _lookup(self, query: str, key: str) -> Optional[str]:
+        row = await db.get_song_search(key)
+        if row is not None:
+            max_age = self.ttl if row['video_id'] else self.miss_ttl
+            if time.time() - row['created_at'] < max_age:
+                logger.debug(f"Song search cache hit for '{query}': {row['video_id']}")
+                cache_requests.inc(cache='song_search', result='hit')
+                return row['video_id']
+        cache_requests.inc(cache='song_search', result='miss')
+
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            video_id = await asyncio.wait_for(loop.run_in_executor(self._executor, self._search_sync, query), self.timeout)
+        except asyncio.TimeoutError:
+            # The search thread finishes on its own; its result is simply not used.
+            logger.warning(f"YouTube search for '{query}' timed out after {self.timeout}s.")
+            return None
+        except Exception as e:
+            logger.error(f"yt-dlp YouTube search error for '{query}': {e}")
+            return None
+        logger.info(f"YouTube search for '{query}' took {time.monotonic() - started:.2f}s: {video_id}")
+        await db.cache_song_search(key, video_id, max(self.ttl, self.miss_ttl))
+        return video_id
+
+    async def find_youtube_url(self, query: str) -> Optional[str]:
+        """Returns the YouTube URL of the best match for a song, or None if nothing was found."""
+        key = normalize_query(query)
+        if not key:
+            return None
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = asyncio.ensure_future(self._lookup(query, key))
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded, so one caller giving up does not cancel the lookup other callers wait for.
+        video_id = await asyncio.shield(future)
+        return f"https://www.youtube.com/watch?v={video_id}" if video_id else None
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- Global Singleton Instance ---
+song_search = SongSearchService(
+    concurrency=settings.SONG_SEARCH_CONCURRENCY,
+    timeout=settings.SONG_SEARCH_TIMEOUT,
+    ttl=settings.SONG_SEARCH_CACHE_TTL_SECONDS,
+    miss_ttl=settings.SONG_SEARCH_MISS_TTL_SECONDS,
+)
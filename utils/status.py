@@ -0,0 +1,173 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Optional
+from telegram import Message, error as telegram_error
+
+from config import logger
+
+# Minimum delay between two edits of the same message.
+MESSAGE_EDIT_INTERVAL = 2.0
+# Telegram allows roughly one message per second per chat (with short bursts)...
+CHAT_EDITS_PER_SECOND = 1.0
+CHAT_EDIT_BURST = 3
+# ...and about 30 requests per second overall; stay below it to leave room for uploads and replies.
+GLOBAL_EDITS_PER_SECOND = 25.0
+# Idle per-chat rate limiters are pruned once there are more than this many.
+MAX_IDLE_CHAT_BUCKETS = 1000
+# Last edit times of drained messages are kept (for MESSAGE_EDIT_INTERVAL) for at most this many messages.
+MAX_RECENT_EDITS = 10000
+
+
+class _TokenBucket:
+    """A simple token bucket: `acquire` waits until a token is available."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _MessageState:
+    """Pending (not yet sent) text of one status message and its delivery bookkeeping."""
+    __slots__ = ('message', 'text', 'parse_mode', 'sent_text', 'sent_at', 'task', 'delivered')
+
+    def __init__(self, message: Message):
+        self.message = message
+        self.text: Optional[str] = None
+        self.parse_mode: Optional[str] = None
+        self.sent_text: Optional[str] = None
+        self.sent_at = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self.delivered = asyncio.Event()
+
+
+class StatusUpdater:
+    """
+    The single place through which status messages are edited.
+
+    Edits are coalesced per message: while one is waiting for its turn, newer texts simply
+    replace it, so only the latest state is ever sent. Delivery respects a minimum interval
+    per message and token buckets per chat and globally, and handles Telegram's RetryAfter.
+    """
+
+    def __init__(self):
+        self._states: dict[tuple[int, int], _MessageState] = {}
+        # When each recently drained message was last edited, oldest first, so the next
+        # burst of updates for it still waits out MESSAGE_EDIT_INTERVAL.
+        self._recent_edits: OrderedDict[tuple[int, int], float] = OrderedDict()
+        self._chat_buckets: dict[int, _TokenBucket] = {}
+        self._global_bucket = _TokenBucket(GLOBAL_EDITS_PER_SECOND, GLOBAL_EDITS_PER_SECOND)
+
+    @staticmethod
+    def _key(message: Message) -> tuple[int, int]:
+        return message.chat_id, message.message_id
+
+    def update(self, message: Message, text: str, parse_mode: Optional[str] = None) -> None:
+        """Schedules an edit without waiting for it (for frequent progress updates)."""
+        key = self._key(message)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _MessageState(message)
+            state.sent_at = self._recent_edits.pop(key, 0.0)
+            if len(self._chat_buckets) > MAX_IDLE_CHAT_BUCKETS:
+                self._prune_chat_buckets()
+        state.text, state.parse_mode = text, parse_mode
+        state.delivered.clear()
+        if state.task is None or state.task.done():
+            state.task = asyncio.create_task(self._drain(key, state))
+
+    async def edit(self, message: Message, text: str, parse_mode: Optional[str] = None) -> None:
+        """Schedules an edit and waits until it (or a newer text for the same message) has been sent."""
+        self.update(message, text, parse_mode)
+        state = self._states[self._key(message)]
+        await state.delivered.wait()
+
+    def _prune_chat_buckets(self) -> None:
+        """Forgets the rate limits of chats whose bucket has refilled completely (idle chats)."""
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            bucket._refill()
+            if bucket._tokens >= bucket.capacity:
+                del self._chat_buckets[chat_id]
+
+    def discard(self, message: Message) -> None:
+        """Drops any pending edit for a message, e.g. before deleting it."""
+        key = self._key(message)
+        self._recent_edits.pop(key, None)
+        state = self._states.pop(key, None)
+        if state and state.task and not state.task.done():
+            state.task.cancel()
+        if state:
+            state.delivered.set()
+
+    async def _drain(self, key: tuple[int, int], state: _MessageState) -> None:
+        try:
+            while state.text is not None:
+                wait = state.sent_at + MESSAGE_EDIT_INTERVAL - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                bucket = self._chat_buckets.setdefault(key[0], _TokenBucket(CHAT_EDITS_PER_SECOND, CHAT_EDIT_BURST))
+                await bucket.acquire()
+                await self._global_bucket.acquire()
+
+                text, parse_mode = state.text, state.parse_mode
+                state.text = None
+                if text != state.sent_text:
+                    await self._send(state, text, parse_mode)
+        finally:
+            state.delivered.set()
+            if self._states.get(key) is state and state.text is None:
+                del self._states[key]
+                if state.sent_at:
+                    self._remember_edit(key, state.sent_at)
+
+    def _remember_edit(self, key: tuple[int, int], sent_at: float) -> None:
+        """Keeps a drained message's last edit time while it still limits the next edit."""
+        self._recent_edits[key] = sent_at
+        self._recent_edits.move_to_end(key)
+        cutoff = time.monotonic() - MESSAGE_EDIT_INTERVAL
+        while self._recent_edits:
+            oldest_key, oldest = next(iter(self._recent_edits.items()))
+            if oldest > cutoff and len(self._recent_edits) <= MAX_RECENT_EDITS:
+                break
+            del self._recent_edits[oldest_key]
+
+    async def _send(self, state: _MessageState, text: str, parse_mode: Optional[str]) -> None:
+        message = state.message
+        try:
+            if message.caption is not None:
+                await message.edit_caption(caption=text, parse_mode=parse_mode)
+            else:
+                await message.edit_text(text, parse_mode=parse_mode)
+            state.sent_text = text
+        except telegram_error.RetryAfter as e:
+            logger.warning(f"Status edit rate-limited for chat {message.chat_id}; retrying in {e.retry_after}s.")
+            if state.text is None:
+                state.text, state.parse_mode = text, parse_mode
+            await asyncio.sleep(e.retry_after)
+        except telegram_error.BadRequest as e:
+            # "Message is not modified" or the message is gone; neither is worth retrying.
+            logger.debug(f"Status edit skipped for message {message.message_id}: {e}")
+        except telegram_error.TelegramError as e:
+            logger.warning(f"Status edit failed for message {message.message_id}: {e}")
+        finally:
+            state.sent_at = time.monotonic()
+
+
+# --- Global Singleton Instance ---
+# Other modules can `from utils.status import status_updater` to edit status messages.
+status_updater = StatusUpdater()
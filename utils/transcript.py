@@ -0,0 +1,84 @@
+import html
+import asyncio
+from typing import Optional
+from telegram import Message, error as telegram_error
+from config import logger
+from utils.status import status_updater
+
+# Telegram allows 4096 characters per message; keep room for the progress/language header.
+PAGE_LIMIT = 3800
+
+
+class StreamingTranscript:
+    """
+    Shows a transcript in Telegram while it is being decoded.
+
+    Segments are appended with `add_segment` (from the Whisper pool's event callback).
+    The status message shows the text so far and a percent-of-duration progress line, and
+    text that does not fit into one message overflows into new reply messages. Edits go
+    through the shared status updater, which coalesces and rate-limits them.
+    """
+
+    def __init__(self, status_message: Message):
+        self.status_message = status_message
+        self._pages: list[str] = [""]
+        self._messages: list[Message] = [status_message]
+        self._progress = 0
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add_segment(self, event: dict) -> None:
+        """Appends a decoded segment ({'text', 'end', 'duration'}) and schedules a re-render."""
+        text = html.escape(event['text'])
+        if not text:
+            return
+        if len(self._pages[-1]) + len(text) + 1 > PAGE_LIMIT:
+            self._pages.append("")
+        self._pages[-1] += text + " "
+        if event.get('duration'):
+            self._progress = min(99, int(event['end'] / event['duration'] * 100))
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._render_loop())
+
+    async def _render_loop(self) -> None:
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            await self._render(header=f"📝 <b>Transkripsiya: {self._progress}%</b>\n---\n", wait=False)
+
+    async def _render(self, header: str, wait: bool) -> None:
+        """Brings every message up to date with its page; only the first one carries the header."""
+        for index, page in enumerate(self._pages):
+            text = (header if index == 0 else "") + page.strip()
+            if index < len(self._messages):
+                if wait:
+                    await status_updater.edit(self._messages[index], text, 'HTML')
+                else:
+                    status_updater.update(self._messages[index], text, 'HTML')
+                continue
+            try:
+                self._messages.append(await self._messages[-1].reply_text(text, parse_mode='HTML'))
+            except telegram_error.RetryAfter as e:
+                logger.warning(f"Transcript overflow message rate-limited, retrying in {e.retry_after}s.")
+                await asyncio.sleep(e.retry_after)
+                return await self._render(header, wait)
+
+    async def stop(self) -> None:
+        """Stops live updates without a final render (e.g. when the transcription failed)."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def finish(self, detected_lang: str) -> None:
+        """Stops live updates and renders the final transcript with the detected language."""
+        await self.stop()
+        header = (
+            f"\U0001F310 Aniqlangan til: <b>{html.escape(detected_lang)}</b>\n"
+            "✅ <b>Transkripsiya yakunlandi!</b>\n---\n"
+        )
+        await self._render(header=header, wait=True)
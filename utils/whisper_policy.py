@@ -0,0 +1,82 @@
+from dataclasses import dataclass
+
+from config import settings
+
+# Real-time factors (processing time / audio duration) of int8 CPU models with greedy decoding,
+# used for a tier until jobs of this deployment have measured it.
+DEFAULT_RTF = {
+    'tiny': 0.04, 'base': 0.08, 'small': 0.25, 'medium': 0.7,
+    'large-v1': 1.5, 'large-v2': 1.5, 'large-v3': 1.5, 'turbo': 0.6,
+}
+# Extra cost of every beam beyond the first, relative to greedy decoding.
+BEAM_COST = 0.2
+# Weight of the newest measurement in a tier's moving average.
+RTF_EWMA_ALPHA = 0.3
+
+
+@dataclass(frozen=True)
+class ModelChoice:
+    model: str
+    beam_size: int
+    # Expected processing time of the job in seconds, queue included.
+    estimated_seconds: float
+
+
+class ModelPolicy:
+    """
+    Picks the Whisper model and beam size of each job: the best tier (largest model, then widest
+    beam) whose estimated time fits the latency target, or the cheapest tier if none does.
+
+    estimate = audio duration × tier RTF / parallel workers × (1 + load), where load is the number
+    of transcriptions queued or running per worker. Each tier's RTF starts from a prior and then
+    follows a moving average of the measured jobs (`record`), so the choice tunes itself.
+    """
+
+    def __init__(self, models: list[str], beam_sizes: list[int], latency_target: float):
+        # Tiers from the cheapest to the best.
+        self.models = models
+        self.beam_sizes = sorted(set(beam_sizes))
+        self.latency_target = latency_target
+        self._rtf: dict[tuple[str, int], float] = {}
+
+    def rtf(self, model: str, beam_size: int) -> float:
+        """Current real-time factor estimate of a tier."""
+        measured = self._rtf.get((model, beam_size))
+        if measured is not None:
+            return measured
+        # Scale from another measured beam size of the same model, or else from the prior.
+        greedy = next(
+            (self._rtf[(model, beam)] / (1 + BEAM_COST * (beam - 1)) for beam in self.beam_sizes if (model, beam) in self._rtf),
+            DEFAULT_RTF.get(model, 1.0)
+        )
+        return greedy * (1 + BEAM_COST * (beam_size - 1))
+
+    def choose(self, duration: float | None, load: float, parallelism: int = 1) -> ModelChoice:
+        """Tier for `duration` seconds of audio (unknown counts as short) split over `parallelism` workers."""
+        def estimate(model: str, beam_size: int) -> float:
+            return (duration or 0) * self.rtf(model, beam_size) / parallelism * (1 + load)
+
+        for model in reversed(self.models):
+            for beam_size in reversed(self.beam_sizes):
+                seconds = estimate(model, beam_size)
+                if seconds <= self.latency_target:
+                    return ModelChoice(model, beam_size, seconds)
+        model, beam_size = self.models[0], self.beam_sizes[0]
+        return ModelChoice(model, beam_size, estimate(model, beam_size))
+
+    def record(self, model: str, beam_size: int, rtf: float) -> None:
+        """Adds a measured real-time factor of a tier to its moving average."""
+        previous = self._rtf.get((model, beam_size))
+        self._rtf[(model, beam_size)] = rtf if previous is None else previous + RTF_EWMA_ALPHA * (rtf - previous)
+
+    def seed(self, merged: dict) -> None:
+        """Starts unmeasured tiers from their mean RTF in the merged metrics of all processes."""
+        rtf = merged.get('vortex_whisper_real_time_factor')
+        for (model, beam_size), (counts, total) in (rtf['values'] if rtf else {}).items():
+            key = (model, int(beam_size))
+            if sum(counts) and key not in self._rtf:
+                self._rtf[key] = total / sum(counts)
+
+
+# --- Global Singleton Instance ---
+model_policy = ModelPolicy(settings.WHISPER_MODELS, settings.WHISPER_BEAM_SIZES, settings.WHISPER_LATENCY_TARGET)
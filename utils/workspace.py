@@ -0,0 +1,206 @@
+import os
+import sys
+import time
+import uuid
+import shutil
+import socket
+import asyncio
+from typing import Optional
+
+from config import settings, logger
+from database import db
+
+MB = 1024 * 1024
+# Reservations (and the janitor lease) of a process that stops renewing them expire after this many seconds.
+RESERVATION_LEASE = 60
+# How often a job waiting for disk space checks the reservations of the other processes again.
+RESERVATION_POLL_INTERVAL = 1.0
+
+
+class DiskQuotaExceeded(Exception):
+    """Raised when a job cannot get disk space within the wait timeout."""
+    pass
+
+
+class JobDir:
+    """A job's private working directory under the download path, with its disk space reservation."""
+
+    def __init__(self, workspace: 'Workspace', path: str, reserved: int):
+        self.workspace = workspace
+        self.path = path
+        self.reserved = reserved
+
+    async def shrink_reservation(self, size: float) -> None:
+        """Lowers the reservation once the job knows it needs less (e.g. after probing the file size)."""
+        if 0 <= size < self.reserved:
+            self.reserved = int(size)
+            await db.resize_disk_reservation(self.path, self.reserved)
+            await self.workspace._notify()
+
+    async def close(self) -> None:
+        """Removes the directory with everything in it, then releases the reservation."""
+        await asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, self.path, True)
+        self.workspace._active.discard(self.path)
+        self.reserved = 0
+        await db.release_disk_reservation(self.path)
+        await self.workspace._notify()
+
+
+class Workspace:
+    """
+    Owns the download directory.
+
+    Every job works in its own directory (`open`), so output paths are known up front and jobs
+    never see each other's files. Before a job starts, it reserves disk space: it waits while
+    the reservations would exceed the quota or eat into the minimum free space, and is
+    rejected if no space frees up in time. A background janitor removes directories and files
+    left behind by crashes once they are older than a maximum age.
+
+    All media worker processes using the directory on a host share it: reservations are leased
+    rows in the database, so the quota holds across processes, and a single janitor lease holder
+    sweeps the directory, skipping every process's active jobs.
+    """
+
+    def __init__(self, root: str, quota: int, min_free: int, wait_timeout: float, max_age: float, interval: float):
+        self.root = os.path.abspath(root)
+        self.jobs_root = os.path.join(self.root, 'jobs')
+        self.quota = quota
+        self.min_free = min_free
+        self.wait_timeout = wait_timeout
+        self.max_age = max_age
+        self.interval = interval
+        self.scope = f"{socket.gethostname()}:{self.root}"
+        # Size of the download directory as of this process's last janitor pass, excluding active jobs.
+        self._idle_usage = 0
+        self._active: set[str] = set()
+        self._space_freed = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def process(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    async def _try_reserve(self, path: str, size: int) -> bool:
+        room = shutil.disk_usage(self.root).free - self.min_free
+        return await db.reserve_disk(path, self.scope, self.process, size, room, self.quota or sys.maxsize, RESERVATION_LEASE)
+
+    async def open(self, kind: str, user_id: int, reserve: float) -> JobDir:
+        """
+        Creates a job directory once `reserve` bytes of disk space are available.
+        Raises DiskQuotaExceeded if that does not happen within the wait timeout.
+        """
+        reserve = int(reserve)
+        path = os.path.join(self.jobs_root, f"{kind}_{user_id}_{uuid.uuid4().hex[:12]}")
+        deadline = time.monotonic() + self.wait_timeout
+        waiting = False
+        while not await self._try_reserve(path, reserve):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DiskQuotaExceeded(f"No room for {reserve // MB} MB within {self.wait_timeout}s.")
+            if not waiting:
+                logger.warning(f"Waiting for disk space for a {kind} job of user {user_id} ({reserve // MB} MB).")
+                waiting = True
+            # Space freed in this process wakes the job at once; other processes are polled.
+            async with self._space_freed:
+                try:
+                    await asyncio.wait_for(self._space_freed.wait(), min(remaining, RESERVATION_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        os.makedirs(path)
+        self._active.add(path)
+        return JobDir(self, path, reserve)
+
+    async def _notify(self) -> None:
+        async with self._space_freed:
+            self._space_freed.notify_all()
+
+    def _sweep(self, active: set[str]) -> tuple[int, int]:
+        """Removes orphans older than the maximum age. Returns (removed entries, bytes still used)."""
+        removed, used = 0, 0
+        cutoff = time.time() - self.max_age
+        for directory in (self.jobs_root, self.root):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.path in active or entry.path == self.jobs_root:
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        size = sum(
+                            os.path.getsize(os.path.join(folder, name))
+                            for folder, _, names in os.walk(entry.path) for name in names
+                        )
+                    else:
+                        size = entry.stat().st_size
+                    if entry.stat().st_mtime < cutoff:
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                        else:
+                            os.remove(entry.path)
+                        removed += 1
+                    else:
+                        used += size
+                except OSError as e:
+                    logger.warning(f"Janitor could not inspect {entry.path}: {e}")
+        return removed, used
+
+    async def sweep(self) -> None:
+        """Runs one janitor pass off the event loop and shares the measured idle usage with the other processes."""
+        active = await db.get_active_disk_reservations(self.scope) | self._active
+        removed, self._idle_usage = await asyncio.get_running_loop().run_in_executor(None, self._sweep, active)
+        await db.set_disk_idle_usage(self.scope, self.process, self._idle_usage)
+        if removed:
+            logger.info(f"Janitor removed {removed} orphaned download(s); {self._idle_usage // MB} MB left outside active jobs.")
+        await self._notify()
+
+    async def _run(self) -> None:
+        """Keeps this process's reservations alive and, while holding the janitor lease, sweeps every interval."""
+        last_sweep = None
+        while True:
+            try:
+                await db.renew_disk_reservations(self.process, RESERVATION_LEASE)
+                if await db.claim_disk_janitor(self.scope, self.process, RESERVATION_LEASE):
+                    if last_sweep is None or time.monotonic() - last_sweep >= self.interval:
+                        last_sweep = time.monotonic()
+                        await self.sweep()
+                else:
+                    last_sweep = None
+            except Exception as e:
+                logger.error(f"Download janitor failed: {e}", exc_info=True)
+            await asyncio.sleep(RESERVATION_LEASE / 3)
+
+    def start(self) -> None:
+        """
+        Starts renewing reservations and the janitor (its first pass cleans up after a crash).
+        Must be called from the running event loop.
+        """
+        os.makedirs(self.jobs_root, exist_ok=True)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await db.release_process_disk(self.process)
+        except Exception as e:
+            logger.warning(f"Could not release the disk reservations of this process: {e}")
+
+
+# --- Global Singleton Instance ---
+# Other modules can `from utils.workspace import workspace` and run each job in `await workspace.open(...)`.
+workspace = Workspace(
+    root=settings.DOWNLOAD_PATH,
+    quota=settings.DOWNLOAD_QUOTA_MB * MB,
+    min_free=settings.MIN_FREE_DISK_MB * MB,
+    wait_timeout=settings.DISK_WAIT_TIMEOUT,
+    max_age=settings.ORPHAN_MAX_AGE_HOURS * 3600,
+    interval=settings.JANITOR_INTERVAL,
+)
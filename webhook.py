@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+from typing import Callable, Optional
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from config import settings, logger
+from utils.metrics_exporter import metrics_exporter
+from utils.process_supervisor import ProcessSupervisor, wait_for_stop_signal
+
+# Header Telegram (and the ingress, when forwarding) uses to prove an update is genuine.
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Path bot workers accept forwarded updates on.
+WORKER_PATH = '/update'
+
+
+def _check_secret(request: web.Request) -> bool:
+    return not settings.WEBHOOK_SECRET or request.headers.get(SECRET_HEADER) == settings.WEBHOOK_SECRET
+
+
+def routing_key(update: dict) -> int:
+    """
+    Returns the id updates are routed by: the sender's user id (or the chat id), so all updates
+    of one user reach the same bot process in order.
+    """
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        sender = value.get('from') or value.get('user') or value.get('chat') or (value.get('message') or {}).get('chat')
+        if sender and 'id' in sender:
+            return sender['id']
+    return update.get('update_id', 0)
+
+
+def pick_worker(update: dict, worker_count: int) -> int:
+    """Maps an update to one of `worker_count` workers with a stable hash of its routing key."""
+    digest = hashlib.blake2b(str(routing_key(update)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % worker_count
+
+
+async def _set_webhook(bot: Bot) -> None:
+    url = settings.WEBHOOK_URL.rstrip('/') + settings.WEBHOOK_PATH
+    await bot.set_webhook(url, secret_token=settings.WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+    logger.info(f"Webhook set to {url}.")
+
+
+# --- Bot worker: an Application fed by HTTP instead of polling ---
+
+async def serve_application(application: Application, host: str, port: int, path: str, set_webhook: bool) -> None:
+    """
+    Runs `application` with updates arriving as JSON POSTs on http://host:port/path, until SIGINT/SIGTERM.
+    Calls the application's post_init/post_shutdown hooks like run_polling would.
+    """
+    async def receive(request: web.Request) -> web.Response:
+        if not _check_secret(request):
+            return web.Response(status=403)
+        update = Update.de_json(await request.json(), application.bot)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, receive)
+    runner = web.AppRunner(app)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        if set_webhook:
+            await _set_webhook(application.bot)
+        logger.info(f"Accepting updates on http://{host}:{port}{path}.")
+        await wait_for_stop_signal()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+
+def run_worker(build_application: Callable[[], Application], port: int, host: str = '127.0.0.1') -> None:
+    """Entry point of a bot worker process: serves updates forwarded by the ingress on host:port."""
+    asyncio.run(serve_application(build_application(), host, port, WORKER_PATH, set_webhook=False))
+
+
+def _local_worker_main(port: int) -> None:
+    from bot import build_application
+    run_worker(build_application, port)
+
+
+# --- Ingress: receives Telegram's webhook calls and routes them to bot workers ---
+
+class Ingress:
+    """
+    The public webhook endpoint. Every update is forwarded to the bot worker chosen by
+    `pick_worker`; if that worker does not accept it, Telegram gets an error and retries later.
+    """
+
+    def __init__(self, worker_urls: list[str]):
+        self.worker_urls = worker_urls
+        self._session: Optional[ClientSession] = None
+
+    async def receive(self, request: web.Request) -> web.Response:
+        if not _check_secret(request):
+            return web.Response(status=403)
+        update = await request.json()
+        url = self.worker_urls[pick_worker(update, len(self.worker_urls))]
+        headers = {SECRET_HEADER: settings.WEBHOOK_SECRET} if settings.WEBHOOK_SECRET else {}
+        try:
+            async with self._session.post(url, json=update, headers=headers) as response:
+                if response.status == 200:
+                    return web.Response()
+                logger.warning(f"Bot worker {url} answered {response.status} for update {update.get('update_id')}.")
+        except (ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Bot worker {url} unreachable for update {update.get('update_id')}: {e}")
+        return web.Response(status=503)
+
+    async def serve(self) -> None:
+        self._session = ClientSession(timeout=ClientTimeout(total=10))
+        app = web.Application()
+        app.router.add_post(settings.WEBHOOK_PATH, self.receive)
+        runner = web.AppRunner(app)
+        try:
+            await runner.setup()
+            await web.TCPSite(runner, settings.WEBHOOK_LISTEN, settings.WEBHOOK_PORT).start()
+            async with _ingress_bot() as bot:
+                await _set_webhook(bot)
+            logger.info(
+                f"Webhook ingress listening on {settings.WEBHOOK_LISTEN}:{settings.WEBHOOK_PORT}, "
+                f"routing to {len(self.worker_urls)} bot worker(s)."
+            )
+            await wait_for_stop_signal()
+        finally:
+            await runner.cleanup()
+            await self._session.close()
+
+
+def _ingress_bot() -> Bot:
+    """A bot with the same token and Bot API server settings as the bot workers."""
+    from bot import application_builder
+
+    return application_builder().build().bot
+
+
+async def _run_ingress_with_workers() -> None:
+    worker_urls = settings.BOT_WORKER_URLS
+    supervisor = ProcessSupervisor()
+    if not worker_urls:
+        ports = [settings.BOT_WORKER_BASE_PORT + index for index in range(settings.BOT_PROCESSES)]
+        worker_urls = [f"http://127.0.0.1:{port}{WORKER_PATH}" for port in ports]
+        for port in ports:
+            supervisor.add(f'bot-worker-{port}', _local_worker_main, (port,))
+    # The bot workers only publish their metrics; the ingress serves them all.
+    await metrics_exporter.serve(settings.METRICS_HOST, settings.METRICS_PORT)
+    try:
+        await Ingress(worker_urls).serve()
+    finally:
+        await metrics_exporter.stop()
+        # SIGTERM lets every bot worker run its shutdown hooks (flush buffers, stop its process pools).
+        await asyncio.get_running_loop().run_in_executor(None, supervisor.stop)
+
+
+def run_webhook(build_application: Callable[[], Application]) -> None:
+    """
+    Runs the bot in webhook mode. With one local process the application serves the webhook
+    itself; otherwise this process becomes the ingress in front of several bot workers.
+    """
+    if settings.BOT_PROCESSES <= 1 and not settings.BOT_WORKER_URLS:
+        asyncio.run(serve_application(
+            build_application(), settings.WEBHOOK_LISTEN, settings.WEBHOOK_PORT, settings.WEBHOOK_PATH, set_webhook=True
+        ))
+    else:
+        asyncio.run(_run_ingress_with_workers())
+    logger.info("Webhook server stopped.")
@@ -0,0 +1,196 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import argparse
+from collections import defaultdict
+from typing import Optional
+from telegram import Bot
+
+from config import settings, logger, parse_job_workers
+from database import db
+from handlers import general, callbacks
+from transcriber_whisper import whisper_pool
+from utils.downloader import ytdlp_pool
+from utils.helpers import load_extractors
+from utils.job_queue import Job, job_queue
+from utils.metrics import job_seconds, active_jobs
+from utils.metrics_exporter import metrics_exporter
+from utils.song_search import song_search
+from utils.whisper_policy import model_policy
+from utils.workspace import workspace
+from utils.process_supervisor import ProcessSupervisor, wait_for_stop_signal
+
+# What a media worker runs for each job type.
+JOB_RUNNERS = {
+    'download': general.run_download_job,
+    'song': callbacks.run_song_job,
+    'transcribe': general.run_transcribe_job,
+}
+
+
+class MediaWorker:
+    """
+    Runs queued media jobs (yt-dlp, ffmpeg, Shazam, Whisper, uploads) away from the bot process.
+
+    `concurrency` maps the job types this worker takes to how many of each it runs at once, so
+    every type scales on its own: give it more slots, or start more workers (on this or other
+    machines). A running job's lease is renewed in the background; if the worker dies, the lease
+    runs out and another worker runs the job again. On SIGINT/SIGTERM running jobs are put back.
+    """
+
+    def __init__(self, concurrency: dict[str, int]):
+        unknown = set(concurrency) - set(JOB_RUNNERS)
+        if unknown:
+            raise ValueError(f"Unknown job type(s): {', '.join(sorted(unknown))}")
+        self.concurrency = concurrency
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._active: dict[str, int] = defaultdict(int)
+        self._tasks: set[asyncio.Task] = set()
+        self._slot_freed = asyncio.Event()
+
+    async def _keep_lease(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+            try:
+                if not await job_queue.renew(job, self.name):
+                    logger.warning(f"Lost the lease of job {job.id}; another worker may run it again.")
+            except Exception as e:
+                logger.warning(f"Could not renew the lease of job {job.id}: {e}")
+
+    async def _run_job(self, bot: Bot, job: Job) -> None:
+        logger.info(f"Worker {self.name} started job {job.id} ({job.kind}) of user {job.user_id}, run {job.attempts}.")
+        if job.attempts == 1:
+            job_seconds.observe(max(0.0, time.time() - job.created_at), kind=job.kind, phase='wait', outcome='ok')
+        active_jobs.inc(kind=job.kind)
+        started = time.monotonic()
+        outcome = 'error'
+        lease = asyncio.create_task(self._keep_lease(job))
+        try:
+            result = await JOB_RUNNERS[job.kind](bot, job)
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            await job_queue.requeue(job, self.name)
+            logger.info(f"Job {job.id} put back in the queue.")
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}", exc_info=True)
+            await job_queue.finish(job, self.name, error=f"{type(e).__name__}: {e}")
+        else:
+            outcome = 'ok'
+            await job_queue.finish(job, self.name, result=result)
+        finally:
+            lease.cancel()
+            job_seconds.observe(time.monotonic() - started, kind=job.kind, phase='run', outcome=outcome)
+            active_jobs.dec(kind=job.kind)
+            self._active[job.kind] -= 1
+            self._slot_freed.set()
+
+    async def _dispatch(self, bot: Bot) -> None:
+        """Claims jobs while this worker has free slots; polls the queue when it is empty."""
+        while True:
+            free = [kind for kind, limit in self.concurrency.items() if self._active[kind] < limit]
+            job = None
+            if free:
+                try:
+                    job = await job_queue.claim(free, self.name)
+                except Exception as e:
+                    logger.error(f"Could not claim a job: {e}", exc_info=True)
+            if job is None:
+                self._slot_freed.clear()
+                try:
+                    await asyncio.wait_for(self._slot_freed.wait(), settings.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._active[job.kind] += 1
+            task = asyncio.create_task(self._run_job(bot, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def run(self) -> None:
+        """Runs until SIGINT/SIGTERM."""
+        from bot import application_builder
+
+        # A bot like the frontend's (same Bot API server and connection pool), without polling.
+        bot = application_builder().build().bot
+        async with bot:
+            if 'transcribe' in self.concurrency:
+                await whisper_pool.start()
+            if {'download', 'song'} & set(self.concurrency) and settings.YTDLP_WORKERS > 0:
+                await ytdlp_pool.start()
+            if 'download' in self.concurrency:
+                # Download jobs key the result cache by yt-dlp's extractor match.
+                await load_extractors()
+            workspace.start()
+            metrics_exporter.start()
+            if 'transcribe' in self.concurrency:
+                # Whisper tiers start from the real-time factors other processes have measured so far.
+                try:
+                    model_policy.seed(await metrics_exporter.collect())
+                except Exception as e:
+                    logger.warning(f"Could not seed the Whisper tiering policy from metrics: {e}")
+            dispatcher = asyncio.create_task(self._dispatch(bot))
+            logger.info(f"Media worker {self.name} running {self.concurrency}.")
+            try:
+                await wait_for_stop_signal()
+            finally:
+                dispatcher.cancel()
+                for task in list(self._tasks):
+                    task.cancel()
+                await asyncio.gather(dispatcher, *self._tasks, return_exceptions=True)
+                await workspace.stop()
+                await metrics_exporter.stop()
+                await whisper_pool.shutdown()
+                await ytdlp_pool.shutdown()
+                song_search.shutdown()
+                await job_queue.close()
+                db.close()
+        logger.info(f"Media worker {self.name} stopped.")
+
+
+def run_worker(concurrency: dict[str, int]) -> None:
+    """Entry point of a media worker process."""
+    asyncio.run(MediaWorker(concurrency).run())
+
+
+# --- Embedded workers: media worker processes started and kept running by bot.py ---
+
+class EmbeddedWorkers:
+    """Starts one media worker process per JOB_WORKERS entry and restarts those that exit."""
+
+    def __init__(self, groups: list[dict[str, int]]):
+        self.groups = groups
+        self._supervisor = ProcessSupervisor()
+
+    def start(self) -> None:
+        if not self.groups:
+            return
+        for index, group in enumerate(self.groups):
+            self._supervisor.add(f'media-worker-{index}', run_worker, (group,))
+        logger.info(f"Started {len(self.groups)} media worker process(es): {self.groups}.")
+
+    def stop(self, timeout: Optional[float] = 30) -> None:
+        """Stops the workers with SIGTERM, so they put their running jobs back in the queue."""
+        self._supervisor.stop(timeout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="VortexFetchBot media worker")
+    parser.add_argument(
+        '--jobs',
+        help="job types and how many of each to run at once, e.g. download=3,song=2,transcribe=1 "
+             "(default: every type of JOB_WORKERS)"
+    )
+    args = parser.parse_args()
+    if args.jobs:
+        concurrency = parse_job_workers(args.jobs)[0]
+    else:
+        concurrency = {kind: count for group in settings.JOB_WORKERS for kind, count in group.items()}
+    settings.setup_environment()
+    run_worker(concurrency or {kind: 1 for kind in JOB_RUNNERS})
+
+
+if __name__ == '__main__':
+    main()